@@ -0,0 +1,215 @@
+""" Compile and runtime overheads of synthetic task graphs
+
+Builds chains, fan-outs, diamonds and random DAGs of the requested sizes and
+measures, for each backend,
+
+    construct_s        - running the @app specification (task decoration,
+                         ASTOps and port creation)
+    passes             - compile statistics of each registered PassManager
+                         pass. Memory allocated per pass is recorded with
+                         --trace-memory. Dot graph generation is only run
+                         with --dot
+    ir_bytes           - size of the serialized graph IR packaged for
+                         deployment (see graph_io)
+    ir_dump_s, ir_load_s
+                       - writing the serialized graph IR and loading it
+                         back. The loaded graph is the one which gets run
+    run_s              - running the compiled graph on the backend
+    dispatch_us        - run_s per executable unit. Tasks do next to no work
+                         so this is the framework overhead of dispatching a task
+
+Usage:
+    python bench_graphs.py --sizes 10,100,1000 --backends serial,hybrid \
+        --out graphs.json
+
+Graphs larger than --max-run-tasks are compiled but not run. Failures (e.g: a
+recursive pass running out of stack on long chains) are recorded in the
+results along with the phase they happened in instead of aborting the
+benchmark.
+"""
+
+import argparse
+import functools
+import gc
+import random
+import sys
+
+from common import Timer
+from common import error_entry
+from common import parse_list
+from common import quiet
+from common import scratch_dir
+from common import write_results
+
+from kisseru import app
+from kisseru import AppRunner
+from kisseru import task
+from graph_io import dumps_graph
+from graph_io import loads_graph
+
+
+@task()
+def source(seed) -> int:
+    return seed
+
+
+@task()
+def step(x) -> int:
+    return x + 1
+
+
+@task()
+def join(a, b) -> int:
+    return a + b
+
+
+@app()
+def chain(n):
+    x = source(0)
+    for _ in range(n - 1):
+        x = step(x)
+
+
+@app()
+def fan_out(n):
+    root = source(0)
+    for _ in range(n - 1):
+        step(root)
+
+
+@app()
+def diamonds(n):
+    # Each diamond adds two branches and a join
+    x = source(0)
+    for _ in range(max(1, (n - 1) // 3)):
+        x = join(step(x), step(x))
+
+
+@app()
+def random_dag(n, seed=42):
+    rng = random.Random(seed)
+    nodes = [source(0)]
+    while len(nodes) < n:
+        if len(nodes) > 1 and rng.random() < 0.5:
+            a, b = rng.sample(nodes, 2)
+            nodes.append(join(a, b))
+        else:
+            nodes.append(step(rng.choice(nodes)))
+
+
+SHAPES = {
+    'chain': chain,
+    'fan_out': fan_out,
+    'diamonds': diamonds,
+    'random_dag': random_dag,
+}
+
+BACKEND_OPTIONS = {
+    'hybrid': {
+        'default_executor': 'thread'
+    },
+}
+
+
+def compile_graph(runner, shape, n):
+    """ Compiles the shape with the runner's backend and compile options """
+
+    runner.app = functools.partial(SHAPES[shape], n)
+    graph = runner.compile()
+    stats = graph.compile_stats
+
+    passes = {}
+    for step in stats.steps[1:]:
+        passes[step.label] = step.to_dict()
+    return graph, stats.steps[0].wall_s, len(graph.tasks), passes
+
+
+def run_one(shape, n, backend, max_run_tasks, trace_memory, dot):
+    result = {'shape': shape, 'size': n, 'backend': backend}
+    options = dict(BACKEND_OPTIONS.get(backend, {}),
+                   trace_memory=trace_memory,
+                   dot=dot)
+
+    with quiet():
+        runner = AppRunner(SHAPES[shape], backend=backend, **options)
+        try:
+            graph, construct_s, n_tasks, passes = compile_graph(
+                runner, shape, n)
+        except BaseException as e:
+            result['failed_in'] = 'compile'
+            result['error'] = error_entry(e)
+            return result
+
+    result['tasks'] = n_tasks
+    result['units'] = graph.get_num_tasks()
+    result['construct_s'] = construct_s
+    result['compile_s'] = graph.compile_stats.total_s
+    result['passes'] = passes
+
+    try:
+        with Timer() as t:
+            data = dumps_graph(graph)
+        result['ir_dump_s'] = t.elapsed
+        result['ir_bytes'] = len(data)
+        with Timer() as t:
+            graph = loads_graph(data)
+        result['ir_load_s'] = t.elapsed
+    except BaseException as e:
+        result['failed_in'] = 'serialize'
+        result['error'] = error_entry(e)
+        return result
+
+    if n_tasks > max_run_tasks:
+        return result
+
+    with quiet():
+        try:
+            with Timer() as t:
+                runner.backend.run_flow(graph)
+            result['run_s'] = t.elapsed
+            result['dispatch_us'] = t.elapsed * 1e6 / max(1, result['units'])
+        except BaseException as e:
+            result['failed_in'] = 'run'
+            result['error'] = error_entry(e)
+        finally:
+            runner.backend.cleanup(graph)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks compile and runtime overheads of synthetic "
+        "task graphs")
+    parser.add_argument('--shapes', default=",".join(SHAPES))
+    parser.add_argument('--sizes', default="10,100,1000,10000")
+    parser.add_argument('--backends', default="serial,hybrid")
+    parser.add_argument('--max-run-tasks', type=int, default=10000)
+    parser.add_argument('--trace-memory', action='store_true')
+    parser.add_argument('--dot', action='store_true')
+    parser.add_argument('--out', default="bench_graphs.json")
+    args = parser.parse_args()
+
+    results = []
+    with scratch_dir():
+        for shape in parse_list(args.shapes):
+            if shape not in SHAPES:
+                raise Exception("Unknown shape {}. Expected one of {}".format(
+                    shape, ", ".join(SHAPES)))
+            for n in parse_list(args.sizes, int):
+                for backend in parse_list(args.backends):
+                    result = run_one(shape, n, backend, args.max_run_tasks,
+                                     args.trace_memory, args.dot)
+                    results.append(result)
+                    sys.stderr.write("{shape:>10} {size:>7} {backend:>7} : "
+                                     "{0}\n".format(
+                                         result.get('error', "{:.3f}s".format(
+                                             result.get('compile_s', 0) +
+                                             result.get('run_s', 0))),
+                                         **result))
+                    gc.collect()
+
+    write_results("graphs", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
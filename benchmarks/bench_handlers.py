@@ -0,0 +1,120 @@
+""" Per call overhead of task runners with handlers on and off
+
+Calls the runner of a trivial task function in a tight loop with different
+handler selections and reports the time per call over a plain call of the
+function. Covers
+
+    none     - @task(handlers=False) or handlers=False for the run
+    profile  - only the profiler
+    trace    - only the tracer, which formats the arguments and the result
+    all      - every registered handler (the default)
+
+Tracer output goes to a log file in a scratch directory and stdout is
+swallowed while measuring.
+
+Usage:
+    python bench_handlers.py --calls 100000 --out handlers.json
+"""
+
+import argparse
+import inspect
+import os
+import sys
+
+from common import Timer
+from common import error_entry
+from common import parse_list
+from common import quiet
+from common import scratch_dir
+from common import write_results
+
+# Registers the tracer and profiler handlers
+import kisseru
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from logger import TaskLogger
+from tasks import gen_runner
+
+SELECTIONS = {
+    'none': False,
+    'profile': 'profile',
+    'trace': 'trace',
+    'all': True,
+}
+
+
+def work(x, y) -> int:
+    return x + y
+
+
+def bench_plain(calls):
+    with Timer() as t:
+        for i in range(calls):
+            work(x=i, y=1)
+    return t.elapsed
+
+
+def bench_runner(selection, calls):
+    result = {'handlers': selection}
+    runner = gen_runner(work, inspect.signature(work), SELECTIONS[selection])
+    try:
+        with quiet():
+            with Timer() as t:
+                for i in range(calls):
+                    runner(x=i, y=1)
+    except BaseException as e:
+        result['error'] = error_entry(e)
+        return result
+    result['elapsed_s'] = t.elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks per call overhead of task runners")
+    parser.add_argument('--handlers', default=",".join(SELECTIONS))
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--out', default="bench_handlers.json")
+    args = parser.parse_args()
+
+    results = []
+    with scratch_dir():
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+        Backend.get_current_backend().logger = TaskLogger("bench.log")
+
+        plain = bench_plain(args.calls)
+        results.append({'handlers': 'plain', 'calls': args.calls,
+                        'benchmark': 'handlers', 'elapsed_s': plain,
+                        'us_per_call': plain * 1e6 / args.calls,
+                        'overhead_us': 0.0})
+        sys.stderr.write("{:>8} : {:.3f} us/call\n".format(
+            'plain', plain * 1e6 / args.calls))
+
+        for selection in parse_list(args.handlers):
+            if selection not in SELECTIONS:
+                raise Exception("Unknown handler selection {}. Expected one "
+                                "of {}".format(selection,
+                                               ", ".join(SELECTIONS)))
+            result = bench_runner(selection, args.calls)
+            result['calls'] = args.calls
+            result['benchmark'] = 'handlers'
+            if 'error' not in result:
+                result['us_per_call'] = result['elapsed_s'] * 1e6 / args.calls
+                result['overhead_us'] = (result['elapsed_s'] - plain) * \
+                    1e6 / args.calls
+            results.append(result)
+            sys.stderr.write("{:>8} : {}\n".format(
+                selection, result.get(
+                    'error', "{:.3f} us/call (+{:.3f})".format(
+                        result.get('us_per_call', 0),
+                        result.get('overhead_us', 0)))))
+
+        Backend.get_current_backend().logger.flush()
+
+    write_results("handlers", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+""" Cold start time of kisseru
+
+Each measurement runs in a freshly started python interpreter, the way each
+Slurm job driver and each spawned worker starts. Covers
+
+    import_s     - import kisseru
+    cold_start_s - import kisseru, compile and run a single trivial task on
+                   the backend from interpreter start up to the task's result
+    wall_s       - the same as seen by the parent, including interpreter start
+                   up and shut down
+    modules      - modules taking the longest to import (cumulative, in
+                   seconds) as reported by python -X importtime
+
+Usage:
+    python bench_import.py --runs 10 --backends serial,hybrid \
+        --out import.json
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from common import Timer
+from common import parse_list
+from common import scratch_dir
+from common import write_results
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import kisseru
+print("IMPORT_S", time.perf_counter() - start)
+"""
+
+COLD_START_SCRIPT = """
+import time
+start = time.perf_counter()
+from kisseru import *
+
+
+@task()
+def trivial(x) -> int:
+    return x + 1
+
+
+@app()
+def cold_start():
+    trivial(1)
+
+
+AppRunner(cold_start, backend="{backend}").run()
+print("COLD_START_S", time.perf_counter() - start)
+"""
+
+
+def run_script(script, *flags):
+    # Task sources need to be on disk for ASTOps to parse them
+    with open("bench_script.py", 'w') as fp:
+        fp.write(script)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT_DIR] + [p for p in [env.get('PYTHONPATH', None)] if p])
+    with Timer() as t:
+        p = subprocess.run(
+            [sys.executable] + list(flags) + ["bench_script.py"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, env=env)
+    if p.returncode:
+        raise Exception("Benchmark script failed with {}".format(
+            p.stderr.strip().splitlines()[-1:]))
+    return p, t.elapsed
+
+
+def reported(p, key):
+    for line in p.stdout.splitlines():
+        if line.startswith(key):
+            return float(line.split()[1])
+    raise Exception("{} was not reported".format(key))
+
+
+def slowest_modules(top):
+    p, _ = run_script(IMPORT_SCRIPT, "-X", "importtime")
+    modules = []
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        modules.append((fields[2].strip(), int(fields[1]) / 1e6))
+    modules.sort(key=lambda module: -module[1])
+    return modules[:top]
+
+
+def summarize(samples):
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the cold start time of kisseru")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--backends', default="serial,hybrid")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--out', default="bench_import.json")
+    args = parser.parse_args()
+
+    results = []
+    with scratch_dir():
+        samples = [reported(run_script(IMPORT_SCRIPT)[0], "IMPORT_S")
+                   for _ in range(args.runs)]
+        results.append({
+            'measure': 'import',
+            'import_s': summarize(samples),
+            'modules': slowest_modules(args.top),
+        })
+        sys.stderr.write("{:>14} : {:.1f}ms\n".format(
+            "import", results[-1]['import_s']['median'] * 1e3))
+
+        for backend in parse_list(args.backends):
+            cold_start = []
+            wall = []
+            for _ in range(args.runs):
+                p, elapsed = run_script(
+                    COLD_START_SCRIPT.format(backend=backend))
+                cold_start.append(reported(p, "COLD_START_S"))
+                wall.append(elapsed)
+            results.append({
+                'measure': 'cold_start',
+                'backend': backend,
+                'cold_start_s': summarize(cold_start),
+                'wall_s': summarize(wall),
+            })
+            sys.stderr.write("{:>14} : {:.1f}ms ({:.1f}ms wall)\n".format(
+                backend, results[-1]['cold_start_s']['median'] * 1e3,
+                results[-1]['wall_s']['median'] * 1e3))
+
+    write_results("import", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
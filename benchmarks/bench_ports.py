@@ -0,0 +1,215 @@
+""" Transfer throughput of the backend ports and slurm job submission
+
+Port benchmark sends payloads of the given sizes over an edge between two
+tasks and measures the time until the value is available at the receiving
+task. Covers
+
+    LocalPort          - in memory hand off used by the serial backend
+    LocalThreadedPort  - pickled files used by the local threaded backend
+    SlurmPort          - pickled files polled for by the slurm backend
+
+Submission benchmark packages a chain graph for slurm and runs the generated
+run.sh against a fake 'sbatch' which only records the submission. This is the
+per-job overhead of the generated batch script itself.
+
+Usage:
+    python bench_ports.py --sizes 1024,1048576 --jobs 10,100 --out ports.json
+"""
+
+import argparse
+import inspect
+import os
+import pickle
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+
+from common import Timer
+from common import error_entry
+from common import parse_list
+from common import quiet
+from common import scratch_dir
+from common import write_results
+
+from kisseru import AppRunner
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from tasks import gen_task
+from tasks import TaskGraph
+from bench_graphs import compile_graph
+from bench_graphs import SHAPES
+
+PORTS = {
+    'LocalPort': BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"),
+    'LocalThreadedPort': BackendConfig(BackendType.LOCAL, "Local Threaded"),
+    'SlurmPort': BackendConfig(BackendType.SLURM, "Slurm"),
+}
+
+FAKE_SBATCH = """#! /bin/bash
+# Stands in for slurm's sbatch. Records the submission and hands out a job id
+echo "$@" >> "$(dirname "$0")/submissions"
+echo $$
+"""
+
+
+def produce() -> bytes:
+    pass
+
+
+def consume(data):
+    pass
+
+
+def make_payload(kind, n_bytes):
+    if kind == 'bytes':
+        return os.urandom(n_bytes)
+    elif kind == 'list':
+        # Roughly n_bytes once pickled. Exercises pickling of many objects
+        return list(range(n_bytes // 5))
+    raise Exception("Unknown payload kind {}".format(kind))
+
+
+def make_edge(port):
+    Backend.set_current_backend(PORTS[port])
+    graph = TaskGraph()
+    graph.reset()
+
+    producer, _ = gen_task(produce, inspect.signature(produce), (), {})
+    graph.add_task(producer)
+    consumer, _ = gen_task(consume, inspect.signature(consume), (producer, ),
+                           {})
+    graph.add_task(consumer)
+
+    # Keep the consumer from ever getting triggered. Only the transfer is
+    # being measured here.
+    consumer._latch.value = 1 << 30
+    return producer.edges[0]
+
+
+def bench_port(port, kind, n_bytes, repeat):
+    result = {'port': port, 'payload': kind, 'size': n_bytes}
+    value = make_payload(kind, n_bytes)
+    result['pickled_bytes'] = len(pickle.dumps(value))
+
+    edge = make_edge(port)
+    inport = edge.dest
+    try:
+        with Timer() as t:
+            for _ in range(repeat):
+                edge.send(value)
+                if not inport.is_one_sided_receive:
+                    inport.receive()
+        if inport.task_ref._args[inport.name] != value:
+            raise Exception("Transferred value doesn't match")
+    except BaseException as e:
+        result['error'] = error_entry(e)
+        return result
+
+    result['repeat'] = repeat
+    result['transfer_us'] = t.elapsed * 1e6 / repeat
+    result['mb_per_s'] = result['pickled_bytes'] * repeat / t.elapsed / 2**20
+    return result
+
+
+def install_fake_sbatch(bin_dir):
+    os.makedirs(bin_dir)
+    path = os.path.join(bin_dir, "sbatch")
+    with open(path, "w") as fp:
+        fp.write(FAKE_SBATCH)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return os.path.join(bin_dir, "submissions")
+
+
+def bench_submission(shape, n):
+    result = {'shape': shape, 'size': n}
+    cwd = os.getcwd()
+    app_dir = os.path.join(cwd, "app_{}_{}".format(shape, n))
+    os.makedirs(app_dir)
+    artifact = os.path.join(cwd, "{}_{}.tar.gz".format(shape, n))
+
+    try:
+        with quiet():
+            runner = AppRunner(SHAPES[shape], backend="slurm")
+            graph, _, n_tasks, _ = compile_graph(runner, shape, n)
+            with Timer() as t:
+                runner.backend.package(graph, app_dir, artifact)
+            # Staging directory left behind by package
+            shutil.rmtree("/tmp/.kisseru_" + graph.name, ignore_errors=True)
+        result['tasks'] = n_tasks
+        result['package_s'] = t.elapsed
+
+        job_dir = os.path.join(cwd, "job_{}_{}".format(shape, n))
+        with tarfile.open(artifact) as tar:
+            tar.extractall(job_dir)
+        job_dir = os.path.join(job_dir, graph.name)
+        submissions = install_fake_sbatch(os.path.join(cwd, "bin_{}_{}".format(
+            shape, n)))
+
+        environ = dict(os.environ)
+        environ['PATH'] = os.path.dirname(submissions) + os.pathsep + \
+            environ.get('PATH', '')
+        with Timer() as t:
+            subprocess.check_call(["bash", "run.sh"],
+                                  cwd=job_dir,
+                                  env=environ,
+                                  stdout=subprocess.DEVNULL)
+        with open(submissions) as fp:
+            jobs = len(fp.readlines())
+    except BaseException as e:
+        result['error'] = error_entry(e)
+        return result
+
+    result['jobs'] = jobs
+    result['submit_s'] = t.elapsed
+    result['submit_us_per_job'] = t.elapsed * 1e6 / max(1, jobs)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks port transfer throughput and slurm job "
+        "submission")
+    parser.add_argument('--ports', default=",".join(PORTS))
+    parser.add_argument('--payloads', default="bytes,list")
+    parser.add_argument('--sizes', default="1024,1048576,16777216")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--shapes', default="chain,fan_out")
+    parser.add_argument('--jobs', default="10,100")
+    parser.add_argument('--out', default="bench_ports.json")
+    args = parser.parse_args()
+
+    results = []
+    with scratch_dir():
+        for port in parse_list(args.ports):
+            if port not in PORTS:
+                raise Exception("Unknown port {}. Expected one of {}".format(
+                    port, ", ".join(PORTS)))
+            for kind in parse_list(args.payloads):
+                for n_bytes in parse_list(args.sizes, int):
+                    result = bench_port(port, kind, n_bytes, args.repeat)
+                    result['benchmark'] = 'transfer'
+                    results.append(result)
+                    sys.stderr.write("{port:>17} {payload:>5} {size:>9} : "
+                                     "{0}\n".format(
+                                         result.get('error', "{:.1f} MB/s".format(
+                                             result.get('mb_per_s', 0))),
+                                         **result))
+
+        for shape in parse_list(args.shapes):
+            for n in parse_list(args.jobs, int):
+                result = bench_submission(shape, n)
+                result['benchmark'] = 'slurm_submit'
+                results.append(result)
+                sys.stderr.write("{:>17} {:>5} {:>9} : {}\n".format(
+                    "sbatch", shape, n,
+                    result.get('error', "{:.1f} us/job".format(
+                        result.get('submit_us_per_job', 0)))))
+
+    write_results("ports", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+""" Throughput of the transfer serializers per payload type
+
+Writes payloads of the given sizes to a transfer file and reads them back,
+once through the serializer the registry picks for the payload and once
+through plain pickle at its default protocol (what the file based ports did
+before the registry). Payloads whose libraries are not installed are
+reported as errors.
+
+    str        - text
+    bytes      - random bytes
+    list       - list of ints, exercising pickling of many objects
+    ndarray    - numpy float64 array
+    DataFrame  - pandas frame of a float, an int and a string column
+
+Usage:
+    python bench_serializers.py --sizes 1048576,16777216 --out ser.json
+"""
+
+import argparse
+import os
+import pickle
+import sys
+
+from common import Timer
+from common import error_entry
+from common import parse_list
+from common import scratch_dir
+from common import write_results
+
+# Puts the framework modules on the import path
+import kisseru
+from transfer import SerializerRegistry
+from transfer import dump
+from transfer import load
+
+
+def make_payload(kind, n_bytes):
+    if kind == 'str':
+        return "kisseru " * (n_bytes // 8)
+    elif kind == 'bytes':
+        return os.urandom(n_bytes)
+    elif kind == 'list':
+        return list(range(n_bytes // 5))
+    elif kind == 'ndarray':
+        import numpy
+        return numpy.random.random(n_bytes // 8)
+    elif kind == 'DataFrame':
+        import numpy
+        import pandas
+        rows = n_bytes // 24
+        return pandas.DataFrame({
+            'value': numpy.random.random(rows),
+            'count': numpy.arange(rows),
+            'label': ["row{}".format(i % 1000) for i in range(rows)],
+        })
+    raise Exception("Unknown payload kind {}".format(kind))
+
+
+def same(a, b):
+    if hasattr(a, 'equals'):
+        return a.equals(b)
+    if hasattr(a, 'shape'):
+        return (a == b).all()
+    return a == b
+
+
+def pickle_dump(value, fp):
+    pickle.dump(value, fp)
+
+
+def bench(kind, value, method, repeat):
+    result = {'payload': kind, 'method': method}
+    if method == 'registry':
+        write, read = dump, load
+        result['serializer'] = SerializerRegistry.lookup(value).name
+    else:
+        write, read = pickle_dump, pickle.load
+
+    try:
+        with Timer() as t_write:
+            for _ in range(repeat):
+                with open("transfer", 'wb') as fp:
+                    write(value, fp)
+        result['file_bytes'] = os.path.getsize("transfer")
+        with Timer() as t_read:
+            for _ in range(repeat):
+                with open("transfer", 'rb') as fp:
+                    received = read(fp)
+        if not same(value, received):
+            raise Exception("Transferred value doesn't match")
+    except BaseException as e:
+        result['error'] = error_entry(e)
+        return result
+
+    mb = result['file_bytes'] * repeat / 2.0**20
+    result['repeat'] = repeat
+    result['write_mb_per_s'] = mb / t_write.elapsed
+    result['read_mb_per_s'] = mb / t_read.elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks transfer serializers per payload type")
+    parser.add_argument('--payloads', default="str,bytes,list,ndarray,"
+                        "DataFrame")
+    parser.add_argument('--sizes', default="1048576,16777216")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--out', default="bench_serializers.json")
+    args = parser.parse_args()
+
+    results = []
+    with scratch_dir():
+        for kind in parse_list(args.payloads):
+            for n_bytes in parse_list(args.sizes, int):
+                try:
+                    value = make_payload(kind, n_bytes)
+                except ImportError as e:
+                    results.append({'payload': kind, 'size': n_bytes,
+                                    'benchmark': 'serializer',
+                                    'error': error_entry(e)})
+                    sys.stderr.write("{:>9} {:>9} : {}\n".format(
+                        kind, n_bytes, error_entry(e)))
+                    continue
+
+                for method in ('pickle', 'registry'):
+                    result = bench(kind, value, method, args.repeat)
+                    result['size'] = n_bytes
+                    result['benchmark'] = 'serializer'
+                    results.append(result)
+                    sys.stderr.write("{:>9} {:>9} {:>8} : {}\n".format(
+                        kind, n_bytes, method, result.get(
+                            'error', "write {:.1f} MB/s read {:.1f} "
+                            "MB/s".format(result.get('write_mb_per_s', 0),
+                                          result.get('read_mb_per_s', 0)))))
+
+    write_results("serializers", results, args.out)
+
+
+if __name__ == "__main__":
+    main()
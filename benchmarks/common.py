@@ -0,0 +1,93 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# append parent directory to import path
+import env
+
+
+class Timer(object):
+    """ Wall clock timer usable as a context manager
+
+    Attributes:
+        elapsed: Seconds spent within the last 'with' block
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self._start
+        return False
+
+
+@contextlib.contextmanager
+def quiet():
+    """ Swallows anything the framework prints while being measured """
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    """ Runs the block within a temporary working directory
+
+    Tasks leave generated sources, logs and transfer files in the working
+    directory. These shouldn't pile up in the caller's directory.
+    """
+
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp(prefix="kisseru_bench_")
+    os.chdir(tmp_dir)
+    try:
+        yield tmp_dir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(',') if v]
+
+
+def error_entry(e):
+    return "{}: {}".format(type(e).__name__, e)
+
+
+def write_results(benchmark, results, out_file):
+    """ Writes benchmark results as JSON so that runs can be compared
+
+    Args:
+        benchmark: Name of the benchmark
+        results: List of result dictionaries
+        out_file: File to write to. '-' writes to stdout
+    """
+
+    report = {
+        'benchmark': benchmark,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'argv': sys.argv[1:],
+        'results': results,
+    }
+
+    if out_file == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(out_file, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print("Wrote {} results to {}".format(len(results), out_file))
@@ -59,5 +59,6 @@ def cluster_app():
     return plot
 
 if __name__ == "__main__":
-    ar = AppRunner(cluster_app)
+    # Also write out the dot graphs of the pipeline for png.sh
+    ar = AppRunner(cluster_app, dot=True)
     ar.run()
@@ -0,0 +1,188 @@
+import platform
+import resource
+import threading
+import time
+
+from cprofiler import take_profiles
+
+# Counters taken from getrusage as (field, rusage attribute)
+RUSAGE_FIELDS = (
+    ('cpu_user_s', 'ru_utime'),
+    ('cpu_sys_s', 'ru_stime'),
+    ('vol_ctx_switches', 'ru_nvcsw'),
+    ('invol_ctx_switches', 'ru_nivcsw'),
+)
+
+# Counters taken from /proc/<pid>/io as (field, io entry). rchar and wchar
+# count all the bytes read and written through system calls, including the
+# ones served from the page cache and those going through pipes.
+PROC_IO_FIELDS = (
+    ('read_bytes', 'rchar'),
+    ('write_bytes', 'wchar'),
+)
+
+# Bytes a task received and sent serialized (e.g: transfer files read and
+# written by its ports, values pulled from other workers or pickled results
+# crossing a process boundary)
+PORT_FIELDS = ('bytes_in', 'bytes_out')
+
+# Fields which add up across executions. Anything else (i.e: peak_rss) is a
+# high water mark.
+ADDITIVE_FIELDS = tuple(field for field, _ in RUSAGE_FIELDS) + \
+    tuple(field for field, _ in PROC_IO_FIELDS) + PORT_FIELDS + ('duration', )
+
+FIELDS = ADDITIVE_FIELDS + ('peak_rss', 'started_at')
+
+# Usage of an execution may carry the cProfile captures of the tasks it ran
+# (see CProfileExit) as a list under this field
+PROFILE_FIELD = 'profile'
+
+_RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', None)
+
+# Serialized port bytes not yet accounted for, keyed by task id. Forked
+# workers inherit the counts of the inputs their parent read on their behalf.
+_port_bytes = {}
+_port_lock = threading.Lock()
+
+
+def count_port_bytes(task, field, n_bytes):
+    """ Accounts serialized bytes received ('bytes_in') or sent ('bytes_out')
+    through a port of the task
+    """
+
+    with _port_lock:
+        counts = _port_bytes.setdefault(task.id, {})
+        counts[field] = counts.get(field, 0) + n_bytes
+
+
+def take_port_bytes(task):
+    """ Port bytes counted for the task (and the members of a fused task)
+    since they were last taken
+    """
+
+    taken = {}
+    with _port_lock:
+        for member in [task] + list(getattr(task, 'tasks', [])):
+            merge(taken, _port_bytes.pop(member.id, {}))
+    return taken
+
+
+def max_rss():
+    """ Peak resident memory of the process in bytes """
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on OS X
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if platform.system() == "Darwin" else max_rss * 1024
+
+
+def _proc_io(per_thread):
+    path = "/proc/thread-self/io" if per_thread else "/proc/self/io"
+    try:
+        with open(path) as fp:
+            entries = dict(line.split(':', 1) for line in fp)
+    except (OSError, ValueError):
+        # Not on Linux or /proc is not mounted
+        return {}
+    return {
+        field: int(entries[entry])
+        for field, entry in PROC_IO_FIELDS if entry in entries
+    }
+
+
+def snapshot(per_thread=False):
+    """ Current resource counters of the process or of the calling thread
+
+    Thread counters are only available on Linux. Elsewhere the process
+    counters are taken instead. Peak RSS is always that of the process.
+    """
+
+    who = resource.RUSAGE_SELF
+    if per_thread and _RUSAGE_THREAD is not None:
+        who = _RUSAGE_THREAD
+    else:
+        per_thread = False
+
+    usage = resource.getrusage(who)
+    counters = {field: getattr(usage, attr) for field, attr in RUSAGE_FIELDS}
+    counters.update(_proc_io(per_thread))
+    counters['peak_rss'] = max_rss()
+    counters['duration'] = time.perf_counter()
+    return counters
+
+
+def merge(total, usage):
+    """ Adds the usage of an execution to the total in place """
+
+    for field, value in usage.items():
+        if field in ADDITIVE_FIELDS:
+            total[field] = total.get(field, 0) + value
+        elif field == 'peak_rss':
+            total[field] = max(total.get(field, 0), value)
+        elif field == 'started_at':
+            total[field] = min(total.get(field, value), value)
+        elif field == PROFILE_FIELD:
+            total[field] = total.get(field, []) + value
+    return total
+
+
+class ResourceMeter(object):
+    """ Measures the resources used by a task execution
+
+    Used as a context manager around the execution. Once done 'usage' holds
+    user and system CPU seconds, context switches, bytes read and written,
+    the peak resident memory added by the execution (peak_rss), the wall
+    clock seconds it took (duration) and the epoch time it started at
+    (started_at). If the execution ran with the 'cprofile' handler enabled,
+    'profile' has the captures taken on the metered thread.
+
+    Executions sharing a process with others (e.g: thread executors) should be
+    metered per thread so that their CPU time, context switches and I/O are
+    not mixed with those of their peers. Peak RSS is a process wide high water
+    mark though. So for them it is only the growth of the process peak seen
+    while the execution ran.
+
+    Attributes:
+        per_thread: Whether only the calling thread gets metered
+        usage: Resources used by the execution. Empty until it is done
+    """
+
+    def __init__(self, per_thread=False):
+        self.per_thread = per_thread
+        self.usage = {}
+        self._start = None
+        self._started_at = None
+
+    def start(self):
+        # Drop captures left behind by unmetered calls on this thread
+        take_profiles()
+        self._started_at = time.time()
+        self._start = snapshot(self.per_thread)
+
+    def stop(self):
+        end = snapshot(self.per_thread)
+        self.usage = {
+            field: end[field] - value
+            for field, value in self._start.items() if field in end
+        }
+        self.usage['peak_rss'] = max(0, self.usage['peak_rss'])
+        self.usage['started_at'] = self._started_at
+        profiles = take_profiles()
+        if profiles:
+            self.usage[PROFILE_FIELD] = profiles
+        return self.usage
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def metered(fn, kwargs, usage, per_thread=True):
+    """ Calls fn with the kwargs updating usage with what the call used """
+
+    with ResourceMeter(per_thread) as meter:
+        ret = fn(**kwargs)
+    usage.update(meter.usage)
+    return ret
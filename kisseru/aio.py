@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from accounting import ResourceMeter
+from tasks import FusedTask
+from tasks import MapTask
+from tasks import run_sync
+from backend import Backend
+from local import LocalPort
+from logger import TaskLogger
+from metrics import RunMetrics
+
+log = logging.getLogger(__name__)
+
+
+def _call_sync(runner, kwargs, usage):
+    # Generator tasks get collected in to a list off the event loop
+    with ResourceMeter(per_thread=True) as meter:
+        ret = run_sync(runner(**kwargs))
+    usage.update(meter.usage)
+    return ret
+
+
+@Backend.register_backend
+class AsyncBackend(Backend):
+    """ Runs the task graph on a single asyncio event loop.
+
+    Coroutine tasks (i.e: tasks defined with 'async def') are run directly on
+    the event loop. Any subprocess they spawn (including inlined bash scripts)
+    or any network I/O they do is awaited on the loop, so that hundreds of such
+    tasks can be in flight at once within a single process. Plain (blocking)
+    tasks are delegated to an executor so that they do not stall the loop.
+
+    All data flow happens in memory with local ports since every task lives
+    within the same process.
+
+    Blocking tasks get their resource usage metered on the executor thread
+    running them. Coroutine tasks interleave on the loop thread, so only their
+    durations are recorded. So are those of map tasks. The run metrics get
+    written to the 'metrics_file' option if given.
+
+    Attributes:
+        loop: Event loop the graph is run on
+        executor: Executor which runs the blocking tasks
+        pending: asyncio tasks for graph tasks currently in flight
+        metrics: RunMetrics of the current run
+    """
+
+    name = "ASYNC"
+
+    def __init__(self, backend_config):
+        Backend.__init__(self, backend_config)
+        self.logger = None
+        self.loop = None
+        self.executor = None
+        self.pending = set()
+        self.metrics = None
+
+    def get_port(self, typ, name, index, task):
+        return LocalPort(typ, name, index, task)
+
+    def package(self):
+        pass
+
+    def deploy(self):
+        pass
+
+    def run_task(self, task):
+        # Ports call back in to the backend from within the event loop thread
+        # once a task has all of its inputs. Just schedule the task on the
+        # loop.
+        future = self.loop.create_task(self._run_task(task))
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+
+    async def _run_map(self, task, args):
+        # Elements run concurrently. Coroutine elements on the loop and the
+        # rest on the thread pool.
+        kwargs = dict(args)
+        items = kwargs.pop(task.map_param)
+        if inspect.iscoroutinefunction(task._element_runner):
+            pending = [task._element_runner(**task.element_args(item, kwargs))
+                       for item in items]
+        else:
+            pending = [self.loop.run_in_executor(
+                self.executor, task.run_element, item, kwargs)
+                       for item in items]
+        return list(await asyncio.gather(*pending))
+
+    async def _run_task(self, task):
+        # A fused task without a generated runner runs its head on behalf of
+        # the fused region. Rest of the region gets pushed through the head's
+        # local ports.
+        runnable = task
+        if isinstance(task, FusedTask) and task._runner is None:
+            runnable = task.head
+
+        start = time.perf_counter()
+        usage = {}
+        if isinstance(runnable, MapTask):
+            ret = await self._run_map(runnable, task._args)
+        elif inspect.iscoroutinefunction(runnable._runner):
+            ret = await runnable._runner(**task._args)
+        else:
+            ret = await self.loop.run_in_executor(
+                self.executor, functools.partial(_call_sync, runnable._runner,
+                                                 task._args, usage))
+        if not usage:
+            usage['duration'] = time.perf_counter() - start
+        self.metrics.record_usage(task, usage)
+
+        task.release_inputs()
+        runnable.send(ret)
+        if runnable is task:
+            task.graph.mark_completed(task.id)
+
+    async def _run_flow(self, graph):
+        for tid, source in graph.sources.items():
+            self.run_task(source)
+
+        # Tasks keep scheduling their children as they complete. We are done
+        # when there is nothing left in flight.
+        while self.pending:
+            done, _ = await asyncio.wait(
+                list(self.pending), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                # Surface any internal errors raised while running the task
+                future.result()
+
+    def run_flow(self, graph):
+        self.logger = TaskLogger("{}.log".format(graph.name))
+        self.metrics = RunMetrics(graph.name, self.name)
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.options.get('max_workers', None))
+        try:
+            self.loop.run_until_complete(self._run_flow(graph))
+        finally:
+            self.executor.shutdown()
+            self.loop.close()
+            self.logger.flush()
+        self.metrics.publish(graph,
+                             self.config.options.get('metrics_file', None),
+                             self.config.options.get('profile_dir', None))
+
+    def cleanup(self, graph):
+        pass
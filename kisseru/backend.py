@@ -1,4 +1,5 @@
 import abc
+import importlib
 
 from enum import Enum
 
@@ -7,12 +8,29 @@ class BackendType(Enum):
     LOCAL_NON_THREADED = 1
     LOCAL = 2
     SLURM = 3
+    ASYNC = 4
+    LOCAL_HYBRID = 5
+    TCP = 6
+
+
+# Name each backend registers itself under and the module defining it. Backend
+# modules get imported the first time a backend of theirs is asked for, so
+# that processes only pay for the backends they use.
+BACKEND_MODULES = {
+    BackendType.LOCAL_NON_THREADED: ('LOCAL_NON_THREADED', 'local'),
+    BackendType.LOCAL: ('LOCAL', 'local'),
+    BackendType.SLURM: ('SLURM', 'slurm'),
+    BackendType.ASYNC: ('ASYNC', 'aio'),
+    BackendType.LOCAL_HYBRID: ('LOCAL_HYBRID', 'local'),
+    BackendType.TCP: ('TCP', 'tcp'),
+}
 
 
 class BackendConfig(object):
-    def __init__(self, backend_type, name):
+    def __init__(self, backend_type, name, options=None):
         self.backend_type = backend_type
         self.name = name
+        self.options = options if options else {}
 
 
 class Backend(metaclass=abc.ABCMeta):
@@ -48,21 +66,34 @@ class Backend(metaclass=abc.ABCMeta):
     def cleanup(self, graph):
         pass
 
+    def run_map(self, task, items, kwargs):
+        """ Runs a MapTask over the given items
+
+        Backends running elements in parallel override this. Results are
+        gathered in the order of the items.
+
+        Args:
+            task: MapTask to run
+            items: Elements to map the task over
+            kwargs: Rest of the task arguments. Shared by all the elements
+        """
+        return [task.run_element(item, kwargs) for item in items]
+
     @classmethod
     def register_backend(cls, backend):
         cls.backends[backend.name] = backend
+        return backend
 
     @classmethod
     def get_backend(cls, backend_config):
-        backend_type = backend_config.backend_type
-        backend = None
-        if backend_type == BackendType.LOCAL_NON_THREADED:
-            backend = cls.backends['LOCAL_NON_THREADED'](backend_config)
-        elif backend_type == BackendType.LOCAL:
-            backend = cls.backends['LOCAL'](backend_config)
-        elif backend_type == BackendType.SLURM:
-            backend = cls.backends['SLURM'](backend_config)
-        return backend
+        name, module = BACKEND_MODULES.get(backend_config.backend_type,
+                                           (None, None))
+        if name is None:
+            return None
+        if name not in cls.backends:
+            # Registers the backend
+            importlib.import_module(module)
+        return cls.backends[name](backend_config)
 
     @classmethod
     def set_current_backend(cls, backend_config):
@@ -140,6 +140,34 @@ Expanded bash script:
     return output
 
 
+async def run_script_async(script_str, locls, globls, script_env):
+    """ Coroutine counterpart of run_script used by async def tasks.
+
+    The bash process is awaited on the running event loop so that many
+    inlined scripts can be in flight at once without tying up a thread each.
+    """
+    result = interpolate(script_str, locls, globls, script_env)
+
+    info_str = """
+---------------------
+Expanded bash script:
+---------------------
+{}
+---------------------
+""".format(result.script)
+    logp_debug(log, info_str)
+
+    import asyncio
+    p = await asyncio.create_subprocess_shell(
+        result.script,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout, stderr = await p.communicate()
+
+    output = ScriptOutput(stdout.decode(), stderr.decode())
+    return output
+
+
 def set_assignments(stdout, env):
     assigns = {}
     lines = stdout.splitlines()
@@ -324,10 +352,11 @@ def process_scripts(fnIR):
         '''
 
         # Replace the inlined bash script with a runtime call to
-        # run_script
+        # run_script. Coroutine functions await the script instead.
+        _runner = 'await run_script_async' if fnIR.is_async else 'run_script'
         _run_script = gen_spaces(script.indent) + "__kiseru_output = " \
-            + 'run_script("""{}""", locals(), globals(), __kiseru_assigns)\n'\
-            .format(script_str)
+            + '{}("""{}""", locals(), globals(), __kiseru_assigns)\n'\
+            .format(_runner, script_str)
 
         _set_assignments = gen_spaces(script.indent) \
                 + "set_assignments(__kiseru_output.stdout, __kiseru_assigns)\n"
@@ -0,0 +1,131 @@
+import logging
+
+from backend import Backend
+from passes import Pass
+from passes import PassResult
+from tasks import BatchTask
+from tasks import FusedTask
+from tasks import MapTask
+from tasks import Sink
+
+log = logging.getLogger(__name__)
+
+# Backends which run a batch as one unit. The others schedule each task from
+# its own description and would need to learn about batches first.
+BATCHING_BACKENDS = ('LOCAL_NON_THREADED', 'LOCAL', 'LOCAL_HYBRID', 'ASYNC')
+
+
+class Batching(Pass):
+    """ Groups instances of @task(batch=N) functions in to batches of up to N
+
+    Only instances which can't depend on each other get batched together. That
+    is the case for instances at the same level of the graph (i.e: the same
+    longest distance from the sources). Tasks which stream or get streamed
+    to, map tasks and compiler generated tasks are left alone. A vectorized
+    task is always called with columns, so a lone instance of it gets a batch
+    of its own. The pass runs before Fusion, which then leaves the batched
+    tasks alone.
+    """
+
+    def __init__(self, name):
+        Pass.__init__(self, name)
+        self.description = "Batching task instances"
+
+    def _levels(self, tasks):
+        # Longest distance of each task from the sources, worked out in
+        # topological order
+        children = {}
+        pending = {}
+        for task in tasks:
+            children.setdefault(task.id, [])
+            pending.setdefault(task.id, 0)
+            for edge in task.edges:
+                if isinstance(edge.dest, Sink):
+                    continue
+                child = edge.dest.task_ref
+                if isinstance(child, FusedTask):
+                    child = child.head
+                children[task.id].append(child)
+                pending[child.id] = pending.get(child.id, 0) + 1
+
+        levels = {}
+        ready = [task for task in tasks if not pending[task.id]]
+        while ready:
+            task = ready.pop()
+            level = levels.setdefault(task.id, 0)
+            for child in children[task.id]:
+                levels[child.id] = max(levels.get(child.id, 0), level + 1)
+                pending[child.id] -= 1
+                if not pending[child.id]:
+                    ready.append(child)
+        return levels
+
+    def _is_batchable(self, task):
+        if isinstance(task, (FusedTask, MapTask)) or task.is_fusee:
+            return False
+        if task.is_staging or task.is_transform or task.is_streaming:
+            return False
+        if task.configs.get('batch', 0) < 2 and \
+                not task.configs.get('vectorized', False):
+            return False
+        return not any(parent.is_streaming for parent in task.get_parents())
+
+    def run(self, graph, ctx):
+        if not any(task.configs.get('batch', 0) > 1 or
+                   task.configs.get('vectorized', False)
+                   for tid, task in graph.tasks.items()):
+            return PassResult.CONTINUE
+
+        Pass.run(self, graph, ctx)
+        backend = Backend.get_current_backend()
+        if type(backend).name not in BATCHING_BACKENDS:
+            for tid, task in graph.tasks.items():
+                if task.configs.get('vectorized', False):
+                    raise Exception("Vectorized task {} needs a backend "
+                                    "which supports batching. Backend {} "
+                                    "doesn't".format(task.name, backend.name))
+            log.warning("Backend {} does not support batching. Running "
+                        "tasks one by one".format(backend.name))
+            return PassResult.CONTINUE
+
+        tasks = [task for tid, task in graph.tasks.items()
+                 if not isinstance(task, FusedTask)]
+        levels = self._levels(tasks)
+
+        groups = {}
+        for task in tasks:
+            if not self._is_batchable(task):
+                continue
+            key = (task._fn.__module__, task.name,
+                   task._fn.__code__.co_code, levels[task.id])
+            groups.setdefault(key, []).append(task)
+
+        batches = []
+        for key, group in groups.items():
+            size = max(group[0].configs.get('batch', 1), 1)
+            vectorized = group[0].configs.get('vectorized', False)
+            for start in range(0, len(group), size):
+                members = group[start:start + size]
+                # A vectorized task always gets called with columns, so even
+                # a lone instance of it runs as a batch
+                if len(members) > 1 or vectorized:
+                    batches.append(BatchTask(members, "{}_batch{}".format(
+                        members[0].name, len(batches))))
+
+        for batch in batches:
+            for task in batch.tasks:
+                graph.fusee_map[task.id] = batch
+            graph.add_task(batch)
+
+            # A batch of sources is a source itself
+            if all(task.id in graph.sources for task in batch.tasks):
+                for task in batch.tasks:
+                    graph.unset_source(task)
+                graph.set_source(batch)
+
+        log.info("Grouped {} tasks in to {} batches".format(
+            sum(len(batch.tasks) for batch in batches), len(batches)))
+        return PassResult.CONTINUE
+
+    def post_run(self, graph, ctx):
+        pass
@@ -0,0 +1,168 @@
+import functools
+import glob
+import hashlib
+import inspect
+import logging
+import os
+import platform
+import types
+
+from graph_io import FORMAT_VERSION
+from graph_io import dump_graph
+from graph_io import load_graph
+
+log = logging.getLogger(__name__)
+
+# Globals of these types referred to by the app are treated as immediate task
+# arguments and become part of the cache key
+IMMEDIATE_TYPES = (int, float, str, bytes, bool, type(None), tuple, list,
+                   dict, frozenset, set)
+
+# Runner options which don't change the compiled graph. Backends only read
+# them at run time. 'handlers' is not one of them since the Specialize pass
+# bakes the enabled handlers in to the task runners.
+NON_COMPILE_OPTIONS = ('cache_dir', 'stats_file', 'trace_memory', 'journal',
+                       'resume', 'compress', 'compress_types',
+                       'compress_min_size', 'mmap_arrays', 'mmap_min_size',
+                       'profile_dir', 'metrics_file', 'history_file',
+                       'mem_budget', 'default_mem', 'stream_buffer',
+                       'speculate', 'speculation_factor', 'speculation_min',
+                       'max_workers', 'default_executor', 'num_workers',
+                       'workers', 'spread_bytes')
+
+_kisseru_digest = None
+
+
+def _get_kisseru_digest():
+    # Changes to the compiler itself invalidate all cached graphs
+    global _kisseru_digest
+    if _kisseru_digest is None:
+        digest = hashlib.sha1()
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(src_dir, "*.py"))):
+            with open(path, 'rb') as fp:
+                digest.update(fp.read())
+        _kisseru_digest = digest.hexdigest()
+    return _kisseru_digest
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+class AppKey(object):
+    """ Computes the cache key of an app
+
+    The key covers everything compilation depends on without running the app
+    specification itself. That is the source of the app function, the sources
+    and configurations of the tasks and helper functions it refers to, module
+    level constants it refers to (which end up as immediate task arguments),
+    arguments the app is called with, the backend and compile options, and the
+    kisseru and python versions.
+
+    Attributes:
+        digest: Cache key as a hex string. None if the app can't be cached
+            (e.g: its source is not available)
+    """
+
+    def __init__(self, app, backend_name, options):
+        self._digest = hashlib.sha1()
+        self._visited = set()
+
+        self._update("format", FORMAT_VERSION)
+        self._update("kisseru", _get_kisseru_digest())
+        self._update("python", platform.python_version())
+        self._update("backend", backend_name)
+        self._update("options", sorted(
+            (k, repr(v)) for k, v in options.items()
+            if k not in NON_COMPILE_OPTIONS))
+
+        try:
+            if isinstance(app, functools.partial):
+                self._update("args", app.args)
+                self._update("kwargs", sorted(app.keywords.items()))
+                app = app.func
+            self._add_function(inspect.unwrap(app))
+            self.digest = self._digest.hexdigest()
+        except (OSError, TypeError) as e:
+            log.warning("Not caching {} since its source is not available "
+                        "({})".format(getattr(app, '__name__', app), e))
+            self.digest = None
+
+    def _update(self, label, value):
+        self._digest.update("{}={!r};".format(label, value).encode())
+
+    def _add_function(self, fn):
+        if fn in self._visited:
+            return
+        self._visited.add(fn)
+
+        self._update("function", "{}.{}".format(fn.__module__,
+                                                fn.__qualname__))
+        self._update("source", inspect.getsource(fn))
+        self._update("defaults", fn.__defaults__)
+
+        for name in sorted(_code_names(fn.__code__)):
+            if name not in fn.__globals__:
+                continue
+            value = fn.__globals__[name]
+            if hasattr(value, 'task_configs'):
+                # A @task decorated function
+                self._update("task", value.task_configs)
+                self._add_function(inspect.unwrap(value))
+            elif isinstance(value, types.FunctionType):
+                self._add_function(inspect.unwrap(value))
+            elif isinstance(value, IMMEDIATE_TYPES):
+                self._update(name, value)
+
+
+class GraphCache(object):
+    """ On disk cache of compiled task graphs
+
+    Attributes:
+        cache_dir: Directory holding the cached graphs
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "{}.graph".format(key))
+
+    def load(self, key):
+        """ Loads the compiled graph for the key
+
+        Returns:
+            The TaskGraph or None if there isn't a usable cached graph
+        """
+
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, 'rb') as fp:
+                return load_graph(fp)
+        except Exception as e:
+            log.warning("Ignoring unreadable cached graph {} ({})".format(
+                path, e))
+            return None
+
+    def store(self, key, graph):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        # Write to a temporary file first so that a concurrent load never
+        # sees a partially written graph
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as fp:
+                dump_graph(graph, fp)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.warning("Unable to cache graph {} ({})".format(graph.name, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,244 @@
+import inspect
+import os
+import sys
+import threading
+
+from handler import Handler
+
+# Functions listed per task in the summary of a run profile
+DEFAULT_TOP = 20
+
+# Stacks taking less than this many seconds are left out when collapsing
+MIN_STACK_S = 1e-6
+
+# Profiles taken on each thread not yet shipped with the usage of a task
+# execution (see ResourceMeter)
+_profiles = threading.local()
+
+
+def _buffer():
+    if not hasattr(_profiles, 'entries'):
+        _profiles.entries = []
+    return _profiles.entries
+
+
+def take_profiles():
+    """ Profiles taken on the calling thread since they were last taken """
+
+    entries = _buffer()
+    _profiles.entries = []
+    return entries
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built in function
+        label = name
+    else:
+        label = "{} ({}:{})".format(name, os.path.basename(filename), line)
+    # Frames of a collapsed stack are separated by ';'
+    return label.replace(';', ',')
+
+
+def collapse(stats):
+    """ Collapsed stacks of a cProfile capture
+
+    cProfile only records which function called which. Stacks are rebuilt
+    from the functions nothing called (i.e: the task function) by splitting
+    the time of each callee between its callers in proportion to the time
+    it spent under each of them.
+
+    Args:
+        stats: Stats of a cProfile.Profile as set by its create_stats()
+
+    Returns:
+        Seconds spent in each stack keyed by its ';' separated frames
+    """
+
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    stacks = {}
+
+    def walk(func, path, frames, share):
+        frames = frames + [_label(func)]
+        self_s = stats[func][2] * share
+        if self_s >= MIN_STACK_S:
+            key = ";".join(frames)
+            stacks[key] = stacks.get(key, 0.0) + self_s
+
+        path.add(func)
+        for child, edge_s in children.get(func, []):
+            total_s = stats[child][3]
+            if child in path or total_s <= 0:
+                continue
+            child_share = share * edge_s / total_s
+            if total_s * child_share >= MIN_STACK_S:
+                walk(child, path, frames, child_share)
+        path.discard(func)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers and func[0] != _PROFILER_FILE:
+            walk(func, set(), [], 1.0)
+    return stacks
+
+
+def functions(stats):
+    """ [calls, own seconds, cumulative seconds] of each function of a
+    cProfile capture keyed by its label
+    """
+
+    table = {}
+    for func, (_, calls, own_s, cumulative_s, callers) in stats.items():
+        # Leave out the handler and what only it called
+        if func[0] == _PROFILER_FILE or callers and \
+                all(caller[0] == _PROFILER_FILE for caller in callers):
+            continue
+        row = table.setdefault(_label(func), [0, 0.0, 0.0])
+        row[0] += calls
+        row[1] += own_s
+        row[2] += cumulative_s
+    return table
+
+
+class CProfileEntry(Handler):
+    """ Starts a cProfile capture of the task call
+
+    Tasks already being profiled on the thread (e.g: by the user) are left
+    alone. So are coroutine tasks, whose frames get interleaved with those of
+    every other coroutine on their event loop.
+    """
+
+    def __init__(self, name):
+        Handler.__init__(self, name, "cprofile", opt_in=True)
+
+    def run(self, ctx):
+        if sys.getprofile() is not None or \
+                inspect.iscoroutinefunction(ctx.fn):
+            return
+
+        import cProfile
+        profiler = cProfile.Profile()
+        ctx.set('__cprofile__', profiler)
+        profiler.enable()
+
+
+class CProfileExit(Handler):
+    """ Ends the cProfile capture of the task call and keeps its collapsed
+    stacks and function table for the worker to ship back with the usage of
+    the task execution
+    """
+
+    def __init__(self, name):
+        Handler.__init__(self, name, "cprofile", opt_in=True)
+
+    def run(self, ctx):
+        profiler = ctx.get('__cprofile__')
+        if profiler is None:
+            return
+
+        profiler.disable()
+        profiler.create_stats()
+        _buffer().append({
+            'task': ctx.get('__name__'),
+            'stacks': collapse(profiler.stats),
+            'functions': functions(profiler.stats),
+        })
+
+
+# Frames of the handlers themselves get left out of the captures
+_PROFILER_FILE = CProfileExit.run.__code__.co_filename
+
+
+class RunProfile(object):
+    """ cProfile captures of the task executions of a run merged per task
+
+    Attributes:
+        graph_name: Name of the graph run
+        executions: Number of captures merged keyed by task name
+        stacks: Seconds spent in each collapsed stack. Stacks are rooted at
+            the name of the task they were captured in.
+        functions: [calls, own seconds, cumulative seconds] of each function
+            keyed by task name and then by function
+    """
+
+    def __init__(self, graph_name=None):
+        self.graph_name = graph_name
+        self.executions = {}
+        self.stacks = {}
+        self.functions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.executions)
+
+    def add(self, profile):
+        task = profile['task']
+        with self.lock:
+            self.executions[task] = self.executions.get(task, 0) + 1
+            for stack, seconds in profile['stacks'].items():
+                key = "{};{}".format(task.replace(';', ','), stack)
+                self.stacks[key] = self.stacks.get(key, 0.0) + seconds
+
+            table = self.functions.setdefault(task, {})
+            for label, (calls, own_s, cumulative_s) in \
+                    profile['functions'].items():
+                row = table.setdefault(label, [0, 0.0, 0.0])
+                row[0] += calls
+                row[1] += own_s
+                row[2] += cumulative_s
+
+    def top(self, task, n=DEFAULT_TOP):
+        """ (function, calls, own seconds, cumulative seconds) of the
+        functions the task spent the most time in, costliest first
+        """
+
+        rows = [(label, ) + tuple(row)
+                for label, row in self.functions.get(task, {}).items()]
+        rows.sort(key=lambda row: -row[2])
+        return rows[:n]
+
+    def write_collapsed(self, fp):
+        """ Writes the stacks in the collapsed format flame graph tools (e.g:
+        flamegraph.pl, speedscope) read. Counts are in microseconds.
+        """
+
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        for stack, seconds in stacks:
+            micros = int(round(seconds * 1e6))
+            if micros:
+                fp.write("{} {}\n".format(stack, micros))
+
+    def summary(self, n=DEFAULT_TOP):
+        lines = []
+        for task in sorted(self.executions):
+            lines.append("Task {} : {} executions".format(
+                task, self.executions[task]))
+            lines.append("  {:>10} {:>10} {:>9}  {}".format(
+                "own_s", "cum_s", "calls", "function"))
+            for label, calls, own_s, cumulative_s in self.top(task, n):
+                lines.append("  {:>10.6f} {:>10.6f} {:>9}  {}".format(
+                    own_s, cumulative_s, calls, label))
+        return lines
+
+    def dump(self, directory=".", n=DEFAULT_TOP):
+        """ Writes the collapsed stacks to <graph>.collapsed and the top
+        functions of each task to <graph>.top.txt in the directory
+
+        Returns:
+            Paths of the (collapsed stacks, summary) files written
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        collapsed = os.path.join(directory,
+                                 "{}.collapsed".format(self.graph_name))
+        with open(collapsed, 'w') as fp:
+            self.write_collapsed(fp)
+        summary = os.path.join(directory, "{}.top.txt".format(self.graph_name))
+        with open(summary, 'w') as fp:
+            fp.write("\n".join(self.summary(n)) + "\n")
+        return collapsed, summary
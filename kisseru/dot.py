@@ -1,254 +1,135 @@
-from itertools import islice
 from passes import Pass
 from passes import PassResult
+from tasks import BatchTask
 from tasks import FusedTask
 from tasks import Sink
 
 
+class DotWriter(object):
+    """ Streams a task graph out in dot format
+
+    The graph is written in a single pass over its tasks and edges. Each task
+    gets a node of its own (tasks sharing a name are still drawn separately)
+    and tasks fused in to a FusedTask or batched in to a BatchTask are drawn
+    within a cluster.
+
+    Attributes:
+        fp: File object to write to
+        node_ids: Dot node id of each task keyed by task id
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.node_ids = {}
+
+    def _node_id(self, task):
+        # In-ports of a fused task head point to the fused task. Draw the edge
+        # to the head itself.
+        if isinstance(task, FusedTask):
+            task = task.head
+
+        node_id = self.node_ids.get(task.id, None)
+        if node_id is None:
+            node_id = "t{}".format(len(self.node_ids))
+            self.node_ids[task.id] = node_id
+        return node_id
+
+    def _node_attrs(self, task):
+        attrs = ["fillcolor=lightcyan"]  # Default fill color
+        if task.is_source:
+            # If it is a source we change the border to be double lined
+            attrs.append("peripheries=2")
+        if task.is_sink:
+            # If it is a sink we override the fill color with orange
+            attrs.append("fillcolor=orange")
+        if task.is_staging or task.is_transform:
+            # If it is a generated node we draw it as a red box
+            attrs.append("shape=box fillcolor=red")
+
+        label = task.name
+        if task.executor:
+            # Show the execution mode the task asked for below its name
+            label += "\\n({})".format(task.executor)
+        attrs.append('label="{}"'.format(label))
+        attrs.append("style=filled")
+        return " ".join(attrs)
+
+    def _write_node(self, task, indent=""):
+        self.fp.write("{}{} [{}]\n".format(indent, self._node_id(task),
+                                           self._node_attrs(task)))
+
+    def _write_edges(self, task):
+        multi_output = len(task.outputs) > 1
+        for edge in task.edges:
+            if isinstance(edge.dest, Sink):
+                continue
+
+            attrs = ""
+            if multi_output:
+                # Mark which output of the task flows along the edge
+                attrs = ' [label="{}"]'.format(edge.source.name)
+            self.fp.write("{} -> {}{}\n".format(
+                self._node_id(task), self._node_id(edge.dest.task_ref),
+                attrs))
+
+    def write(self, graph):
+        self.fp.write("digraph {} {{\n".format(graph.name))
+
+        # Fused tasks and batches get drawn as clusters holding the tasks they
+        # contain
+        members = []
+        cluster = 0
+        for tid, task in graph.tasks.items():
+            if isinstance(task, (FusedTask, BatchTask)):
+                self.fp.write("subgraph cluster{} {{\n".format(cluster))
+                self.fp.write("style=filled\n")
+                self.fp.write("color=lightgrey\n")
+                for member in task.tasks:
+                    self._write_node(member, "  ")
+                    members.append(member)
+                self.fp.write("}\n")
+                cluster += 1
+
+        for tid, task in graph.tasks.items():
+            if not isinstance(task, (FusedTask, BatchTask)) and \
+                    not task.is_fusee:
+                self._write_node(task)
+
+        # A fused task shares its edges with its tail and a batch sends along
+        # the edges of its members. So drawing the edges of the tasks they
+        # contain covers them as well.
+        for tid, task in graph.tasks.items():
+            if not isinstance(task, (FusedTask, BatchTask)):
+                self._write_edges(task)
+
+        self.fp.write("}\n")
+
+
 class DotGraphGenerator(Pass):
+    """ Writes the task graph out as <graph name>-<tag>.dot
+
+    Visualization is opt-in. The pass does nothing unless the runner was given
+    the 'dot' option.
+    """
+
     def __init__(self, name, tag=""):
         Pass.__init__(self, name, tag)
-        self.pre_graph = None
-        self.post_graph = None
         self.description = "Generating the dot graph"
 
-    def _gen_dot_graph(self, graph, paths, labels):
-        header = "digraph {} {{\n".format(graph.name)
-        body = ""
-        nodes = ""
-        for label in labels:
-            tokens = label.split(":")
-            node = tokens[0]
-            attr_open = "["
-            attrs = "fillcolor=lightcyan "  # Default fill color is green
-            is_generated = False
-            for attr in islice(tokens, 1, None):
-                if attr == "source":
-                    # If it is a source we change the border to be double lined
-                    attrs += "peripheries=2 "
-                elif attr == "sink":
-                    # If it is a sink we override the file color with orange
-                    attrs += "fillcolor=orange "
-                elif attr == "generated":
-                    is_generated = True
-                    # If it is a generated node we change the border to be a
-                    # a dotted  red line
-                    attrs += "shape=box fillcolor=red "
-
-            # attrs += 'style="filled, dotted"' if is_generated else 'style=filled'
-            attrs += 'style=filled'
-            attr_close = "]"
-            node = node + " " + attr_open + attrs + attr_close + "\n"
-            nodes += node
-
-        # Add node configurations as the first part of the body
-        body += nodes
-
-        # BEGIN -- Path segment related classes and utils
-        class PathSegment:
-            def __init__(self, typ):
-                self.type = typ
-                self.items = []
-
-            def extend(self, item):
-                self.items.append(item)
-
-            def __repr__(self):
-                return self.items
-
-            def __str__(self):
-                return str(self.items)
-
-        def get_next_segment(path, index):
-            lookahead = None
-            ptr = len(path)
-            if index + 1 < len(path):
-                lookahead = path[index + 1]
-                ptr = index + 1
-
-            segment = None
-            if lookahead:
-                if lookahead == "(":
-                    segment = PathSegment("GROUPED")
-                    ptr += 1
-                else:
-                    segment = PathSegment("RAW")
-            return (segment, ptr)
-
-        def get_next_segment_head(path, index):
-            head = None
-            ptr = len(path)
-            if index + 1 < len(path):
-                head = path[index + 1]
-                ptr = index + 1
-
-            if head:
-                if head == "(":
-                    ptr += 1
-                    head = path[ptr]
-            return head
-
-        # END --
-
-        # Next we add the paths in the graph
-        segments = []
-        segment_edges = []
-        for path in paths:
-            i = 0
-            queue = []
-            cur_segment, i = get_next_segment(path, -1)
-            while i < len(path):
-                if path[i] == "(":
-                    while queue:
-                        cur_segment.extend(queue.pop(0))
-                    next_head = get_next_segment_head(path, i)
-                    if next_head:
-                        segment_edges.append((cur_segment.items[-1],
-                                              next_head))
-                    segments.append(cur_segment)
-                    cur_segment = PathSegment("GROUPED")
-                    i += 1
-                    continue
-
-                if path[i] == ")":
-                    while queue:
-                        cur_segment.extend(queue.pop(0))
-                    next_head = get_next_segment_head(path, i)
-                    if next_head:
-                        segment_edges.append((cur_segment.items[-1],
-                                              next_head))
-                    segments.append(cur_segment)
-                    cur_segment, i = get_next_segment(path, i)
-                    continue
-
-                queue.append(path[i])
-                i += 1
-            while queue:
-                cur_segment.extend(queue.pop(0))
-
-            if cur_segment:
-                segments.append(cur_segment)
-
-        # Draw subgraph regions which corresponds to fused tasks
-        subgraph_cntr = 0
-        for segment in segments:
-            if segment.type == "GROUPED":
-                body += "subgraph cluster{} {{\n".format(subgraph_cntr)
-                body += "style=filled\n"
-                body += "color=lightgrey\n"
-                body += '->'.join(segment.items)
-                body += "\n"
-                body += "}\n"
-                subgraph_cntr += 1
-            else:
-                body += '->'.join(segment.items)
-                body += '\n'
-
-        # Connect fused and unfused regions together
-        for segment_edge in segment_edges:
-            body += '{}->{}\n'.format(segment_edge[0], segment_edge[1])
-
-        footer = "}"
-        return header + body + footer
-
-    def _gen_label(self, node):
-        label = node.name
-        if node.is_source:
-            # Update the node's label to mark it as source
-            label = label + ":source"
-        if node.is_sink:
-            # Update the node's label to mark it as sink
-            label = label + ":sink"
-        if node.is_staging or node.is_transform:
-            # Update the node's label to mark it as generated
-            label = label + ":generated"
-        return label
-
-    def _traverse(self, node, cur, paths, visited, labels):
-        # Handle the first edge separately since we continue the top down path
-        # at left most child
-        if not node.is_sink:
-            edge_zero = node.edges[0]
-            self._dfs(edge_zero.dest.task_ref, cur, paths, visited, labels)
-        else:
-            paths.append(cur)
-            return
-
-        # Generate new paths for non left most children
-        if len(node.edges) > 1:
-            for edge in islice(node.edges, 1, None):
-                self._dfs(edge.dest.task_ref, [node.name], paths, visited,
-                          labels)
-
-    def _dfs(self, node, cur, paths, visited, labels):
-        if node == None:
-            return
-
-        if cur == None:
-            cur = []
-
-        if isinstance(node, FusedTask):
-            label = node.head.name
-            if node.id in visited:
-                cur.append(label)
-                paths.append(cur)
-                return
-            else:
-                cur.append("(")
-                for task in node.tasks:
-                    # Generate the node label with attributes
-                    label = self._gen_label(task)
-                    # Extend the current path with the node name
-                    cur.append(task.name)
-                    # Accumulate this node's label
-                    labels.add(label)
-                cur.append(")")
-                visited.add(node.id)
-                # Traverse the children starting from the tail of this fused
-                # task
-                self._traverse(node.tail, cur, paths, visited, labels)
-        else:
-            label = node.name
-            if node.id in visited:
-                cur.append(label)
-                paths.append(cur)
-                return
-
-            # Generate the node label with attributes
-            label = self._gen_label(node)
-            visited.add(node.id)
-            # Extend the current path with the node name
-            cur.append(node.name)
-            # Accumulate this node's label
-            labels.add(label)
-            # Traverse the node's children with dfs.
-            self._traverse(node, cur, paths, visited, labels)
-
-    def _generate_dot_graph(self, graph):
-        paths = []
-        visited = set()
-        labels = set()
-        for tid, source in graph.sources.items():
-            self._dfs(source, None, paths, visited, labels)
-        return self._gen_dot_graph(graph, paths, labels)
+    def get_filename(self, graph):
+        if self.tag:
+            return "{}-{}.dot".format(graph.name, self.tag)
+        return "{}.dot".format(graph.name)
 
     def run(self, graph, ctx):
-        Pass.run(self, graph, ctx)
-        graph_map = ctx.properties.get('__dot_graph__', None)
-        if not graph_map:
-            graph_map = {}
-        graph_map[self.tag] = self._generate_dot_graph(graph)
-        ctx.properties['__dot_graph__'] = graph_map
+        if not ctx.options.get('dot', False):
+            return PassResult.CONTINUE
 
+        Pass.run(self, graph, ctx)
+        # Graph gets written out right away since later passes modify it
+        with open(self.get_filename(graph), "w") as fp:
+            DotWriter(fp).write(graph)
         return PassResult.CONTINUE
 
     def post_run(self, graph, ctx):
-        graph_map = ctx.properties['__dot_graph__']
-        if graph_map:
-            for tag, dot_graph in graph_map.items():
-                filename = graph.name
-                if not tag or tag != "":
-                    filename = "{}-{}".format(graph.name, tag)
-
-                with open("{}.dot".format(filename), "w") as f:
-                    f.write(dot_graph)
+        pass
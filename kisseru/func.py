@@ -15,6 +15,7 @@ from utils import *
 # Need these to be in global environment when recompile is run so that we can
 # include them in the newly generated function's global scope
 from bash import run_script
+from bash import run_script_async
 from bash import set_assignments
 
 log = logging.getLogger(__name__)
@@ -51,17 +52,23 @@ Generated python function:
     defaults = old_func.__defaults__.copy() if old_func.__defaults__ else None
     annotations = inspect.signature(old_func)
     globs['run_script'] = run_script
+    globs['run_script_async'] = run_script_async
     globs['set_assignments'] = set_assignments
     new_fn = types.FunctionType(
         func_code, globs, name=fn.name, argdefs=defaults)
     return new_fn
 
 
+def is_prototype_start(line):
+    stripped = line.lstrip()
+    return stripped.startswith("def ") or stripped.startswith("async def ")
+
+
 def set_function_meta(fn):
     is_in_proto = False
     fn.indent = get_indentation(fn.lines[0])
     for lineno, line in enumerate(fn.lines):
-        if line.lstrip().startswith("def "):
+        if is_prototype_start(line):
             if not is_in_proto:
                 is_in_proto = True
             else:
@@ -69,6 +76,9 @@ def set_function_meta(fn):
                     """Invalid function definition. Multiple def key words in the
                     prototype for function {}""".format(fn.name))
             fn.proto_start = lineno
+            # Coroutine tasks get their inlined scripts awaited instead of
+            # blocking the event loop
+            fn.is_async = line.lstrip().startswith("async def ")
 
         if is_in_proto:
             if line.rstrip().endswith("\\"):
@@ -95,7 +105,7 @@ def normalize_fn_body(fn):
     is_in_proto = False
     for lineno, line in enumerate(fn.lines):
         # This is the start of the function prototype
-        if line != None and line.lstrip().startswith("def "):
+        if line != None and is_prototype_start(line):
             is_in_proto = True
 
         # We set 'is_in_proto' in above conditional and do the prototype
@@ -7,42 +7,50 @@ from passes import PassResult
 class Fusion(Pass):
     """ Task fusion merges straight line task sequences to run inside one 
     texecutable unit. 
+
+    A fused task runs with the executor of its members. So tasks asking for
+    different executors (@task(executor=...)) never get fused together.
     """
 
     def __init__(self, name):
         Pass.__init__(self, name)
         self.description = "Running the task fusion optimizer"
 
-    def _dfs(self, node, cur_fusables, all_fusables, visited):
-        if node in visited:
-            return
-
-        visited.add(node)
-        children = node.get_children()
-
-        if len(children) == 1:
-            child = children[0]
-
-            if len(child.get_parents()) == 1:
-                cur_fusables.append(child)
-                self._dfs(child, cur_fusables, all_fusables, visited)
-                return
-
-        all_fusables.append(cur_fusables)
-
-        # Current node ends a fusable region. Try forming new fusable regions
-        # starting with its children
-        for child in children:
-            cur_fusables = [child]
-            self._dfs(child, cur_fusables, all_fusables, visited)
+    def _dfs(self, source, all_fusables, visited):
+        # Iterative so that long chains don't run out of stack
+        stack = [[source]]
+        while stack:
+            cur_fusables = stack.pop()
+            node = cur_fusables[-1]
+            while node not in visited:
+                visited.add(node)
+                children = node.get_children()
+
+                # Batched tasks already run as a part of a batch
+                if len(children) == 1 and node.batch is None:
+                    child = children[0]
+
+                    if len(child.get_parents()) == 1 and \
+                            child.batch is None and \
+                            child.executor == node.executor:
+                        cur_fusables.append(child)
+                        node = child
+                        continue
+
+                all_fusables.append(cur_fusables)
+
+                # Current node ends a fusable region. Try forming new fusable
+                # regions starting with its children
+                for child in reversed(children):
+                    stack.append([child])
+                break
 
     def run(self, graph, ctx):
         Pass.run(self, graph, ctx)
         all_fusables = []
         visited = set()
         for name, source in graph.sources.items():
-            cur_fusables = [source]
-            self._dfs(source, cur_fusables, all_fusables, visited)
+            self._dfs(source, all_fusables, visited)
 
         # Filter out single node fusable regions which are redundant
         fusables = [fusable for fusable in all_fusables if len(fusable) > 1]
@@ -0,0 +1,519 @@
+import enum
+import importlib
+import inspect
+import io
+import pickle
+import sys
+import uuid
+
+from multiprocessing import Condition
+from multiprocessing import Value
+
+from payload import function_hash
+from payload import pack_function
+from payload import unpack_function
+from tasks import BatchTask
+from tasks import Edge
+from tasks import FusedTask
+from tasks import gen_runner
+from tasks import Task
+from tasks import TaskGraph
+from tasks import Tasklet
+
+# Leads every serialized graph
+MAGIC = b"KGIR"
+
+# Bump when the layout of the serialized graph changes
+FORMAT_VERSION = 2
+
+# Task attributes which refer to other tasks of the graph
+TASK_REFS = ('head', 'tail', 'batch')
+
+# Task attributes rebuilt at load time instead of being written out. Runners
+# get regenerated from the task function, monitors and batch readiness start
+# afresh and the graph is the one being loaded in to.
+RUNTIME_ATTRS = ('_runner', '_element_runner', 'triggered', '_ready', 'graph')
+
+# A fused task runs with the in-ports, arguments and latch of its head and
+# sends down the edges of its tail
+FUSED_SHARED = (('_args', 'head'), ('_latch', 'head'), ('triggered', 'head'),
+                ('inputs', 'head'), ('edges', 'tail'))
+
+PARAMETER_KINDS = (inspect.Parameter.POSITIONAL_ONLY,
+                   inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                   inspect.Parameter.VAR_POSITIONAL,
+                   inspect.Parameter.KEYWORD_ONLY,
+                   inspect.Parameter.VAR_KEYWORD)
+
+_PLAIN_TYPES = (int, float, str, bytes, bool, type(None))
+
+
+def _is_plain(value):
+    if type(value) in _PLAIN_TYPES:
+        return True
+    if type(value) in (list, tuple, set, frozenset):
+        return all(_is_plain(v) for v in value)
+    if type(value) == dict:
+        return all(_is_plain(k) and _is_plain(v) for k, v in value.items())
+    return False
+
+
+def _is_importable(obj):
+    # Classes and functions reachable by their qualified name are written out
+    # by reference
+    module = sys.modules.get(getattr(obj, '__module__', None), None)
+    target = module
+    for attr in getattr(obj, '__qualname__', '').split('.'):
+        target = getattr(target, attr, None)
+    return module is not None and target is obj
+
+
+def _resolve(module, qualname):
+    obj = sys.modules.get(module, None) or importlib.import_module(module)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class _Unpickler(pickle.Unpickler):
+    # The document is made of builtins only. Anything else (e.g: an
+    # immediate argument of a user defined type) is a nested pickle of its
+    # own, loaded when the task gets rebuilt.
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(
+            "Unexpected object {}.{} in serialized graph".format(module, name))
+
+
+class GraphWriter(object):
+    """ Lowers a compiled task graph to its serialized form
+
+    The serialized form is a document of plain python builtins with a table
+    per kind of object in the graph IR,
+
+        code    - Task functions. ASTOps recompiles task functions so they
+                  can't be found by name. Their code gets packed and stored
+                  once per content hash, however many tasks use it. Importable
+                  functions are referred to by module and qualified name
+        sigs    - Task signatures
+        types   - Port types
+        ports   - Task in-ports and out-ports, including sinks
+        edges   - Edges between out-ports and in-ports as (source port, dest
+                  port, needs transform)
+        tasks   - Tasks with their immediate arguments, configs and flags
+        layouts - Class and attribute names of the objects in the types,
+                  ports and tasks tables
+
+    Objects are written out as a tuple of their layout followed by the values
+    of its attributes. Objects refer to each other by table index. Values
+    which are not plain builtins are tagged tuples (see value).
+
+    Runners, latches and monitors are runtime state. Runners are regenerated
+    from the task functions on load and latches are written out as counts.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.code = []
+        self.sigs = []
+        self.types = []
+        self.ports = []
+        self.edges = []
+        self.layouts = []
+        self._code_ids = {}
+        self._code_hashes = {}
+        self._sig_ids = {}
+        self._type_ids = {}
+        self._port_ids = {}
+        self._edge_ids = {}
+        self._layout_ids = {}
+        self._task_ids = {id(task): index for index, task in
+                          enumerate(graph.tasks.values())}
+
+    def value(self, value):
+        if type(value) != tuple and _is_plain(value):
+            return value
+        elif isinstance(value, uuid.UUID):
+            return ('uuid', value.bytes)
+        elif isinstance(value, enum.Enum) and _is_importable(type(value)):
+            cls = type(value)
+            return ('enum', cls.__module__, cls.__qualname__, value.name)
+        elif inspect.isfunction(value) and not _is_importable(value):
+            return ('code', self.function(value))
+        elif (inspect.isclass(value) or inspect.isfunction(value)) and \
+                _is_importable(value):
+            return ('ref', value.__module__, value.__qualname__)
+        elif type(value) in (list, tuple):
+            return (type(value).__name__, [self.value(v) for v in value])
+        elif type(value) == dict:
+            return ('dict', [(self.value(k), self.value(v))
+                             for k, v in value.items()])
+        return ('pickle', pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def function(self, fn):
+        index = self._code_ids.get(id(fn), None)
+        if index is not None:
+            return index
+
+        packed = pack_function(fn)
+        defaults = self.value(packed['defaults'])
+        # Each call of a task recompiles its function. Those share the code.
+        key = function_hash(packed)
+        for index, seen in self._code_hashes.get(key, []):
+            if seen == defaults:
+                break
+        else:
+            packed['defaults'] = defaults
+            index = len(self.code)
+            self.code.append(packed)
+            self._code_hashes.setdefault(key, []).append((index, defaults))
+        self._code_ids[id(fn)] = index
+        return index
+
+    def _intern(self, table, ids, record):
+        # Equal records get stored once. Those holding unhashable values
+        # (e.g: a list default) are stored as they come.
+        try:
+            index = ids.get(record, None)
+        except TypeError:
+            index = len(table)
+            table.append(record)
+            return index
+        if index is None:
+            index = len(table)
+            table.append(record)
+            ids[record] = index
+        return index
+
+    def signature(self, sig):
+        params = tuple((param.name, int(param.kind),
+                        self.value(param.default),
+                        self.value(param.annotation))
+                       for param in sig.parameters.values())
+        return self._intern(self.sigs, self._sig_ids,
+                            (params, self.value(sig.return_annotation)))
+
+    def layout(self, obj, names):
+        return self._intern(self.layouts, self._layout_ids,
+                            (self.value(type(obj)), tuple(names)))
+
+    def record(self, obj, encode, skip=()):
+        names = [name for name in vars(obj) if name not in skip]
+        return (self.layout(obj, names), ) + tuple(
+            encode(name, getattr(obj, name)) for name in names)
+
+    def type(self, typ):
+        if typ is None:
+            return None
+        # Port types are created per port. Equal ones are stored once.
+        return self._intern(self.types, self._type_ids,
+                            self.record(typ, lambda name, v: self.value(v)))
+
+    def task(self, task):
+        if task is None:
+            return None
+        index = self._task_ids.get(id(task), None)
+        if index is None:
+            raise Exception("{} is not a task of graph {}".format(
+                task.name, self.graph.name))
+        return index
+
+    def port(self, port):
+        index = self._port_ids.get(id(port), None)
+        if index is not None:
+            return index
+
+        index = len(self.ports)
+        self._port_ids[id(port)] = index
+        # Reserve the slot since the in-port edge refers back to this port
+        self.ports.append(None)
+        self.ports[index] = self.record(port, self.port_field)
+        return index
+
+    def port_field(self, name, value):
+        if name == 'type':
+            return self.type(value)
+        elif name == 'task_ref':
+            return self.task(value)
+        elif name == 'inport_edge':
+            return self.edge(value)
+        return self.value(value)
+
+    def edge(self, edge):
+        if edge is None:
+            return None
+        index = self._edge_ids.get(id(edge), None)
+        if index is not None:
+            return index
+
+        index = len(self.edges)
+        self._edge_ids[id(edge)] = index
+        self.edges.append(None)
+        self.edges[index] = (self.port(edge.source), self.port(edge.dest),
+                             edge.needs_transform)
+        return index
+
+    def task_field(self, name, value):
+        if name in TASK_REFS:
+            return self.task(value)
+        elif name == 'tasks':
+            return [self.task(task) for task in value]
+        elif name in ('inputs', 'outputs'):
+            return [(key, self.port(port)) for key, port in value.items()]
+        elif name == 'edges':
+            return [self.edge(edge) for edge in value]
+        elif name == '_fn':
+            return self.function(value)
+        elif name in ('_sig', '_element_sig'):
+            return self.signature(value)
+        elif name == '_args':
+            # Values from upstream tasks are only known at runtime
+            return [(arg, self.value(v)) for arg, v in value.items()
+                    if not isinstance(v, (Task, Tasklet))]
+        elif name == '_latch':
+            return value.value
+        return self.value(value)
+
+    def write(self):
+        graph = self.graph
+        tasks = []
+        for task in graph.tasks.values():
+            skip = RUNTIME_ATTRS
+            if isinstance(task, FusedTask):
+                skip += tuple(name for name, owner in FUSED_SHARED)
+            tasks.append(self.record(task, self.task_field, skip))
+
+        return {
+            'version': FORMAT_VERSION,
+            'name': graph.name,
+            'num_tasks': graph.num_tasks,
+            'code': self.code,
+            'sigs': self.sigs,
+            'types': self.types,
+            'ports': self.ports,
+            'edges': self.edges,
+            'tasks': tasks,
+            'layouts': self.layouts,
+            'sources': [self.task(task) for task in graph.sources.values()],
+            'fusee_map': [(tid.bytes, self.task(fused))
+                          for tid, fused in graph.fusee_map.items()],
+        }
+
+
+class GraphReader(object):
+    """ Rebuilds a task graph from its serialized form (see GraphWriter) """
+
+    def __init__(self, doc, graph):
+        self.doc = doc
+        self.graph = graph
+        self.code = [None] * len(doc['code'])
+        self.sigs = [None] * len(doc['sigs'])
+        self.types = []
+        self.ports = []
+        self.edges = []
+        self.tasks = []
+        self.layouts = []
+        self._refs = {}
+
+    def value(self, enc):
+        if type(enc) != tuple:
+            return enc
+
+        kind = enc[0]
+        if kind == 'uuid':
+            return uuid.UUID(bytes=enc[1])
+        elif kind == 'enum':
+            return getattr(self.ref(enc[1], enc[2]), enc[3])
+        elif kind == 'ref':
+            return self.ref(enc[1], enc[2])
+        elif kind == 'code':
+            return self.function(enc[1])
+        elif kind == 'list':
+            return [self.value(v) for v in enc[1]]
+        elif kind == 'tuple':
+            return tuple(self.value(v) for v in enc[1])
+        elif kind == 'dict':
+            return {self.value(k): self.value(v) for k, v in enc[1]}
+        elif kind == 'pickle':
+            return pickle.loads(enc[1])
+        raise Exception("Unknown value encoding {}".format(kind))
+
+    def ref(self, module, qualname):
+        obj = self._refs.get((module, qualname), None)
+        if obj is None:
+            obj = _resolve(module, qualname)
+            self._refs[(module, qualname)] = obj
+        return obj
+
+    def function(self, index):
+        if self.code[index] is None:
+            packed = dict(self.doc['code'][index])
+            packed['defaults'] = self.value(packed['defaults'])
+            self.code[index] = unpack_function(packed)
+        return self.code[index]
+
+    def signature(self, index):
+        if self.sigs[index] is None:
+            params, return_annotation = self.doc['sigs'][index]
+            kinds = {int(kind): kind for kind in PARAMETER_KINDS}
+            self.sigs[index] = inspect.Signature(
+                [inspect.Parameter(name, kinds[kind],
+                                   default=self.value(default),
+                                   annotation=self.value(annotation))
+                 for name, kind, default, annotation in params],
+                return_annotation=self.value(return_annotation))
+        return self.sigs[index]
+
+    def new(self, record):
+        cls = self.layouts[record[0]][0]
+        return cls.__new__(cls)
+
+    def fill(self, obj, record, decode):
+        names = self.layouts[record[0]][1]
+        obj.__dict__.update(
+            (name, decode(name, value))
+            for name, value in zip(names, record[1:]))
+        return obj
+
+    def port_field(self, name, value):
+        if value is None:
+            return None
+        elif name == 'type':
+            return self.types[value]
+        elif name == 'task_ref':
+            return self.tasks[value]
+        elif name == 'inport_edge':
+            return self.edges[value]
+        return self.value(value)
+
+    def task_field(self, name, value):
+        if name in TASK_REFS:
+            return None if value is None else self.tasks[value]
+        elif name == 'tasks':
+            return [self.tasks[index] for index in value]
+        elif name in ('inputs', 'outputs'):
+            return {key: self.ports[index] for key, index in value}
+        elif name == 'edges':
+            return [self.edges[index] for index in value]
+        elif name == '_fn':
+            return self.function(value)
+        elif name in ('_sig', '_element_sig'):
+            return self.signature(value)
+        elif name == '_args':
+            return {arg: self.value(v) for arg, v in value}
+        elif name == '_latch':
+            return Value('i', value)
+        return self.value(value)
+
+    def read(self):
+        doc = self.doc
+        self.layouts = [(self.value(cls), names)
+                        for cls, names in doc['layouts']]
+        self.types = [self.fill(self.new(record), record,
+                                lambda name, v: self.value(v))
+                      for record in doc['types']]
+
+        # Objects refer to each other. Allocate all of them before filling
+        # them in.
+        self.tasks = [self.new(record) for record in doc['tasks']]
+        self.ports = [self.new(record) for record in doc['ports']]
+        self.edges = [Edge.__new__(Edge) for _ in doc['edges']]
+
+        for port, record in zip(self.ports, doc['ports']):
+            self.fill(port, record, self.port_field)
+
+        for edge, (source, dest, needs_transform) in zip(self.edges,
+                                                         doc['edges']):
+            edge.source = self.ports[source]
+            edge.dest = self.ports[dest]
+            edge.needs_transform = needs_transform
+
+        for task, record in zip(self.tasks, doc['tasks']):
+            self.fill(task, record, self.task_field)
+            task.graph = self.graph
+            task.triggered = Condition()
+            if isinstance(task, BatchTask):
+                task._ready = set()
+
+        for task in self.tasks:
+            if isinstance(task, FusedTask):
+                for name, owner in FUSED_SHARED:
+                    setattr(task, name, getattr(getattr(task, owner), name))
+
+        graph = self.graph
+        graph.name = doc['name']
+        graph.num_tasks = doc['num_tasks']
+        graph.tasks.update((task.id, task) for task in self.tasks)
+        graph.sources.update(
+            (self.tasks[index].id, self.tasks[index])
+            for index in doc['sources'])
+        graph.fusee_map.update(
+            (uuid.UUID(bytes=tid), self.tasks[index])
+            for tid, index in doc['fusee_map'])
+        return graph
+
+
+def bind_runners(graph):
+    """ Regenerates the runners of the tasks of a loaded graph """
+
+    for tid, task in graph.tasks.items():
+        if isinstance(task, FusedTask):
+            continue
+        if hasattr(task, 'bind_runners'):
+            # Map tasks and batches generate runners of their own
+            task.bind_runners()
+        else:
+            task._runner = gen_runner(task._fn, task._sig, task.handlers)
+
+    # Fused chains are generated from the runners of their members
+    for tid, task in graph.tasks.items():
+        if isinstance(task, FusedTask):
+            task.bind_runners()
+
+
+def dump_graph(graph, fp):
+    """ Writes a compiled task graph to a binary file object
+
+    Args:
+        graph: Compiled TaskGraph
+        fp: File object to write to
+    """
+
+    fp.write(MAGIC)
+    pickle.dump(GraphWriter(graph).write(), fp, pickle.HIGHEST_PROTOCOL)
+
+
+def load_graph(fp):
+    """ Reads a compiled task graph written with dump_graph
+
+    The graph replaces any graph currently held in the process since graph
+    state is shared by all TaskGraph instances.
+
+    Args:
+        fp: File object to read from
+
+    Returns:
+        The loaded TaskGraph ready to be run
+    """
+
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise Exception("Not a serialized task graph")
+    doc = _Unpickler(fp).load()
+    if type(doc) != dict or doc.get('version', None) != FORMAT_VERSION:
+        raise Exception("Unsupported graph format version {}".format(
+            doc.get('version', None) if type(doc) == dict else None))
+
+    graph = TaskGraph()
+    graph.reset()
+    GraphReader(doc, graph).read()
+    bind_runners(graph)
+    return graph
+
+
+def dumps_graph(graph):
+    fp = io.BytesIO()
+    dump_graph(graph, fp)
+    return fp.getvalue()
+
+
+def loads_graph(data):
+    return load_graph(io.BytesIO(data))
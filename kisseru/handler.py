@@ -16,8 +16,21 @@ class HandlerContext(object):
 
 
 class Handler(object):
-    def __init__(self, name):
+    """ A hook run around (or before) each task call
+
+    Attributes:
+        name: Name of the handler
+        feature: Feature the handler implements (e.g: 'trace'). Handlers are
+            enabled and disabled by feature or by name.
+        opt_in: Whether the handler only runs when enabled by its name or
+            feature. Opt in handlers (e.g: 'cprofile') are too costly to run
+            by default and so are left out when all handlers are enabled.
+    """
+
+    def __init__(self, name, feature=None, opt_in=False):
         self.name = name
+        self.feature = feature if feature else name
+        self.opt_in = opt_in
 
     # Context -> Void
     def run(self, ctx):
@@ -41,3 +54,42 @@ class HandlerRegistry(object):
     @staticmethod
     def register_post_handler(handler):
         HandlerRegistry.post_handlers.append(handler)
+
+    @staticmethod
+    def select(selection=True):
+        """ Pre and post handlers enabled by a selection
+
+        Args:
+            selection: True for all the handlers except the opt in ones, False
+                for none of them or the names or features of the handlers to
+                enable
+
+        Returns:
+            (pre handlers, post handlers) tuple of tuples
+        """
+
+        if selection is True or selection is None:
+            default = lambda handler: not handler.opt_in
+            return (tuple(filter(default, HandlerRegistry.pre_handlers)),
+                    tuple(filter(default, HandlerRegistry.post_handlers)))
+        if selection is False:
+            return ((), ())
+        if isinstance(selection, str):
+            selection = (selection, )
+
+        selection = set(selection)
+        enabled = lambda handler: handler.name in selection or \
+            handler.feature in selection
+        return (tuple(filter(enabled, HandlerRegistry.pre_handlers)),
+                tuple(filter(enabled, HandlerRegistry.post_handlers)))
+
+    @staticmethod
+    def select_opt_in(selection):
+        """ Names of the opt in handlers enabled by a selection. False if there
+        are none.
+        """
+
+        pre, post = HandlerRegistry.select(selection)
+        names = tuple(handler.name for handler in pre + post
+                      if handler.opt_in)
+        return names if names else False
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import threading
+
+from tasks import FusedTask
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_FILE = ".kisseru_history.json"
+
+
+class TaskHistory(object):
+    """ Resource usage of tasks observed over previous runs
+
+    Samples are kept per task and per metric (e.g: 'peak_rss') and persisted
+    as JSON so that later runs of the same pipeline can plan with them. Only
+    the most recent samples are kept so that the history follows changes to
+    the task or its inputs.
+
+    Attributes:
+        path: JSON file the history is persisted to. None keeps the history in
+            memory only
+        max_samples: Number of recent samples kept per task and metric
+        samples: Samples keyed by task key and then by metric
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE, max_samples=20):
+        self.path = path
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(task):
+        """ Tasks are identified by their function across runs """
+
+        runnable = task.head if isinstance(task, FusedTask) else task
+        return "{}.{}".format(runnable._fn.__module__, task.name)
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path) as fp:
+                self.samples = json.load(fp)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable task history {} ({})".format(
+                self.path, e))
+            self.samples = {}
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self.lock:
+            data = json.dumps(self.samples, indent=2, sort_keys=True)
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            fp.write(data)
+        os.replace(tmp_path, self.path)
+
+    def record(self, task, metric, value):
+        with self.lock:
+            metrics = self.samples.setdefault(self.key(task), {})
+            values = metrics.setdefault(metric, [])
+            values.append(value)
+            del values[:-self.max_samples]
+
+    def get(self, task, metric):
+        with self.lock:
+            return list(
+                self.samples.get(self.key(task), {}).get(metric, []))
+
+    def peak(self, task, metric):
+        """ Largest sample observed. None if there are no samples """
+
+        values = self.get(task, metric)
+        return max(values) if values else None
+
+    def median(self, task, metric):
+        """ Median of the samples. None if there are no samples """
+
+        values = self.get(task, metric)
+        import statistics
+        return statistics.median(values) if values else None
@@ -4,6 +4,7 @@ class Function(object):
         self.scripts = []
         self.line_map = set()
         self.name = None
+        self.is_async = False
         self.indent = -1
         self.body_indent = -1
         self.deco_start = -1
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import marshal
+import os
+import shutil
+import threading
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+from tasks import BatchTask
+from tasks import FusedTask
+from tasks import Sink
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_DIR = ".kisseru_journal"
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+def _code_digest(fn):
+    try:
+        return hashlib.sha1(marshal.dumps(fn.__code__)).hexdigest()
+    except (AttributeError, ValueError):
+        return "{}.{}".format(getattr(fn, '__module__', ''),
+                              getattr(fn, '__name__', ''))
+
+
+def _members(graph):
+    # Tasks which actually run. Fused tasks and batches run through their
+    # members.
+    return [task for tid, task in graph.tasks.items()
+            if not isinstance(task, (FusedTask, BatchTask))]
+
+
+def _upstream(graph):
+    # Parents of each task keyed by task id as (in-port, parent, out-port
+    # index). Worked out from the out-going edges since the in-ports of fused
+    # tasks get replaced when they are fused.
+    parents = {}
+    children = {}
+    for task in _members(graph):
+        parents.setdefault(task.id, [])
+        children.setdefault(task.id, [])
+        for edge in task.edges:
+            if isinstance(edge.dest, Sink):
+                continue
+            child = edge.dest.task_ref
+            if isinstance(child, FusedTask):
+                child = child.head
+            parents.setdefault(child.id, []).append(
+                (edge.dest.name, task, edge.source.index))
+            children[task.id].append(child)
+    return (parents, children)
+
+
+def _topological_order(tasks, parents, children):
+    pending = {task.id: len(parents.get(task.id, [])) for task in tasks}
+    ready = [task for task in tasks if not pending[task.id]]
+    order = []
+    while ready:
+        task = ready.pop()
+        order.append(task)
+        for child in children.get(task.id, []):
+            pending[child.id] -= 1
+            if not pending[child.id]:
+                ready.append(child)
+    return order
+
+
+class Skipped(object):
+    """ Sent downstream in place of the output of a task skipped on resume
+
+    Only tasks which are skipped or replayed themselves receive it. Ports take
+    None to mean there is no value yet, so this can't be None.
+    """
+
+    def __repr__(self):
+        return "<skipped>"
+
+
+class Replay(object):
+    """ Stands in for the runner of a task completed in an earlier run """
+
+    def __init__(self, journal, key, load):
+        self.journal = journal
+        self.key = key
+        self.load = load
+
+    def __call__(self, **kwargs):
+        if not self.load:
+            # Nothing which runs needs the value
+            return Skipped()
+        return self.journal.load(self.key)
+
+
+class RunJournal(object):
+    """ Durable record of the tasks completed during a run of a pipeline
+
+    Each task gets a key which stays the same across runs of an unchanged
+    pipeline. It is derived from the task's code, its immediate arguments and
+    the keys of its upstream tasks. As tasks push their results downstream the
+    results get pickled under the journal directory and a line recording the
+    task key and the location of its output gets appended to the journal.
+
+    On resume tasks found in the journal replay their recorded output instead
+    of running, and tasks which are not needed by anything still to run are
+    skipped altogether. So only the frontier left by the earlier run gets
+    executed. A task returning a file path is only replayed while the file is
+    still around.
+
+    Tasks are journaled as they send their results. Streaming stages, which
+    never hold all of their output at once, and tasks run by the TCP backend,
+    whose outputs stay at the workers, are always run again. So are the tasks
+    of a fused chain with a generated runner unless the tail of the chain
+    completed, since only the tail sends its result.
+
+    Attributes:
+        path: Journal directory of the pipeline
+        keys: Stable key of each task keyed by task id
+        entries: Journal entries keyed by task key
+    """
+
+    def __init__(self, journal_dir, graph):
+        self.path = os.path.join(os.path.abspath(journal_dir), graph.name)
+        self.keys = {}
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._set_keys(graph)
+
+    def _set_keys(self, graph):
+        parents, children = _upstream(graph)
+        order = _topological_order(_members(graph), parents, children)
+        for task in order:
+            digest = hashlib.sha1()
+            digest.update(task.name.encode())
+            digest.update(_code_digest(task._fn).encode())
+            for name, inport in sorted(task.inputs.items()):
+                if inport.is_immediate and name in task._args:
+                    digest.update("{}={!r};".format(
+                        name, task._args[name]).encode())
+            for name, parent, index in sorted(
+                    parents.get(task.id, []), key=lambda p: (p[0], p[2])):
+                digest.update("{}<{}:{};".format(
+                    name, self.keys[parent.id], index).encode())
+            self.keys[task.id] = digest.hexdigest()
+
+    def _output_path(self, key):
+        return os.path.join(self.path, "{}.out".format(key))
+
+    def start(self):
+        """ Starts a new journal discarding what earlier runs recorded """
+
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+    def open(self):
+        """ Loads the journal of an earlier run """
+
+        os.makedirs(self.path, exist_ok=True)
+        journal_file = os.path.join(self.path, JOURNAL_FILE)
+        if not os.path.isfile(journal_file):
+            return
+
+        with open(journal_file) as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partially written last line of a run which died
+                    continue
+                if self._is_valid(entry):
+                    self.entries[entry['key']] = entry
+
+    def _is_valid(self, entry):
+        if not os.path.isfile(entry.get('output', '')):
+            return False
+        for path, size in entry.get('files', []):
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def record(self, task, value):
+        """ Records that the task completed with the given output """
+
+        # Failed tasks send None which never reaches their consumers
+        key = self.keys.get(task.id, None)
+        if key is None or key in self.entries or value is None or \
+                isinstance(task._runner, Replay):
+            return
+
+        output = self._output_path(key)
+        tmp_path = "{}.{}.{}.tmp".format(output, os.getpid(),
+                                         threading.get_ident())
+        try:
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, output)
+        except Exception as e:
+            log.warning("Not journaling {} since its output can't be "
+                        "pickled ({})".format(task.name, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        entry = {'key': key, 'task': task.name, 'output': output}
+        if isinstance(value, str) and os.path.isfile(value):
+            path = os.path.abspath(value)
+            entry['files'] = [(path, os.path.getsize(path))]
+
+        # Single appending write so that concurrent tasks (possibly in other
+        # processes) don't interleave their lines
+        with self.lock:
+            with open(os.path.join(self.path, JOURNAL_FILE), 'a') as fp:
+                fp.write(json.dumps(entry) + "\n")
+            self.entries[key] = entry
+
+    def load(self, key):
+        with open(self.entries[key]['output'], 'rb') as fp:
+            return pickle.load(fp)
+
+    def resume(self, graph):
+        """ Rewires the graph so that only the tasks left to be run execute
+
+        Returns:
+            Number of tasks which will be replayed or skipped
+        """
+
+        parents, children = _upstream(graph)
+        order = _topological_order(_members(graph), parents, children)
+
+        # A task runs if it did not complete earlier and something still to
+        # be run, or the pipeline output, needs it
+        runs = set()
+        for task in reversed(order):
+            completed = self.keys[task.id] in self.entries
+            needed = task.is_sink or any(
+                child.id in runs for child in children[task.id])
+            if not completed and needed:
+                runs.add(task.id)
+
+        for task in order:
+            if task.id in runs:
+                continue
+
+            key = self.keys[task.id]
+            load = key in self.entries and (task.is_sink or any(
+                child.id in runs for child in children[task.id]))
+            task._runner = Replay(self, key, load)
+            # Replaying is cheap. Keep it off the executors.
+            task.executor = 'inline'
+            task.is_streaming = False
+
+        for tid, task in graph.tasks.items():
+            if isinstance(task, FusedTask):
+                task.executor = task.head.executor
+                task.is_streaming = task.head.is_streaming
+                # Chains call the runners of replayed members instead
+                task.bind_runners()
+            elif isinstance(task, BatchTask) and any(
+                    isinstance(member._runner, Replay)
+                    for member in task.tasks):
+                # Members get replayed (or run) one by one
+                task._runner = task.run_each
+        return len(order) - len(runs)
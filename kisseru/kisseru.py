@@ -1,9 +1,8 @@
-import ast
 import functools
 import logging
-import os
 import platform
 import inspect
+import time
 
 from handler import HandlerContext
 from handler import HandlerRegistry
@@ -12,25 +11,19 @@ from tracer import TraceExit
 from func import ASTOps
 from profiler import ProfilerEntry
 from profiler import ProfilerExit
+from cprofiler import CProfileEntry
+from cprofiler import CProfileExit
 from passes import PassManager
 from passes import PassContext
 from passes import PassResult
-from typed import TypeCheck
-from transform import Transform
-from stage import Stage
+from passes import CompileStats
 from tasks import gen_task
+from tasks import gen_map_task
 from tasks import TaskGraph
-from tasks import PreProcess
-from tasks import PostProcess
 from backend import BackendType
 from backend import BackendConfig
 from backend import Backend
-from dot import DotGraphGenerator
-from fusion import Fusion
 from colors import Colors
-from local import LocalNonThreadedBackend
-from local import LocalThreadedBackend
-from slurm import SlurmBackend
 
 xls = 'xls'
 csv = 'csv'
@@ -46,33 +39,39 @@ prof_entry = ProfilerEntry("ProfilerEntry")
 prof_exit = ProfilerExit("ProfilerExit")
 logger_entry = TraceEntry("TraceEntry")
 logger_exit = TraceExit("TraceExit")
+cprof_entry = CProfileEntry("CProfileEntry")
+cprof_exit = CProfileExit("CProfileExit")
 ast_ops = ASTOps("ASTOps")
 
 HandlerRegistry.register_init_handler(ast_ops)
 
+# Opt in. Enabled with handlers=('cprofile', ...). Registered innermost so
+# that the other handlers don't show up in the captures.
 HandlerRegistry.register_pre_handler(logger_entry)
 HandlerRegistry.register_pre_handler(prof_entry)
+HandlerRegistry.register_pre_handler(cprof_entry)
+HandlerRegistry.register_post_handler(cprof_exit)
 HandlerRegistry.register_post_handler(prof_exit)
 HandlerRegistry.register_post_handler(logger_exit)
 
-# Setup graph IR passes
-preprocess = PreProcess("Graph Preprocess")
-type_check = TypeCheck("Type Check")
-transform = Transform("Data Type Transformation")
-stage = Stage("Stage Data")
-fusion = Fusion("Fuse Tasks")
-dot_before = DotGraphGenerator("Dot Graph Generation", "before")
-dot_after = DotGraphGenerator("Dot Graph Generation", "after")
-postprocess = PostProcess("Graph Postprocess")
-
-PassManager.register_pass(preprocess)
-PassManager.register_pass(dot_before)
-PassManager.register_pass(type_check)
-PassManager.register_pass(transform)
-PassManager.register_pass(stage)
-PassManager.register_pass(fusion)
-PassManager.register_pass(dot_after)
-PassManager.register_pass(postprocess)
+# Setup graph IR passes. Pass modules (and their dependencies, e.g: pandas for
+# Transform) get imported when the first app is compiled. Backends get
+# imported when they are first used (see Backend.get_backend). Importing
+# kisseru, as each job driver and spawned worker does, stays cheap.
+PassManager.register_lazy_pass("tasks", "PreProcess", "Graph Preprocess")
+PassManager.register_lazy_pass("dot", "DotGraphGenerator",
+                               "Dot Graph Generation", "before")
+PassManager.register_lazy_pass("typed", "TypeCheck", "Type Check")
+PassManager.register_lazy_pass("transform", "Transform",
+                               "Data Type Transformation")
+PassManager.register_lazy_pass("stage", "Stage", "Stage Data")
+PassManager.register_lazy_pass("specialize", "Specialize",
+                               "Specialize Runners")
+PassManager.register_lazy_pass("batching", "Batching", "Batch Tasks")
+PassManager.register_lazy_pass("fusion", "Fusion", "Fuse Tasks")
+PassManager.register_lazy_pass("dot", "DotGraphGenerator",
+                               "Dot Graph Generation", "after")
+PassManager.register_lazy_pass("tasks", "PostProcess", "Graph Postprocess")
 
 params = {'split': None}
 _graph = TaskGraph()
@@ -80,8 +79,7 @@ _graph = TaskGraph()
 
 def task(**configs):
     def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
+        def init_context():
             # Run task init handlers
             ctx = HandlerContext(func)
             # We need to save the signature meta data before we run the
@@ -93,15 +91,39 @@ def task(**configs):
             ctx.sig = inspect.signature(func)
             for init in HandlerRegistry.init_handlers:
                 init.run(ctx)
+            return ctx
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            ctx = init_context()
 
             global _graph
-            task, tasklets = gen_task(ctx.fn, ctx.sig, args, kwargs)
+            task, tasklets = gen_task(ctx.fn, ctx.sig, args, kwargs, configs)
             _graph.add_task(task)
             if tasklets == ():
                 return task
             else:
                 return tasklets
 
+        def map_task(items, *args, **kwargs):
+            """ Expands the task over the elements of items at runtime
+
+            items is usually the output of an upstream task producing a list.
+            It is passed element by element as the first argument of the task
+            while the rest of the arguments are shared by all the elements.
+            Results are gathered in to a list in the order of the elements.
+            """
+            ctx = init_context()
+
+            global _graph
+            task, _ = gen_map_task(ctx.fn, ctx.sig, items, args, kwargs,
+                                   configs)
+            _graph.add_task(task)
+            return task
+
+        # Marks the wrapper as a task for the graph cache
+        wrapper.task_configs = configs
+        wrapper.map = map_task
         return wrapper
 
     return decorator
@@ -111,6 +133,7 @@ def app(**configs):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            _graph.reset()
             _graph.name = func.__name__
             print(Colors.OKRED +
                   "[KISSERU] Compiling pipeline {}".format(_graph.name) +
@@ -128,15 +151,26 @@ def app(**configs):
 class AppRunner(object):
     def __init__(self,
                  app,
-                 backend="local"):
+                 backend="local",
+                 **options):
         self.app = app
+        self.options = options
 
         if backend == "slurm":
-            config = BackendConfig(BackendType.SLURM, "Slurm")
+            config = BackendConfig(BackendType.SLURM, "Slurm", options)
         elif backend == "local":
-            config = BackendConfig(BackendType.LOCAL, "Local Threaded")
+            config = BackendConfig(BackendType.LOCAL, "Local Threaded",
+                                   options)
         elif backend == "serial":
-            config = BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial")
+            config = BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial",
+                                   options)
+        elif backend == "hybrid":
+            config = BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid",
+                                   options)
+        elif backend == "tcp":
+            config = BackendConfig(BackendType.TCP, "Tcp", options)
+        elif backend == "async":
+            config = BackendConfig(BackendType.ASYNC, "Async", options)
         else:
             raise Exception("Unknown backend {}".format(backend))
 
@@ -145,23 +179,98 @@ class AppRunner(object):
         if platform.system().startswith("Darwin") and \
                 config.backend_type == BackendType.LOCAL:
             config = BackendConfig(BackendType.LOCAL_NON_THREADED,
-                                   "Local Non Threaded")
+                                   "Local Non Threaded", options)
 
         Backend.set_current_backend(config)
         self.backend = Backend.get_current_backend()
         print("[KISSERU] Using '{}' backend\n".format(self.backend.name))
 
+    def _load_cached(self, stats):
+        cache_dir = self.options.get('cache_dir', None)
+        if not cache_dir:
+            return (None, None, None)
+
+        from cache import AppKey
+        from cache import GraphCache
+
+        key = AppKey(self.app, self.backend.name, self.options).digest
+        if not key:
+            return (None, None, None)
+
+        cache = GraphCache(cache_dir)
+        step = stats.begin("Cache Load")
+        graph = cache.load(key)
+        stats.end(step, graph)
+        return (cache, key, graph)
+
+    def _finish_compile(self, graph, stats):
+        print("")
+        print(Colors.OKBLUE +
+              "[KISSERU] Running pipeline {}".format(graph.name) +
+              Colors.ENDC)
+        print("========================================")
+        print("")
+
+        stats.graph_name = graph.name
+        stats.finish()
+        graph.compile_stats = stats
+        for line in stats.report():
+            log.info(line)
+
+        stats_file = self.options.get('stats_file', None)
+        if stats_file:
+            stats.dump(stats_file)
+        return graph
+
     def compile(self):
+        """ Compiles the app in to a graph ready to be run on the backend
+
+        Compile options given to the runner,
+
+            trace_memory: Trace memory allocated by each pass. Off by default
+                since tracing slows down compilation
+            stats_file: Write compile statistics as JSON to this file
+            cache_dir: Cache compiled graphs in this directory. A graph is
+                reused as long as the app, the tasks it uses, its arguments
+                and the backend stay the same
+            dot: Write the graph before and after optimization as dot files
+                to the working directory. Off by default
+
+        Returns:
+            The compiled TaskGraph
+        """
+
+        # Wall time, graph size and optionally memory of each compilation step
+        # are recorded in to graph.compile_stats
+        stats = CompileStats(self.options.get('trace_memory', False))
+        stats.start()
+
+        # Skip compilation altogether if we already compiled the same app
+        cache, key, graph = self._load_cached(stats)
+        if graph:
+            print(Colors.OKRED +
+                  "[Compiler] Loaded compiled pipeline {} from cache ...\n".
+                  format(graph.name) + Colors.ENDC)
+            return self._finish_compile(graph, stats)
+
         # Get the task graph by running the app specification
+        step = stats.begin("App Specification")
         graph = self.app()
+        stats.end(step, graph)
 
         # Now run the passes on the graph IR. PassContext holds any errors
         # encountered during the graph processing. We fail fast if we encounter
         # any errors during a pass.
-        ctx = PassContext()
-        for p in PassManager.passes:
+        ctx = PassContext(self.options)
+        passes = PassManager.get_passes()
+        steps = []
+        for p in passes:
+            step = stats.begin(p.name, p.tag, graph)
             res = p.run(graph, ctx)
+            stats.end(step, graph)
+            steps.append(step)
             if res == PassResult.ERROR:
+                stats.finish()
                 # [TODO] Print user friendly error message using the ctx
                 # information here
                 raise Exception("Aborting pipeline compilation due to errors")
@@ -176,22 +285,65 @@ class AppRunner(object):
         # print("Dumping task {}".format(str(tid)))
         # task.dump()
 
+        # Run any post code generation tasks which passes may run for
+        # tearing down or saving computed results
+        for p, step in zip(passes, steps):
+            start = time.perf_counter()
+            res = p.post_run(graph, ctx)
+            step.post_run_s = time.perf_counter() - start
+
+        if cache:
+            step = stats.begin("Cache Store", graph=graph)
+            cache.store(key, graph)
+            stats.end(step, graph)
+
         # Finally push the validated (and hopefully optimized) graph IR to
         # specified code generation backend or runner given we didn't encounter
         # any errors during the graph processing passes
-        print("")
-        print(Colors.OKBLUE +
-              "[KISSERU] Running pipeline {}".format(_graph.name) +
-              Colors.ENDC)
-        print("========================================")
-        print("")
+        return self._finish_compile(graph, stats)
+
+    def _open_journal(self, graph):
+        journal_dir = self.options.get('journal', None)
+        if not journal_dir:
+            if self.options.get('resume', False):
+                raise Exception("Resuming {} requires a journal".format(
+                    graph.name))
+            return
+
+        from journal import DEFAULT_JOURNAL_DIR
+        from journal import RunJournal
+
+        if journal_dir is True:
+            journal_dir = DEFAULT_JOURNAL_DIR
+        journal = RunJournal(journal_dir, graph)
+        if self.options.get('resume', False):
+            journal.open()
+            done = journal.resume(graph)
+            print(Colors.OKBLUE + "[KISSERU] Resuming pipeline {}. {} of {} "
+                  "tasks are already done".format(graph.name, done,
+                                                  len(journal.keys)) +
+                  Colors.ENDC)
+        else:
+            journal.start()
+        graph.journal = journal
 
-        # Run any post code generation tasks which passes may run for
-        # tearing down or saving computed results
-        for p in PassManager.passes:
-            res = p.post_run(graph, ctx)
+    def run(self):
+        """ Compiles and runs the app
 
-        return graph
+        Run options given to the runner,
+
+            journal: Record completed tasks and their outputs in this
+                directory (True picks '.kisseru_journal')
+            resume: Resume the journaled run. Tasks completed by the earlier
+                run are not run again
+        """
+
+        graph = self.compile()
+        self._open_journal(graph)
+        try:
+            self.backend.run_flow(graph)
+        finally:
+            self.backend.cleanup(graph)
 
     def package(self, app_dir, out_file):
         graph = self.compile()
@@ -1,19 +1,41 @@
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import platform
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import queue
+import threading
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
 
 from tasks import Port
 from tasks import FusedTask
+from tasks import MapTask
+from tasks import Sink
+from tasks import gen_runner
+from tasks import run_sync
+from payload import remote
 from backend import Backend
+from accounting import ResourceMeter
+from accounting import take_port_bytes
+from cprofiler import take_profiles
+from process import ChildProcess
 from process import ProcessFactory
+from metrics import RunMetrics
+from history import DEFAULT_HISTORY_FILE
+from history import TaskHistory
+from utils import fmt_bytes
+from utils import parse_bytes
+from utils import sizeof
+from stream import DEFAULT_BUFFER
+from stream import Stream
+from stream import pump
 from logger import TaskLogger
 from logger import ThreadLocalLogger
 from logger import MonoChromeLogger
 from logger import LogColor
+import transfer
 
 log = logging.getLogger(__name__)
 
@@ -47,11 +69,16 @@ class LocalThreadedPort(Port):
         Port.__init__(self, typ, name, index, task)
         self.is_one_sided_receive = True
 
+    def release(self):
+        # Each in-port gets a transfer file of its own. So the file can go as
+        # soon as the task owning the in-port has run.
+        filename = "{}_{}".format(self.task_ref.id, self.name)
+        if os.path.isfile(filename):
+            os.remove(filename)
+
     def send(self, value, to_port):
         filename = "{}_{}".format(to_port.task_ref.id, to_port.name)
-        fp = open(filename, 'wb')
-        pickle.dump(value, fp)
-        fp.close()
+        transfer.write(self, value, filename)
 
         to_port.receive(filename, self)
 
@@ -60,11 +87,8 @@ class LocalThreadedPort(Port):
             # This receive was invoked as a callback from the task.
             filename = "{}_{}".format(self.task_ref.id, self.name)
             if os.path.isfile(filename):
-                fp = open(filename, 'rb')
-                value = pickle.load(fp)
-                fp.close()
-
-                self.task_ref._args[self.name] = value
+                self.task_ref._args[self.name] = transfer.read(filename,
+                                                               self)
             return
 
         # Notify the task that it got a new input
@@ -96,21 +120,48 @@ class LocalNonThreadedBackend(Backend):
 
     def run_flow(self, graph):
         self.logger = TaskLogger("{}.log".format(graph.name))
+        metrics = RunMetrics(graph.name, self.name)
+        # Tasks run one after the other on this thread. So do their profiles
+        # get taken.
+        take_profiles()
         for tid, source in graph.sources.items():
             source.run()
         self.logger.flush()
 
+        for profile in take_profiles():
+            metrics.profile.add(profile)
+        metrics.publish(graph, self.config.options.get('metrics_file', None),
+                        self.config.options.get('profile_dir', None))
+
     def cleanup(self, graph):
         pass
 
 
 @Backend.register_backend
 class LocalThreadedBackend(Backend):
+    """ Runs each task in a process of its own forked off its parent task
+
+    Values get passed between tasks through transfer files. Each task process
+    meters the resources it used along with the bytes of the transfer files
+    it read and wrote and ships them back to the driver, which aggregates
+    them in to the run metrics once the graph has completed.
+
+    Attributes:
+        usage: Queue task processes put their (task id, resource usage) on
+        started: Number of task processes started during the run
+    """
+
     name = "LOCAL"
 
+    # Seconds to wait on the usage of a task process which has already
+    # completed its task
+    USAGE_TIMEOUT = 10
+
     def __init__(self, backend_config):
         Backend.__init__(self, backend_config)
         self.logger = None
+        self.usage = None
+        self.started = None
 
         # [NOTE] We have to disable proxies to get some libraries working
         # (e.g: urllib, scikitlearn) with multiprocessing
@@ -129,7 +180,11 @@ class LocalThreadedBackend(Backend):
 
     def run_task(self, task):
         def threaded_task(task):
-            task.run()
+            with ResourceMeter() as meter:
+                task.run()
+            usage = meter.usage
+            usage.update(take_port_bytes(task))
+            self.usage.put((str(task.id), usage))
             # Flush the thread local log in case task.run() did not result in
             # spawning a new thread (process).
             self.logger.flush()
@@ -147,11 +202,31 @@ class LocalThreadedBackend(Backend):
             if platform.system().startswith("Darwin"):
                 os.environ["no_proxy"] = "*"
 
+            with self.started.get_lock():
+                self.started.value += 1
             ProcessFactory.create_process(threaded_task, (task, ))
         else:
             task.run()
 
+    def _collect_usage(self, graph, metrics):
+        # Each task process puts its usage after running its task, and so
+        # after having started the processes of its children
+        for _ in range(self.started.value):
+            try:
+                tid, usage = self.usage.get(timeout=self.USAGE_TIMEOUT)
+            except queue.Empty:
+                log.warning("Missing resource usage of {} task "
+                            "processes".format(self.started.value -
+                                               len(metrics.resources)))
+                return
+            task = graph.get_task(uuid.UUID(tid))
+            metrics.record_usage(task, usage, executor='process')
+
     def run_flow(self, graph):
+        metrics = RunMetrics(graph.name, self.name)
+        self.usage = multiprocessing.Queue()
+        self.started = multiprocessing.Value('i', 0)
+
         for tid, source in graph.sources.items():
             self.run_task(source)
 
@@ -159,6 +234,10 @@ class LocalThreadedBackend(Backend):
             with graph.done:
                 graph.done.wait()
 
+        self._collect_usage(graph, metrics)
+        metrics.publish(graph, self.config.options.get('metrics_file', None),
+                        self.config.options.get('profile_dir', None))
+
     def cleanup(self, graph):
         # Remove temporary files used for transferring data between python
         # threads (processes)
@@ -168,3 +247,446 @@ class LocalThreadedBackend(Backend):
                     filename = "{}_{}".format(task.id, param)
                     if os.path.isfile(filename):
                         os.remove(filename)
+            transfer.remove_shared(task)
+
+
+@Backend.register_backend
+class LocalHybridBackend(Backend):
+    """ Runs each task with the executor it asked for via @task(executor=...)
+
+    All tasks share in-memory local ports. So values never get pickled unless
+    the task leaves the driver process (i.e: 'process' and 'subprocess'
+    executors) and even then only the task inputs and results cross the
+    process boundary. Tasks which do not specify an executor use the
+    'default_executor' backend option which defaults to 'process'.
+
+    Given the 'mem_budget' option (bytes or a size like '8G') ready tasks are
+    only admitted while the sum of their memory estimates stays within the
+    budget. A task's estimate is what it declared via @task(mem=...), or else
+    the largest peak RSS observed for it in earlier runs, or else the
+    'default_mem' option. Peak RSS is observed for tasks run with the
+    'process' executor and kept in a TaskHistory file ('history_file' option).
+    Among the ready tasks the ones freeing the most input memory get admitted
+    first. A task is always admitted when nothing else is running, even if it
+    alone exceeds the budget.
+
+    Generator tasks run as streaming stages. Each chunk they yield is pushed
+    to their consumers right away through a bounded Stream per edge, holding
+    at most @task(buffer=...) chunks (or the 'stream_buffer' option). A stage
+    is blocked once its slowest consumer falls that far behind. Consumers
+    start as soon as their streams are connected and iterate over them. The
+    producers and consumers of streams run on threads of their own regardless
+    of the executor they asked for and are not subject to admission control,
+    since they have to run side by side. Chunks reaching a sink are collected
+    in to a list.
+
+    Map tasks are coordinated from a thread of their own while each of their
+    elements gets run with the executor the task asked for. Elements are not
+    subject to admission control either.
+
+    Given the 'speculate' option, 'process' tasks marked @task(idempotent=True)
+    which run 'speculation_factor' (2 by default) times longer than their
+    median duration in earlier runs get a duplicate launched. Whichever copy
+    finishes first is taken and the other one is terminated. Tasks are never
+    speculated on within 'speculation_min' seconds (1 by default). Durations
+    are kept in the TaskHistory alongside peak RSS. Speculative launches and
+    their outcomes are recorded in the run metrics, which get written to the
+    'metrics_file' option if given.
+
+    The run metrics also account for the resources used by each task (and
+    each map element) where it ran. That is user and system CPU time, peak
+    RSS, context switches, bytes read and written and the bytes of its
+    pickled result if it left the driver process. Executions sharing the
+    driver get metered per thread. The resource table aggregating them per
+    task gets logged at the end of the run. Tasks run with the 'cprofile'
+    handler enabled are profiled where they run and their merged collapsed
+    stacks and top functions get written to the 'profile_dir' option (the
+    current directory by default).
+
+    Attributes:
+        pool: Thread pool running 'thread' tasks. Also hosts the threads
+            waiting on 'process' and 'subprocess' tasks
+        dispatched: Tasks which have been handed to an executor so far
+        in_flight: Number of tasks dispatched but not yet completed
+        errors: Internal errors encountered while running tasks
+        mem_budget: Memory budget in bytes. None disables admission control
+        history: TaskHistory of observed peak RSS and durations. None unless
+            admission control or speculation is on
+        ready: Tasks waiting for admission as (priority, task, estimate)
+        reserved: Memory estimates of admitted tasks keyed by task id
+        mem_in_use: Sum of the memory estimates of admitted tasks
+        mem_peak: Largest mem_in_use seen during the run
+        stream_buffer: Default number of chunks buffered per stream
+        speculate: Whether idempotent straggler tasks get a duplicate launched
+        metrics: RunMetrics of the current run
+    """
+
+    name = "LOCAL_HYBRID"
+
+    def __init__(self, backend_config):
+        Backend.__init__(self, backend_config)
+        self.logger = None
+        self.pool = None
+        self.dispatched = set()
+        self.in_flight = 0
+        self.errors = []
+        self.monitor = threading.Condition()
+        self.default_executor = self.config.options.get(
+            'default_executor', 'process')
+
+        # Admission control
+        options = self.config.options
+        self.mem_budget = parse_bytes(options.get('mem_budget', None))
+        self.default_mem = parse_bytes(options.get('default_mem', 0))
+
+        # Speculative execution
+        self.speculate = options.get('speculate', False)
+        self.speculation_factor = options.get('speculation_factor', 2.0)
+        self.speculation_min = options.get('speculation_min', 1.0)
+        self.metrics = None
+
+        self.history = None
+        if self.mem_budget is not None or self.speculate:
+            self.history = TaskHistory(
+                options.get('history_file', DEFAULT_HISTORY_FILE))
+        self.ready = []
+        self.reserved = {}
+        self.mem_in_use = 0
+        self.mem_peak = 0
+
+        self.stream_buffer = options.get('stream_buffer', DEFAULT_BUFFER)
+
+    def get_port(self, typ, name, index, task):
+        return LocalPort(typ, name, index, task)
+
+    def package(self):
+        pass
+
+    def deploy(self):
+        pass
+
+    def get_executor(self, task):
+        # Streams live in the driver and the stages connected by them block
+        # on each other. So each such stage needs a thread of its own.
+        if task.is_streaming or any(isinstance(value, Stream)
+                                    for value in task._args.values()):
+            return 'stream'
+        # Map tasks only wait on their elements
+        runnable = task.head if isinstance(task, FusedTask) else task
+        if isinstance(runnable, MapTask):
+            return 'map'
+        if task.executor:
+            return task.executor
+        return self.default_executor
+
+    def speculates(self, task):
+        """ Whether a duplicate of the task may be launched if it straggles """
+
+        # A fused chain with a generated runner gets run as a whole
+        members = [task.head] if isinstance(task, FusedTask) else [task]
+        if isinstance(task, FusedTask) and task._runner is not None:
+            members = task.tasks
+        return self.speculate and all(
+            member.configs.get('idempotent', False) for member in members) \
+            and self.history.median(task, 'duration') is not None
+
+    def _run_speculative(self, task, fn, usage):
+        median = self.history.median(task, 'duration')
+        deadline = max(self.speculation_min, self.speculation_factor * median)
+        primary = ChildProcess(fn, task._args)
+        if primary.wait(deadline):
+            return primary.result(usage)
+
+        log.info("Task {} is still running after {:.1f}s. Launching a "
+                 "duplicate".format(task.name, deadline))
+        backup = ChildProcess(fn, task._args)
+        self.metrics.incr('speculative_launches')
+        self.metrics.event('speculative_launch', task, median_s=median,
+                           deadline_s=deadline)
+
+        ready = multiprocessing.connection.wait(
+            [primary.reader, backup.reader])
+        first, second = (primary, backup) if primary.reader in ready else \
+            (backup, primary)
+        winner = 'primary' if first is primary else 'backup'
+        try:
+            ret = first.result(usage)
+            second.terminate()
+        except Exception as e:
+            # The other copy may still make it
+            log.warning("{} copy of {} failed ({}). Waiting on the other "
+                        "one".format(winner, task.name, e))
+            winner = 'backup' if first is primary else 'primary'
+            ret = second.result(usage)
+
+        self.metrics.incr('speculative_{}_won'.format(winner))
+        self.metrics.event('speculative_outcome', task, winner=winner)
+        return ret
+
+    def estimate_mem(self, task):
+        """ Memory a task is expected to need while running in bytes """
+
+        runnable = task.head if isinstance(task, FusedTask) else task
+        declared = parse_bytes(runnable.configs.get('mem', None))
+        if declared is not None:
+            return declared
+
+        observed = self.history.peak(task, 'peak_rss')
+        if observed is not None:
+            return observed
+        return self.default_mem
+
+    def freed_bytes(self, task):
+        """ Input memory which can be freed once the task has run
+
+        Consumers of an upstream value share it. So each consumer is accounted
+        for its share of the value.
+        """
+
+        freed = 0
+        for name, inport in task.inputs.items():
+            if inport.is_immediate or not inport.inport_edge:
+                continue
+            source = inport.inport_edge.source
+            consumers = sum(1 for edge in source.task_ref.edges
+                            if edge.source.index == source.index)
+            freed += sizeof(task._args.get(name, None)) // max(1, consumers)
+        return freed
+
+    def _admit(self):
+        # Called with the monitor held. Returns the tasks to be dispatched.
+        admitted = []
+        self.ready.sort(key=lambda entry: entry[0])
+        for entry in list(self.ready):
+            priority, task, estimate = entry
+            fits = self.mem_in_use + estimate <= self.mem_budget
+            # Never let the pipeline stall on a task larger than the budget
+            idle = not self.reserved and not admitted
+            if fits or idle:
+                self.ready.remove(entry)
+                self.reserved[task.id] = estimate
+                self.mem_in_use += estimate
+                self.mem_peak = max(self.mem_peak, self.mem_in_use)
+                admitted.append(task)
+        return admitted
+
+    def _release(self, task):
+        # Called with the monitor held
+        estimate = self.reserved.pop(task.id, None)
+        if estimate is None:
+            return []
+        self.mem_in_use -= estimate
+        return self._admit()
+
+    def _dispatch(self, task):
+        executor = self.get_executor(task)
+        if executor == 'inline':
+            self._execute(task, executor)
+        elif executor == 'stream':
+            # Bound the input streams before the producers get ahead
+            for value in task._args.values():
+                if isinstance(value, Stream):
+                    value.attach()
+            threading.Thread(target=self._execute, args=(task, executor),
+                             daemon=True).start()
+        elif executor == 'map':
+            # Waiting on the elements from within the pool could starve it
+            threading.Thread(target=self._execute, args=(task, executor),
+                             daemon=True).start()
+        else:
+            self.pool.submit(self._execute, task, executor)
+
+    def run_task(self, task):
+        # Each parent delivering the last input races to run the task. Only
+        # dispatch it once.
+        with self.monitor:
+            if task.id in self.dispatched:
+                return
+            self.dispatched.add(task.id)
+            self.in_flight += 1
+
+            admitted = [task]
+            # Inline tasks are glue code. Not worth holding back. Streaming
+            # stages can't be held back without stalling their peers and map
+            # tasks only coordinate their elements.
+            if self.mem_budget is not None and self.get_executor(task) \
+                    not in ('inline', 'stream', 'map'):
+                priority = (-self.freed_bytes(task), len(self.dispatched))
+                self.ready.append((priority, task, self.estimate_mem(task)))
+                admitted = self._admit()
+
+        for admitted_task in admitted:
+            self._dispatch(admitted_task)
+
+    def _run_element(self, task, executor, item, kwargs):
+        usage = {}
+        if executor == 'process':
+            ret = ProcessFactory.run_in_process(
+                task.run_element, {'item': item, 'kwargs': kwargs}, usage)
+        elif executor == 'subprocess':
+            runner = gen_runner(remote(task._fn, usage, task.handlers),
+                                task._element_sig)
+            ret = run_sync(runner(**task.element_args(item, kwargs)))
+        else:
+            with ResourceMeter(per_thread=True) as meter:
+                ret = task.run_element(item, kwargs)
+            usage = meter.usage
+        self.metrics.record_usage(task, usage, executor=executor)
+        return ret
+
+    def run_map(self, task, items, kwargs):
+        executor = task.executor if task.executor else self.default_executor
+        if executor == 'inline':
+            with ResourceMeter(per_thread=True) as meter:
+                ret = Backend.run_map(self, task, items, kwargs)
+            self.metrics.record_usage(task, meter.usage, executor=executor)
+            return ret
+
+        futures = [
+            self.pool.submit(self._run_element, task, executor, item, kwargs)
+            for item in items
+        ]
+        return [future.result() for future in futures]
+
+    def _stream(self, runnable, gen):
+        # Connect the consumers first so that they start reading while the
+        # chunks are being produced
+        buffer = runnable.configs.get('buffer', self.stream_buffer)
+        streams = []
+        sinks = []
+        for edge in runnable.edges:
+            if isinstance(edge.dest, Sink):
+                sinks.append(edge)
+                continue
+            stream = Stream(runnable.name, buffer)
+            edge.send(stream)
+            streams.append(stream)
+
+        collected = [] if sinks else None
+        count = pump(gen, streams, collected)
+        log.debug("Streamed {} chunks from {}".format(count, runnable.name))
+        for edge in sinks:
+            edge.send(collected)
+
+    def _execute(self, task, executor):
+        admitted = []
+        inputs = [value for value in task._args.values()
+                  if isinstance(value, Stream)]
+        try:
+            # A fused task without a generated runner runs its head on behalf
+            # of the fused region. Rest of the region gets pushed through the
+            # head's local ports. So does one run in a subprocess since the
+            # generated runner can't be shipped to another interpreter.
+            runnable = task
+            if isinstance(task, FusedTask) and (task._runner is None or
+                                                executor == 'subprocess'):
+                runnable = task.head
+
+            usage = {}
+            meter = ResourceMeter(per_thread=True)
+            if executor == 'stream' and runnable.is_streaming:
+                with meter:
+                    self._stream(runnable, runnable._runner(**task._args))
+                self.metrics.record_usage(task, meter.usage,
+                                          executor=executor)
+                task.release_inputs()
+                if runnable is task:
+                    task.graph.mark_completed(task.id)
+                return
+            elif executor == 'process':
+                fn = lambda **kwargs: run_sync(runnable._runner(**kwargs))
+                if self.speculates(task):
+                    ret = self._run_speculative(task, fn, usage)
+                else:
+                    ret = ProcessFactory.run_in_process(fn, task._args, usage)
+                if self.history:
+                    for metric in ('peak_rss', 'duration'):
+                        if metric in usage:
+                            self.history.record(task, metric, usage[metric])
+            elif executor == 'subprocess':
+                runner = gen_runner(
+                    remote(runnable._fn, usage, runnable.handlers),
+                    runnable._sig)
+                ret = runner(**task._args)
+            elif executor == 'map':
+                # Elements get accounted for as they run
+                ret = run_sync(runnable._runner(**task._args))
+            else:
+                with meter:
+                    ret = run_sync(runnable._runner(**task._args))
+                usage = meter.usage
+            if executor != 'map':
+                self.metrics.record_usage(task, usage, executor=executor)
+
+            task.release_inputs()
+            # Task is done with its memory. Make room for the tasks waiting
+            # for admission before pushing the results downstream.
+            with self.monitor:
+                admitted = self._release(task)
+            for admitted_task in admitted:
+                self._dispatch(admitted_task)
+
+            runnable.send(ret)
+            if runnable is task:
+                task.graph.mark_completed(task.id)
+        except Exception as e:
+            log.exception("Failed running task {}".format(task.name))
+            self.errors.append(e)
+        finally:
+            # Let the upstream stages go on even if the task stopped reading
+            # before the end of its streams
+            for stream in inputs:
+                stream.cancel()
+            with self.monitor:
+                admitted = self._release(task)
+                self.in_flight -= 1
+                self.monitor.notify_all()
+            for admitted_task in admitted:
+                self._dispatch(admitted_task)
+
+    def run_flow(self, graph):
+        # The backend may be reused across runs. Nothing of the previous run
+        # should leak in to this one.
+        with self.monitor:
+            self.dispatched = set()
+            self.in_flight = 0
+            self.errors = []
+            self.ready = []
+            self.reserved = {}
+            self.mem_in_use = 0
+            self.mem_peak = 0
+
+        self.logger = TaskLogger("{}.log".format(graph.name),
+                                 line_buffered=True)
+        self.metrics = RunMetrics(graph.name, self.name)
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.config.options.get('max_workers', 32))
+
+        for tid, source in graph.sources.items():
+            self.run_task(source)
+
+        # Completing tasks dispatch their children before they are accounted
+        # as done. So nothing being in flight means the graph has completed.
+        with self.monitor:
+            while self.in_flight:
+                self.monitor.wait()
+
+        self.pool.shutdown()
+        self.logger.flush()
+
+        if self.mem_budget is not None:
+            log.info("Peak reserved memory {} of the {} budget".format(
+                fmt_bytes(self.mem_peak), fmt_bytes(self.mem_budget)))
+        if self.history:
+            self.history.save()
+
+        self.metrics.publish(graph,
+                             self.config.options.get('metrics_file', None),
+                             self.config.options.get('profile_dir', None))
+
+        if self.errors:
+            raise Exception("Pipeline {} failed with {} errors".format(
+                graph.name, len(self.errors)))
+
+    def cleanup(self, graph):
+        pass
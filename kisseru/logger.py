@@ -1,3 +1,4 @@
+import re
 from enum import Enum
 
 from multiprocessing import Lock
@@ -5,6 +6,8 @@ from multiprocessing import Lock
 from colors import Colors
 from handler import Handler
 
+_ANSI_COLOR = re.compile('\033[^m]*m?')
+
 
 class LogColor(Enum):
     GREEN = 0
@@ -14,23 +17,15 @@ class LogColor(Enum):
 
 
 class TaskLogger(object):
-    def __init__(self, logfile):
-        self.fp = open(logfile, "a")
+    def __init__(self, logfile, line_buffered=False):
+        # Loggers shared with forked children need to be line buffered.
+        # Otherwise lines buffered at fork get written twice and lines logged
+        # by children may never make it to the file
+        self.fp = open(logfile, "a", buffering=1 if line_buffered else -1)
 
     def _strip_ansi_colors(self, log_str):
-        new_log_str = ''
-        skip = False
-        for c in log_str:
-            if c == '\033':
-                skip = True
-                continue
-            elif c == 'm' and skip:
-                skip = False
-                continue
-
-            if not skip:
-                new_log_str += c
-        return new_log_str
+        # Escape sequences run from the escape character up to the next 'm'
+        return _ANSI_COLOR.sub('', log_str)
 
     def log(self, log_str):
         # Write to stdout
@@ -0,0 +1,202 @@
+import json
+import logging
+import platform
+import threading
+import time
+
+from accounting import PROFILE_FIELD
+from accounting import merge
+from cprofiler import RunProfile
+from tasks import Sink
+from utils import fmt_bytes
+
+log = logging.getLogger(__name__)
+
+
+class RunMetrics(object):
+    """ Instrumentation of a pipeline run
+
+    Backends count notable runtime occurrences (e.g: speculative launches) and
+    record an event for each of them with the details. They also record the
+    resources used by each task execution as measured by a ResourceMeter in
+    the worker running it. Executions get aggregated per task in to the
+    resource table of the run.
+
+    Attributes:
+        graph_name: Name of the graph run
+        backend: Name of the backend running the graph
+        counters: Occurrence counts keyed by name
+        events: Recorded events in the order they happened. Each has its kind,
+            the task it is about and seconds since the start of the run ('at')
+        resources: Resource usage of each task execution in the order they
+            completed. Each has the task, its id, the executor it ran with,
+            the fields of accounting.FIELDS which could be measured and when
+            it started and ended in seconds since the start of the run
+        profile: RunProfile merging the cProfile captures shipped with the
+            usage of the executions. Empty unless the 'cprofile' handler was
+            enabled
+        topology: Executable units of the graph (i.e: tasks not run as a part
+            of a fused task or a batch) and the edges between them. Recorded
+            once the run is published
+        total_s: Seconds the run took
+    """
+
+    def __init__(self, graph_name=None, backend=None):
+        self.graph_name = graph_name
+        self.backend = backend
+        self.counters = {}
+        self.events = []
+        self.resources = []
+        self.profile = RunProfile(graph_name)
+        self.topology = None
+        self.total_s = 0.0
+        self.lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._started_at = time.time()
+
+    def incr(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def event(self, kind, task, **fields):
+        entry = {
+            'kind': kind,
+            'task': task.name,
+            'at': time.perf_counter() - self._start,
+        }
+        entry.update(fields)
+        with self.lock:
+            self.events.append(entry)
+
+    def record_usage(self, task, usage, **fields):
+        entry = {'task': task.name, 'tid': str(task.id)}
+        entry.update(fields)
+        entry.update(usage)
+        for profile in entry.pop(PROFILE_FIELD, []):
+            self.profile.add(profile)
+
+        # Workers time stamp executions with the wall clock. Executions
+        # recorded without one are taken to have just ended.
+        duration = usage.get('duration', 0.0)
+        if 'started_at' in usage:
+            entry['start'] = usage['started_at'] - self._started_at
+            entry['end'] = entry['start'] + duration
+        else:
+            entry['end'] = time.perf_counter() - self._start
+            entry['start'] = entry['end'] - duration
+        with self.lock:
+            self.resources.append(entry)
+
+    def resource_table(self):
+        """ Resource usage aggregated per task name
+
+        CPU time, context switches, I/O and port bytes add up across the
+        executions of a task while peak RSS is the largest seen. Durations are
+        summed too and 'executions' counts them.
+        """
+
+        with self.lock:
+            resources = list(self.resources)
+
+        table = {}
+        for entry in resources:
+            row = table.setdefault(entry['task'], {'executions': 0})
+            row['executions'] += 1
+            merge(row, entry)
+        for row in table.values():
+            row.pop('started_at', None)
+        return table
+
+    def record_topology(self, graph):
+        units = {}
+        for tid, task in graph.tasks.items():
+            unit = self._unit(graph, task)
+            units[str(unit.id)] = unit.name
+
+        edges = set()
+        for tid, task in graph.tasks.items():
+            source = self._unit(graph, task)
+            for edge in task.edges:
+                if isinstance(edge.dest, Sink):
+                    continue
+                dest = self._unit(graph, edge.dest.task_ref)
+                if dest is not source:
+                    edges.add((str(source.id), str(dest.id)))
+        self.topology = {'units': units, 'edges': sorted(edges)}
+
+    @staticmethod
+    def _unit(graph, task):
+        task = graph.fusee_map.get(task.id, task)
+        batch = getattr(task, 'batch', None)
+        return batch if batch is not None else task
+
+    def finish(self):
+        self.total_s = time.perf_counter() - self._start
+
+    def publish(self, graph, metrics_file=None, profile_dir=None):
+        """ Finishes the metrics of the run on the graph, logs the report and
+        writes the metrics to the given file as JSON if any. Tasks profiled
+        during the run get their collapsed stacks and top functions written
+        to the given directory (the current one if None).
+        """
+
+        self.finish()
+        self.record_topology(graph)
+        graph.run_metrics = self
+        for line in self.report():
+            log.info(line)
+        if metrics_file:
+            self.dump(metrics_file)
+        if len(self.profile):
+            paths = self.profile.dump(profile_dir if profile_dir else ".")
+            log.info("Task profiles written to {} and {}".format(*paths))
+
+    def to_dict(self):
+        # The table takes the lock itself
+        table = self.resource_table()
+        with self.lock:
+            return {
+                'graph': self.graph_name,
+                'backend': self.backend,
+                'python': platform.python_version(),
+                'total_s': self.total_s,
+                'counters': dict(self.counters),
+                'events': list(self.events),
+                'resources': list(self.resources),
+                'resource_table': table,
+                'topology': self.topology,
+            }
+
+    def dump(self, path):
+        """ Writes the metrics to the given file as JSON """
+
+        with open(path, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=2)
+
+    def report(self):
+        lines = ["{:<32} {:>9}".format("Counter", "count")]
+        for name, count in sorted(self.counters.items()):
+            lines.append("{:<32} {:>9}".format(name[:32], count))
+
+        table = self.resource_table()
+        if table:
+            lines.append("{:<24} {:>5} {:>9} {:>9} {:>9} {:>9} {:>9} "
+                         "{:>9}".format("Task", "runs", "user_s", "sys_s",
+                                        "peak_rss", "read", "written",
+                                        "port_io"))
+            # Memory hogs first
+            for name, row in sorted(table.items(),
+                                    key=lambda item: -item[1].get(
+                                        'peak_rss', 0)):
+                lines.append(
+                    "{:<24} {:>5} {:>9.3f} {:>9.3f} {:>9} {:>9} {:>9} "
+                    "{:>9}".format(
+                        name[:24], row['executions'],
+                        row.get('cpu_user_s', 0), row.get('cpu_sys_s', 0),
+                        fmt_bytes(row.get('peak_rss', 0)),
+                        fmt_bytes(row.get('read_bytes', 0)),
+                        fmt_bytes(row.get('write_bytes', 0)),
+                        fmt_bytes(row.get('bytes_in', 0) +
+                                  row.get('bytes_out', 0))))
+        lines.append("Total : {:.3f}s".format(self.total_s))
+        return lines
@@ -1,4 +1,9 @@
 import abc
+import importlib
+import json
+import platform
+import time
+import tracemalloc
 
 from colors import Colors
 from enum import Enum
@@ -11,10 +16,12 @@ class PassResult(Enum):
 
 
 class PassContext(object):
-    def __init__(self):
+    def __init__(self, options=None):
         self.errors = []
         self.warnings = []
         self.properties = {}
+        # Options the app runner was given. Lets passes be configured per run
+        self.options = options if options else {}
 
 
 class Pass(metaclass=abc.ABCMeta):
@@ -35,8 +42,181 @@ class Pass(metaclass=abc.ABCMeta):
 
 
 class PassManager(object):
+    """ Passes run on the graph IR in the order they were registered
+
+    Passes can be registered by module and class name. Those get created the
+    first time passes are looked up (i.e: when an app gets compiled), so that
+    importing kisseru doesn't import the passes and what they depend on.
+    """
+
     passes = []
 
     @staticmethod
     def register_pass(p):
         PassManager.passes.append(p)
+
+    @staticmethod
+    def register_lazy_pass(module, cls, *args):
+        """ Registers the pass module.cls(*args) to be created on demand """
+        PassManager.passes.append((module, cls, args))
+
+    @staticmethod
+    def get_passes():
+        for index, p in enumerate(PassManager.passes):
+            if type(p) == tuple:
+                module, cls, args = p
+                PassManager.passes[index] = getattr(
+                    importlib.import_module(module), cls)(*args)
+        return PassManager.passes
+
+
+class PassStats(object):
+    """ Statistics of a single compilation step
+
+    Attributes:
+        name: Pass name
+        tag: Pass tag
+        wall_s: Seconds spent in the pass run
+        post_run_s: Seconds spent in the pass post run
+        tasks_before: Tasks in the graph (including fused ones) before the pass
+        tasks_after: Tasks in the graph (including fused ones) after the pass
+        units_before: Executable units (tasks not fused in to another task)
+            before the pass
+        units_after: Executable units after the pass
+        edges_before: Edges in the graph before the pass
+        edges_after: Edges in the graph after the pass
+        mem_alloc_bytes: Net memory allocated by the pass. None unless memory
+            is being traced
+        mem_peak_bytes: Peak memory allocated during the pass. None unless
+            memory is being traced
+    """
+
+    def __init__(self, name, tag=""):
+        self.name = name
+        self.tag = tag
+        self.wall_s = 0.0
+        self.post_run_s = 0.0
+        self.tasks_before = 0
+        self.tasks_after = 0
+        self.units_before = 0
+        self.units_after = 0
+        self.edges_before = 0
+        self.edges_after = 0
+        self.mem_alloc_bytes = None
+        self.mem_peak_bytes = None
+
+    @property
+    def label(self):
+        return "{} ({})".format(self.name, self.tag) if self.tag else self.name
+
+    def to_dict(self):
+        return dict(self.__dict__, label=self.label)
+
+
+class CompileStats(object):
+    """ Instrumentation of a graph compilation
+
+    The app specification run which builds the graph is recorded as the first
+    step followed by each pass in the order they were run.
+
+    Attributes:
+        graph_name: Name of the compiled graph
+        trace_memory: Whether memory allocated by each step is traced with
+            tracemalloc. Tracing slows down compilation considerably
+        steps: PassStats for each compilation step
+        total_s: Seconds spent compiling
+    """
+
+    def __init__(self, trace_memory=False):
+        self.graph_name = None
+        self.trace_memory = trace_memory
+        self.steps = []
+        self.total_s = 0.0
+        self._started_tracing = False
+        self._start = None
+        self._step_start = None
+        self._mem_start = 0
+
+    def _count(self, graph):
+        if graph is None:
+            return (0, 0, 0)
+
+        tasks = graph.tasks.values()
+        units = sum(1 for task in tasks if not task.is_fusee)
+        edges = sum(len(task.edges) for task in tasks)
+        return (len(graph.tasks), units, edges)
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.perf_counter()
+
+    def finish(self):
+        self.total_s = time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def begin(self, name, tag="", graph=None):
+        """ Starts measuring a compilation step
+
+        Args:
+            name: Step name
+            tag: Step tag
+            graph: Graph before the step. None if the step creates the graph
+
+        Returns:
+            PassStats to be passed to end() once the step is done
+        """
+
+        step = PassStats(name, tag)
+        (step.tasks_before, step.units_before,
+         step.edges_before) = self._count(graph)
+        self.steps.append(step)
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self._mem_start = tracemalloc.get_traced_memory()[0]
+        self._step_start = time.perf_counter()
+        return step
+
+    def end(self, step, graph):
+        step.wall_s = time.perf_counter() - self._step_start
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            step.mem_alloc_bytes = current - self._mem_start
+            step.mem_peak_bytes = peak - self._mem_start
+        (step.tasks_after, step.units_after,
+         step.edges_after) = self._count(graph)
+
+    def to_dict(self):
+        return {
+            'graph': self.graph_name,
+            'python': platform.python_version(),
+            'total_s': self.total_s,
+            'trace_memory': self.trace_memory,
+            'steps': [step.to_dict() for step in self.steps],
+        }
+
+    def dump(self, path):
+        """ Writes the statistics to the given file as JSON """
+
+        with open(path, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=2)
+
+    def report(self):
+        lines = [
+            "{:<32} {:>9} {:>9} {:>15} {:>15} {:>10}".format(
+                "Step", "run", "post run", "tasks", "edges", "mem")
+        ]
+        for step in self.steps:
+            mem = "-" if step.mem_alloc_bytes is None else "{:.1f} KB".format(
+                step.mem_alloc_bytes / 1024.0)
+            lines.append("{:<32} {:>8.3f}s {:>8.3f}s {:>15} {:>15} {:>10}".format(
+                step.label[:32], step.wall_s, step.post_run_s,
+                "{} -> {}".format(step.tasks_before, step.tasks_after),
+                "{} -> {}".format(step.edges_before, step.edges_after), mem))
+        lines.append("Total : {:.3f}s".format(self.total_s))
+        return lines
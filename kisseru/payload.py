@@ -0,0 +1,184 @@
+import functools
+import importlib
+import importlib.util
+import inspect
+import marshal
+import multiprocessing
+import os
+import pickle
+import sys
+import types
+
+from accounting import ResourceMeter
+from handler import HandlerRegistry
+
+# Application modules loaded from their files keyed by path
+_app_modules = {}
+
+
+def _is_main(module, path):
+    main_path = getattr(module, '__file__', None)
+    return not path or not main_path or \
+        os.path.abspath(main_path) == os.path.abspath(path)
+
+
+def _get_module(name, path):
+    # Module is already loaded in this interpreter (always the case for the
+    # driver and for forked workers). An application run as a script is only
+    # __main__ in the interpreter it was run in though. Elsewhere (e.g: a
+    # Slurm job driver) __main__ is some other script.
+    module = sys.modules.get(name, None)
+    if module and (name != "__main__" or _is_main(module, path)):
+        return module
+
+    if name != "__main__":
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            pass
+
+    if path and not os.path.isfile(path):
+        # Packaged applications get their files copied to the job directory
+        path = os.path.basename(path)
+
+    if path and os.path.isfile(path):
+        # The application module may not be importable by name (e.g: it was
+        # run as a script). Load it from its file instead.
+        module = _app_modules.get(os.path.abspath(path), None)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(
+                "__kisseru_app__", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _app_modules[os.path.abspath(path)] = module
+        return module
+    raise Exception("Unable to load module {} of a task".format(name))
+
+
+def pack_function(fn):
+    """ Packs a task function so that it can be shipped to another python
+    interpreter.
+
+    Task functions are recompiled by ASTOps at decoration time so they are not
+    importable by name. We ship the compiled code object instead, and resolve
+    its global scope from the module the task was defined in on the other end.
+
+    Args:
+        fn: Task function
+
+    Returns:
+        A picklable dictionary describing the function
+    """
+
+    if fn.__closure__:
+        raise Exception(
+            "Task {} is a closure and cannot be shipped".format(fn.__name__))
+
+    module = sys.modules.get(fn.__module__, None)
+    return {
+        'name': fn.__name__,
+        'module': fn.__module__,
+        'path': getattr(module, '__file__', None),
+        'code': marshal.dumps(fn.__code__),
+        'defaults': fn.__defaults__,
+    }
+
+
+def function_hash(packed):
+    """ Content hash of a packed function. Used for caching task code """
+
+    import hashlib
+    digest = hashlib.sha1(packed['code'])
+    digest.update(packed['module'].encode())
+    return digest.hexdigest()
+
+
+def unpack_function(packed):
+    # Need these to be in the global environment of the function since ASTOps
+    # generates calls to them for inlined bash scripts
+    from bash import run_script
+    from bash import run_script_async
+    from bash import set_assignments
+
+    module = _get_module(packed['module'], packed['path'])
+    globs = module.__dict__.copy()
+    globs['run_script'] = run_script
+    globs['run_script_async'] = run_script_async
+    globs['set_assignments'] = set_assignments
+
+    code = marshal.loads(packed['code'])
+    return types.FunctionType(
+        code, globs, name=packed['name'], argdefs=packed['defaults'])
+
+
+def call_packed(packed, args, handlers, conn):
+    # Entry point of a spawned interpreter
+    try:
+        fn = unpack_function(packed)
+        if handlers:
+            from tasks import gen_runner
+            fn = gen_runner(fn, inspect.signature(fn), handlers)
+        kwargs = pickle.loads(args)
+        with ResourceMeter() as meter:
+            ret = fn(**kwargs)
+            if inspect.isawaitable(ret):
+                import asyncio
+                ret = asyncio.run(ret)
+            elif inspect.isgenerator(ret):
+                ret = list(ret)
+        conn.send_bytes(
+            pickle.dumps((True, ret, meter.usage), pickle.HIGHEST_PROTOCOL))
+    except BaseException as e:
+        conn.send((False, repr(e), {}))
+    finally:
+        conn.close()
+
+
+def remote(fn, usage=None, handlers=False):
+    """ Wraps a task function so that each call is run in a freshly spawned
+    python interpreter. Only the packed function, the arguments and the return
+    value cross the interpreter boundary.
+
+    Args:
+        fn: Task function
+        usage: If given gets updated with the resource usage of each call in
+            the spawned interpreter (see ResourceMeter) and the sizes of the
+            pickled arguments sent over ('bytes_in') and of the pickled result
+            sent back ('bytes_out')
+        handlers: Handlers enabled for the task. Callers wrap the returned
+            function in a runner of their own, so only the opt in handlers
+            (e.g: 'cprofile') get run around the call in the spawned
+            interpreter.
+    """
+
+    packed = pack_function(fn)
+    handlers = HandlerRegistry.select_opt_in(handlers)
+
+    @functools.wraps(fn)
+    def run_remote(**kwargs):
+        ctx = multiprocessing.get_context('spawn')
+        reader, writer = ctx.Pipe(duplex=False)
+        args = pickle.dumps(kwargs, pickle.HIGHEST_PROTOCOL)
+        p = ctx.Process(target=call_packed,
+                        args=(packed, args, handlers, writer))
+        p.start()
+        writer.close()
+        try:
+            data = reader.recv_bytes()
+            ok, value, child_usage = pickle.loads(data)
+        except EOFError:
+            raise Exception("Interpreter running {} exited abruptly".format(
+                fn.__name__))
+        finally:
+            reader.close()
+            p.join()
+
+        if not ok:
+            raise Exception("{} failed with {}".format(fn.__name__, value))
+        if usage is not None:
+            usage.update(child_usage)
+            usage['bytes_in'] = len(args)
+            usage['bytes_out'] = len(data)
+        return value
+
+    return run_remote
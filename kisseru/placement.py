@@ -0,0 +1,175 @@
+import logging
+
+from collections import defaultdict
+
+from tasks import FusedTask
+from utils import fmt_bytes
+
+log = logging.getLogger(__name__)
+
+
+class Holding(object):
+    """ A task output held at a worker
+
+    Attributes:
+        address: Worker holding the output
+        n_bytes: Bytes that need to be moved for another worker to get the
+            output. For files this is the size of the file itself
+        is_file: True if the output is a path to a file local to the worker
+    """
+
+    def __init__(self, address, n_bytes, is_file):
+        self.address = address
+        self.n_bytes = n_bytes
+        self.is_file = is_file
+
+
+class PlacementDecision(object):
+    """ Records where a task was placed and what that cost in data movement
+
+    Attributes:
+        task: Name of the placed task
+        address: Worker the task was placed on
+        bytes_moved: Input bytes which had to be pulled from other workers
+        bytes_local: Input bytes which were already at the chosen worker
+        reason: Why the worker was chosen
+    """
+
+    def __init__(self, task, address, bytes_moved, bytes_local, reason):
+        self.task = task
+        self.address = address
+        self.bytes_moved = bytes_moved
+        self.bytes_local = bytes_local
+        self.reason = reason
+
+    def __str__(self):
+        return "{} -> {}:{} (moved {}, local {}, {})".format(
+            self.task, self.address[0], self.address[1],
+            fmt_bytes(self.bytes_moved), fmt_bytes(self.bytes_local),
+            self.reason)
+
+
+class LocalityPlanner(object):
+    """ Places tasks on workers so that as little data as possible moves
+
+    The planner keeps track of which worker holds each task output and how
+    large it is. A task is placed on the worker already holding most of its
+    input bytes. Files are only meaningful at the worker which produced them,
+    so consumers of files always follow the file. Staging tasks are placed on
+    a worker which already staged the same resource if there is one, which
+    lets the worker skip fetching it again.
+
+    Locality is traded for parallelism only when it is cheap. If a task's
+    inputs are smaller than 'spread_bytes' in total and a less busy worker
+    exists the task goes there instead.
+
+    Attributes:
+        workers: Worker addresses to place tasks on
+        spread_bytes: Input size under which tasks may move to less busy
+            workers
+        holdings: Holding for each task output keyed by (task id, out index)
+        staged: Worker which staged a given resource keyed by its URL
+        load: Number of tasks in flight at each worker
+        decisions: PlacementDecision for each placed task in placement order
+    """
+
+    def __init__(self, workers, spread_bytes=1024 * 1024):
+        self.workers = workers
+        self.spread_bytes = spread_bytes
+        self.holdings = {}
+        self.staged = {}
+        self.load = defaultdict(int)
+        self.decisions = []
+
+    def _least_loaded(self, candidates):
+        # Order of the workers list breaks ties so that placement is
+        # deterministic
+        return min(candidates, key=lambda address: self.load[address])
+
+    def _get_inputs(self, graph, unit):
+        head = unit.head if isinstance(unit, FusedTask) else unit
+        holdings = []
+        for name, inport in head.inputs.items():
+            if not inport.is_immediate and inport.inport_edge:
+                source = inport.inport_edge.source
+                parent = graph.fusee_map.get(source.task_ref.id,
+                                             source.task_ref)
+                holding = self.holdings.get((parent.id, source.index), None)
+                if holding:
+                    holdings.append(holding)
+        return holdings
+
+    def _get_staged_url(self, unit):
+        head = unit.head if isinstance(unit, FusedTask) else unit
+        if head.is_staging:
+            return head._args.get('infile', None)
+        return None
+
+    def place(self, graph, unit):
+        """ Picks the worker to place the unit on and records the decision """
+
+        holdings = self._get_inputs(graph, unit)
+        url = self._get_staged_url(unit)
+
+        files = [holding for holding in holdings if holding.is_file]
+        if url and url in self.staged:
+            address = self.staged[url]
+            reason = "already staged"
+        elif files:
+            address = max(files, key=lambda h: h.n_bytes).address
+            reason = "co-located with input file"
+        elif holdings:
+            local = defaultdict(int)
+            for holding in holdings:
+                local[holding.address] += holding.n_bytes
+            most = max(local.values())
+            address = self._least_loaded(
+                [w for w in self.workers if local[w] == most])
+            reason = "co-located with inputs"
+
+            idlest = self._least_loaded(self.workers)
+            total = sum(local.values())
+            if total < self.spread_bytes and \
+                    self.load[idlest] < self.load[address]:
+                address = idlest
+                reason = "spread to less busy worker"
+        else:
+            address = self._least_loaded(self.workers)
+            reason = "least loaded"
+
+        bytes_local = sum(h.n_bytes for h in holdings if h.address == address)
+        bytes_moved = sum(h.n_bytes for h in holdings if h.address != address)
+
+        if url:
+            self.staged[url] = address
+
+        self.load[address] += 1
+        decision = PlacementDecision(unit.name, address, bytes_moved,
+                                     bytes_local, reason)
+        self.decisions.append(decision)
+        log.debug("Placed {}".format(decision))
+        return address
+
+    def record_outputs(self, unit, address, sizes):
+        """ Records the outputs a unit left at the worker it ran on
+
+        Args:
+            unit: The completed unit
+            address: Worker the unit ran on
+            sizes: (serialized bytes, file bytes or None) keyed by out index
+        """
+
+        self.load[address] -= 1
+        for index, (n_bytes, file_bytes) in sizes.items():
+            is_file = file_bytes is not None
+            self.holdings[(unit.id, index)] = Holding(
+                address, file_bytes if is_file else n_bytes, is_file)
+
+    def bytes_moved(self):
+        return sum(decision.bytes_moved for decision in self.decisions)
+
+    def report(self):
+        lines = list(map(str, self.decisions))
+        lines.append("Total bytes moved : {}".format(
+            fmt_bytes(self.bytes_moved())))
+        return lines
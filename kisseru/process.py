@@ -1,5 +1,77 @@
+import pickle
+
 from multiprocessing import Process
 from multiprocessing import Barrier
+from multiprocessing import Pipe
+
+from accounting import ResourceMeter
+
+
+def _run_and_send(fn, kwargs, conn):
+    # A forked child starts off with the memory of its parent. The meter only
+    # counts what the task added on top of that.
+    try:
+        with ResourceMeter() as meter:
+            ret = fn(**kwargs)
+        conn.send_bytes(
+            pickle.dumps((True, ret, meter.usage), pickle.HIGHEST_PROTOCOL))
+    except BaseException as e:
+        conn.send((False, repr(e), {}))
+    finally:
+        conn.close()
+
+
+class ChildProcess(object):
+    """ A function running in a child process
+
+    Attributes:
+        name: Name of the function. Used for error reporting
+        process: The child process
+        reader: Connection the result arrives on
+    """
+
+    def __init__(self, fn, kwargs):
+        self.name = getattr(fn, '__name__', fn)
+        self.reader, writer = Pipe(duplex=False)
+        self.process = Process(target=_run_and_send,
+                               args=(fn, kwargs, writer))
+        self.process.start()
+        writer.close()
+
+    def wait(self, timeout=None):
+        """ Waits for the result
+
+        Returns:
+            True if the result is ready within the timeout
+        """
+
+        return self.reader.poll(timeout)
+
+    def result(self, usage=None):
+        """ Blocks until the child is done and returns its result """
+
+        try:
+            data = self.reader.recv_bytes()
+            ok, value, child_usage = pickle.loads(data)
+        except EOFError:
+            raise Exception("Process running {} exited abruptly".format(
+                self.name))
+        finally:
+            self.reader.close()
+            self.process.join()
+
+        if not ok:
+            raise Exception("Process running {} failed with {}".format(
+                self.name, value))
+        if usage is not None:
+            usage.update(child_usage)
+            usage['bytes_out'] = len(data)
+        return value
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.join()
+        self.reader.close()
 
 
 class ProcessFactory(object):
@@ -20,6 +92,25 @@ class ProcessFactory(object):
         p.start()
         ProcessFactory.processes.append(p)
 
+    @staticmethod
+    def run_in_process(fn, kwargs, usage=None):
+        """ Runs fn in a child process and returns its result.
+
+        The child inherits fn and its arguments from the parent, so only the
+        return value gets pickled on its way back.
+
+        Args:
+            fn: Function to run
+            kwargs: Arguments to the function
+            usage: If given gets updated with resource usage of the child as
+                measured by a ResourceMeter (e.g: 'peak_rss' is the peak
+                resident memory the run added in bytes and 'duration' is the
+                seconds fn took to run). 'bytes_out' is the size of the
+                pickled result sent back
+        """
+
+        return ChildProcess(fn, kwargs).result(usage)
+
     @staticmethod
     def join_all():
         print("Joining all threads")
@@ -46,7 +46,7 @@ class Timer:
 
 class ProfilerEntry(Handler):
     def __init__(self, name):
-        Handler.__init__(self, name)
+        Handler.__init__(self, name, "profile")
 
     def run(self, ctx):
         timer = Timer()
@@ -56,7 +56,7 @@ class ProfilerEntry(Handler):
 
 class ProfilerExit(Handler):
     def __init__(self, name):
-        Handler.__init__(self, name)
+        Handler.__init__(self, name, "profile")
 
     def run(self, ctx):
         timer = ctx.get('__timer__')
@@ -0,0 +1,340 @@
+import html
+import json
+
+# Dispatch delays shorter than this are not reported as scheduler gaps
+DEFAULT_MIN_GAP = 0.01
+
+# Slack within this many seconds counts as none (i.e: the task is critical)
+EPSILON = 1e-6
+
+
+class UnitTiming(object):
+    """ Observed timing of an executable unit over all of its executions
+
+    Attributes:
+        tid: Id of the unit
+        name: Name of the unit
+        start: Seconds since the start of the run its first execution started
+        end: Seconds since the start of the run its last execution ended
+        executions: Number of executions recorded (e.g: map elements)
+        parents: Ids of the units it got inputs from
+        children: Ids of the units it sent outputs to
+        earliest_start: Earliest it could have started had every unit run as
+            soon as its inputs were ready
+        latest_start: Latest it could have started without delaying the run
+    """
+
+    def __init__(self, tid, name):
+        self.tid = tid
+        self.name = name
+        self.start = None
+        self.end = None
+        self.executions = 0
+        self.parents = []
+        self.children = []
+        self.earliest_start = 0.0
+        self.latest_start = 0.0
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.executions else 0.0
+
+    @property
+    def slack(self):
+        return self.latest_start - self.earliest_start
+
+    @property
+    def critical(self):
+        return self.slack <= EPSILON
+
+
+class RunReport(object):
+    """ Critical path and slack analysis of a recorded run
+
+    Built from the JSON a backend writes to the 'metrics_file' option, which
+    has the timings of each task execution and the topology of the graph.
+    Timings are those observed, so that the analysis reflects where the run
+    actually spent its time.
+
+    The critical path is the chain of units with no slack when the units are
+    scheduled as early as their inputs allow using their observed durations.
+    Speeding up anything off of it doesn't shorten the run. Slack of a unit is
+    how much it could have been delayed without delaying the run.
+
+    Parallelism is the number of units running over time. Idle gaps are the
+    spans nothing was running and scheduler gaps are the delays between a
+    unit's inputs being ready and it starting.
+
+    Attributes:
+        graph: Name of the graph run
+        backend: Backend which ran the graph
+        total_s: Seconds the run took
+        units: UnitTiming of each unit keyed by its id
+        order: Ids of the units in topological order
+        makespan: Length of the critical path in seconds
+        min_gap: Shortest dispatch delay reported as a scheduler gap
+    """
+
+    def __init__(self, metrics, min_gap=DEFAULT_MIN_GAP):
+        topology = metrics.get('topology', None)
+        if not topology:
+            raise Exception("Run metrics have no graph topology. Were they "
+                            "written by a backend recording it?")
+
+        self.graph = metrics.get('graph', None)
+        self.backend = metrics.get('backend', None)
+        self.total_s = metrics.get('total_s', 0.0)
+        self.min_gap = min_gap
+
+        self.units = {}
+        for tid, name in topology['units'].items():
+            self.units[tid] = UnitTiming(tid, name)
+        for source, dest in topology['edges']:
+            self.units[source].children.append(dest)
+            self.units[dest].parents.append(source)
+
+        for entry in metrics.get('resources', []):
+            unit = self.units.get(entry['tid'], None)
+            if unit is None or 'start' not in entry:
+                continue
+            unit.executions += 1
+            unit.start = entry['start'] if unit.start is None else \
+                min(unit.start, entry['start'])
+            unit.end = entry['end'] if unit.end is None else \
+                max(unit.end, entry['end'])
+
+        self.order = self._topological_order()
+        self.makespan = self._schedule()
+
+    @staticmethod
+    def load(path, min_gap=DEFAULT_MIN_GAP):
+        with open(path) as fp:
+            return RunReport(json.load(fp), min_gap)
+
+    def _topological_order(self):
+        n_parents = {
+            tid: len(unit.parents) for tid, unit in self.units.items()
+        }
+        ready = sorted(tid for tid, n in n_parents.items() if n == 0)
+        order = []
+        while ready:
+            tid = ready.pop()
+            order.append(tid)
+            for child in self.units[tid].children:
+                n_parents[child] -= 1
+                if not n_parents[child]:
+                    ready.append(child)
+        if len(order) != len(self.units):
+            raise Exception("Graph {} is not a DAG".format(self.graph))
+        return order
+
+    def _schedule(self):
+        # Forward pass for the earliest and backward pass for the latest start
+        # of each unit under its observed duration
+        for tid in self.order:
+            unit = self.units[tid]
+            unit.earliest_start = max(
+                [self.units[p].earliest_start + self.units[p].duration
+                 for p in unit.parents] or [0.0])
+
+        makespan = max([unit.earliest_start + unit.duration
+                        for unit in self.units.values()] or [0.0])
+
+        for tid in reversed(self.order):
+            unit = self.units[tid]
+            latest_end = min([self.units[c].latest_start
+                              for c in unit.children] or [makespan])
+            unit.latest_start = latest_end - unit.duration
+        return makespan
+
+    def critical_path(self):
+        """ Units on the critical path in the order they ran """
+
+        path = []
+        candidates = [tid for tid in self.order
+                      if not self.units[tid].parents]
+        while candidates:
+            critical = [tid for tid in candidates
+                        if self.units[tid].critical and
+                        abs(self.units[tid].earliest_start -
+                            (self._end_of(path[-1]) if path else 0.0)) <=
+                        EPSILON]
+            if not critical:
+                break
+            # Longest critical unit first so that zero duration units don't
+            # cut the path short
+            tid = max(critical, key=lambda t: self.units[t].duration)
+            path.append(tid)
+            candidates = self.units[tid].children
+        return [self.units[tid] for tid in path]
+
+    def _end_of(self, tid):
+        unit = self.units[tid]
+        return unit.earliest_start + unit.duration
+
+    def parallelism(self):
+        """ Number of units running over time
+
+        Returns:
+            List of (seconds since the start, units running from then on)
+        """
+
+        changes = []
+        for unit in self.units.values():
+            if unit.executions:
+                changes.append((unit.start, 1))
+                changes.append((unit.end, -1))
+        changes.sort()
+
+        timeline = []
+        running = 0
+        for at, change in changes:
+            running += change
+            if timeline and timeline[-1][0] == at:
+                timeline[-1] = (at, running)
+            else:
+                timeline.append((at, running))
+        return timeline
+
+    def average_parallelism(self):
+        span = self.observed_span()
+        if span <= 0:
+            return 0.0
+        busy = sum(unit.duration for unit in self.units.values())
+        return busy / span
+
+    def observed_span(self):
+        ran = [unit for unit in self.units.values() if unit.executions]
+        if not ran:
+            return 0.0
+        return max(unit.end for unit in ran) - min(unit.start for unit in ran)
+
+    def idle_gaps(self):
+        """ Spans in which no unit was running as (start, end) """
+
+        gaps = []
+        timeline = self.parallelism()
+        for (at, running), (next_at, _) in zip(timeline, timeline[1:]):
+            if running == 0 and next_at - at >= self.min_gap:
+                gaps.append((at, next_at))
+        return gaps
+
+    def scheduler_gaps(self):
+        """ Units which started well after their inputs were ready
+
+        Returns:
+            List of (unit, seconds its start got delayed) with the longest
+            delays first
+        """
+
+        gaps = []
+        for unit in self.units.values():
+            parents = [self.units[p] for p in unit.parents
+                       if self.units[p].executions]
+            if not unit.executions or not parents:
+                continue
+            delay = unit.start - max(parent.end for parent in parents)
+            if delay >= self.min_gap:
+                gaps.append((unit, delay))
+        gaps.sort(key=lambda gap: -gap[1])
+        return gaps
+
+    def text(self):
+        lines = ["Run of {} on {} took {:.3f}s".format(self.graph,
+                                                     self.backend,
+                                                     self.total_s)]
+        path = self.critical_path()
+        lines.append("Critical path : {:.3f}s over {} units".format(
+            self.makespan, len(path)))
+        for unit in path:
+            lines.append("  {:<32} {:>9.3f}s".format(unit.name[:32],
+                                                     unit.duration))
+
+        lines.append("{:<32} {:>5} {:>10} {:>10} {:>10}".format(
+            "Task", "runs", "duration", "start", "slack"))
+        for unit in sorted(self.units.values(), key=lambda u: u.slack):
+            lines.append("{:<32} {:>5} {:>9.3f}s {:>9.3f}s {:>9.3f}s".format(
+                unit.name[:32], unit.executions, unit.duration,
+                unit.start if unit.executions else 0.0, unit.slack))
+
+        lines.append("Average parallelism : {:.2f} (peak {})".format(
+            self.average_parallelism(),
+            max([running for at, running in self.parallelism()] or [0])))
+
+        idle = self.idle_gaps()
+        lines.append("Idle gaps : {} totalling {:.3f}s".format(
+            len(idle), sum(end - start for start, end in idle)))
+        for start, end in idle:
+            lines.append("  {:>9.3f}s - {:>9.3f}s".format(start, end))
+
+        delayed = self.scheduler_gaps()
+        lines.append("Scheduler gaps : {}".format(len(delayed)))
+        for unit, delay in delayed:
+            lines.append("  {:<32} waited {:.3f}s".format(unit.name[:32],
+                                                          delay))
+        return lines
+
+    def html(self):
+        body = ["<html><head><title>{}</title></head><body>".format(
+            html.escape(str(self.graph)))]
+        body.append("<h1>Run of {} on {}</h1>".format(
+            html.escape(str(self.graph)), html.escape(str(self.backend))))
+        body.append("<p>Took {:.3f}s. Critical path {:.3f}s. Average "
+                    "parallelism {:.2f}.</p>".format(
+                        self.total_s, self.makespan,
+                        self.average_parallelism()))
+
+        body.append("<h2>Critical path</h2><ol>")
+        for unit in self.critical_path():
+            body.append("<li>{} ({:.3f}s)</li>".format(
+                html.escape(unit.name), unit.duration))
+        body.append("</ol>")
+
+        body.append("<h2>Tasks</h2><table border=1><tr><th>Task</th>"
+                    "<th>Runs</th><th>Duration (s)</th><th>Start (s)</th>"
+                    "<th>Slack (s)</th></tr>")
+        for unit in sorted(self.units.values(), key=lambda u: u.slack):
+            style = ' style="color:red"' if unit.critical else ""
+            body.append("<tr{}><td>{}</td><td>{}</td><td>{:.3f}</td>"
+                        "<td>{:.3f}</td><td>{:.3f}</td></tr>".format(
+                            style, html.escape(unit.name), unit.executions,
+                            unit.duration,
+                            unit.start if unit.executions else 0.0,
+                            unit.slack))
+        body.append("</table>")
+
+        body.append("<h2>Idle gaps</h2><ul>")
+        for start, end in self.idle_gaps():
+            body.append("<li>{:.3f}s - {:.3f}s</li>".format(start, end))
+        body.append("</ul><h2>Scheduler gaps</h2><ul>")
+        for unit, delay in self.scheduler_gaps():
+            body.append("<li>{} waited {:.3f}s</li>".format(
+                html.escape(unit.name), delay))
+        body.append("</ul></body></html>")
+        return "\n".join(body)
+
+    def write_dot(self, fp):
+        """ Writes the graph out in dot format with the timings of each unit
+
+        Units and edges on the critical path are drawn in red.
+        """
+
+        critical = set(unit.tid for unit in self.critical_path())
+        node_ids = {}
+        fp.write("digraph {} {{\n".format(self.graph))
+        for tid in self.order:
+            unit = self.units[tid]
+            node_ids[tid] = "t{}".format(len(node_ids))
+            color = "red" if tid in critical else "lightcyan"
+            fp.write('{} [label="{}\\n{:.3f}s (slack {:.3f}s)" style=filled '
+                     'fillcolor={}]\n'.format(node_ids[tid], unit.name,
+                                              unit.duration, unit.slack,
+                                              color))
+        for tid in self.order:
+            for child in self.units[tid].children:
+                attrs = ""
+                if tid in critical and child in critical:
+                    attrs = " [color=red penwidth=2]"
+                fp.write("{} -> {}{}\n".format(node_ids[tid],
+                                               node_ids[child], attrs))
+        fp.write("}\n")
@@ -1,21 +1,22 @@
+import json
 import logging
 import os
-try:
-    import cPickle as pickle
-except:
-    import pickle
 import shutil
 import tarfile
+import time
 
 from collections import defaultdict
 from tasks import Port
 from tasks import FusedTask
 from backend import Backend
+from graph_io import dump_graph
 from process import ProcessFactory
 from logger import TaskLogger
 from logger import ThreadLocalLogger
 from logger import MonoChromeLogger
 from logger import LogColor
+from metrics import RunMetrics
+import transfer
 
 import kisseru as self_pkg
 
@@ -29,30 +30,32 @@ class SlurmPort(Port):
     def send(self, value, to_port):
         # Write value to file
         filename = "{}_{}".format(to_port.task_ref.id, to_port.name)
-        fp = open(filename, 'wb')
-        pickle.dump(value, fp)
-        fp.close()
+        transfer.write(self, value, filename)
 
     def receive(self, value=None, from_port=None):
         # Poll value from file
         filename = "{}_{}".format(self.task_ref.id, self.name)
-        while not os.path.exists(file_path):
-            time.sleep(1) 
+        while not os.path.exists(filename):
+            time.sleep(1)
 
         if os.path.isfile(filename):
-            fp = open(filename, 'rb')
-            value = pickle.load(fp)
-            fp.close()
+            value = transfer.read(filename, self)
         else:
             raise ValueError("%s isn't a file\n" % filename)
 
-        log.debug("Received value {} from task {}".format(
-            value, from_port.task_ref.name))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Received value {} at {}".format(value, filename))
 
         self.task_ref._args[self.name] = value
         # Notify the task that it got a new input
         self.notify_task()
 
+    def release(self):
+        # Transfer files are per in-port. Nobody else reads this one.
+        filename = "{}_{}".format(self.task_ref.id, self.name)
+        if os.path.isfile(filename):
+            os.remove(filename)
+
 
 @Backend.register_backend
 class SlurmBackend(Backend):
@@ -63,25 +66,40 @@ class SlurmBackend(Backend):
         self.logger = None
         self.slurm_driver = """
 
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import json
 import sys
+import uuid
 
 from kisseru import *
+from accounting import ResourceMeter
+from accounting import take_port_bytes
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from graph_io import load_graph
+from logger import TaskLogger
 
 if __name__ == "__main__":
-    if not len(sys.argv):
+    if len(sys.argv) < 2:
         raise ValueError("Task ID unavailable")
 
-    tid = sys.argv[0]
-    graph = None
+    tid = uuid.UUID(sys.argv[1])
+    Backend.set_current_backend(BackendConfig(BackendType.SLURM, "Slurm"))
     with open("graph", 'rb') as fp:
-       graph = pickle.load(fp)
-       
+        graph = load_graph(fp)
+    logger = TaskLogger("{}_{}.log".format(graph.name, tid))
+    Backend.get_current_backend().logger = logger
+
     task = graph.get_task(tid)
-    task.receive()
+    with ResourceMeter() as meter:
+        task.receive()
+    logger.flush()
+
+    # Picked up by SlurmBackend.collect_metrics to size later job requests
+    usage = meter.usage
+    usage.update(take_port_bytes(task))
+    with open("{}.usage".format(tid), 'w') as fp:
+        json.dump(usage, fp)
 
 """
 
@@ -108,6 +126,11 @@ if __name__ == "__main__":
                 _visit(source)
         return topo_sorted
 
+    def _job_label(self, task):
+        # Fused task names grow with the chain length. Cap them so that job
+        # script names stay within file name limits
+        return task.name[:64]
+
     def _populate_job_map(self, source, visited, job_map, counter):
         if source in visited:
             return (counter, job_map)
@@ -119,8 +142,10 @@ if __name__ == "__main__":
                 continue
             visited.add(node)
             job_id = "jid" + str(counter)
-            job_name = "--job-name=" + node.name + "_" + str(counter)
-            job_script = "job_" + node.name + "_" + str(node.id) + ".sh"
+            job_name = "--job-name=" + self._job_label(node) + "_" + str(
+                counter)
+            job_script = "job_" + self._job_label(node) + "_" + str(
+                node.id) + ".sh"
             job_map[node.id] = job_id + "/" + job_name + "/" + job_script
 
             children = node.get_children()
@@ -147,7 +172,8 @@ if __name__ == "__main__":
             if parents:
                 dependencies = "--dependency=afterany"
                 for parent in parents:
-                    fused_parent = parent.graph.fusee_map[parent.id]
+                    fused_parent = parent.graph.fusee_map.get(
+                        parent.id, parent)
                     parent_job = job_map[fused_parent.id]
                     dependencies += ":$" + parent_job.split("/")[0]
 
@@ -178,9 +204,11 @@ if __name__ == "__main__":
             if os.path.isfile(os.path.join(app_dir, f)):
                 shutil.copy(os.path.join(app_dir, f), temp_dir)
 
-        # serialize the graph as a file in the temporary directory
+        # serialize the graph as a file in the temporary directory. Only the
+        # graph IR gets written out (see graph_io) so that each job loads it
+        # quickly however large the graph is.
         with open(os.path.join(temp_dir, "graph"), "wb") as fp:
-            pickle.dump(graph, fp)
+            dump_graph(graph, fp)
 
         # serialize the slurm driver as file in the temporary directory
         with open(os.path.join(temp_dir, "slurm_driver.py"), "w") as fp:
@@ -209,7 +237,8 @@ if __name__ == "__main__":
         for tid in slurm_jobs:
             script_body = "module load python3\n"
             task = graph.get_task(tid)
-            job_script = "job_" + task.name + "_" + str(task.id) + ".sh"
+            job_script = "job_" + self._job_label(task) + "_" + str(
+                task.id) + ".sh"
             with open(os.path.join(temp_dir, job_script), "w") as fp:
                 script_body += ("python3 slurm_driver.py " + str(task.id))
                 fp.write(script_body)
@@ -240,6 +269,22 @@ if __name__ == "__main__":
     def deploy(self):
         pass
 
+    def collect_metrics(self, graph, job_dir="."):
+        """ Run metrics of the jobs run from the package of the graph
+
+        Each job meters the resources its task used and leaves them in a
+        usage file in the job directory. Tasks without one have not run (yet).
+        """
+
+        metrics = RunMetrics(graph.name, self.name)
+        for tid, task in graph.tasks.items():
+            path = os.path.join(job_dir, "{}.usage".format(tid))
+            if os.path.isfile(path):
+                with open(path) as fp:
+                    metrics.record_usage(task, json.load(fp),
+                                         executor='slurm')
+        return metrics
+
     def run_task(self, task):
         task.run()
 
@@ -255,3 +300,4 @@ if __name__ == "__main__":
                     filename = "{}_{}".format(task.id, param)
                     if os.path.isfile(filename):
                         os.remove(filename)
+            transfer.remove_shared(task)
@@ -0,0 +1,56 @@
+from handler import HandlerRegistry
+from passes import Pass
+from passes import PassResult
+from tasks import BatchTask
+from tasks import FusedTask
+from tasks import gen_runner
+
+
+def narrow(selection, enabled):
+    """ Handler selection enabling only the handlers enabled by both """
+
+    if enabled is True or enabled is None:
+        return selection
+    if selection is True or selection is None:
+        return enabled
+
+    pre, post = HandlerRegistry.select(selection)
+    run_pre, run_post = HandlerRegistry.select(enabled)
+    names = tuple(handler.name for handler in pre + post
+                  if handler in run_pre or handler in run_post)
+    return names if names else False
+
+
+class Specialize(Pass):
+    """ Specializes the task runners for the handlers enabled for the run
+
+    The 'handlers' runner option enables handlers for the run the same way
+    @task(handlers=...) does for a task (i.e: True, False or handler names or
+    features like 'trace' and 'profile'). A task runs the handlers enabled
+    both for it and for the run. Its runner gets regenerated for just those,
+    so that disabled handlers add nothing to each call.
+    """
+
+    def __init__(self, name):
+        Pass.__init__(self, name)
+        self.description = "Specializing task runners"
+
+    def run(self, graph, ctx):
+        enabled = ctx.options.get('handlers', True)
+        if enabled is True:
+            return PassResult.CONTINUE
+
+        Pass.run(self, graph, ctx)
+        for tid, task in graph.tasks.items():
+            if isinstance(task, (FusedTask, BatchTask)):
+                continue
+
+            task.handlers = narrow(task.handlers, enabled)
+            if hasattr(task, 'bind_runners'):
+                task.bind_runners()
+            else:
+                task._runner = gen_runner(task._fn, task._sig, task.handlers)
+        return PassResult.CONTINUE
+
+    def post_run(self, graph, ctx):
+        pass
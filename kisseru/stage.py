@@ -1,9 +1,7 @@
 import os
 import inspect
-import urllib.request
 import shutil
 import time
-import socket
 
 from colors import Colors
 from tasks import gen_runner
@@ -22,6 +20,8 @@ def staging(infile):
     path = get_path_to_file(infile)
     response = None
 
+    # Imported on demand since it is slow to import and seldom needed
+    import urllib.request
     try:
         response = urllib.request.urlopen(infile)
     except e:
@@ -43,12 +43,15 @@ class Stage(Pass):
         new_tasks = []
         new_sources = []
         deleted_sources = []
+        # Staging tasks generated so far keyed by the staged URL
+        staged = {}
 
         # Run edge transformations
         #
         # This depends on the run time placement of the task since staging may
         # or may not be necessary depending on whether the next task is placed
-        # at the same node or not.
+        # at the same node or not. Backends with multiple nodes leave that
+        # decision to their placement planner (see placement.py).
 
         # Run source input staging
         for tid, source in graph.sources.items():
@@ -57,44 +60,56 @@ class Stage(Pass):
                 arg = source._args[name]
 
                 # Check if it looks like a URL (currently we only support FTP)
-                if arg.startswith("ftp:"):
-                    ext = get_file_extention(get_file_name(arg))
-                    intype = inport.type.id
-                    '''
-                    if ext:
-                        if intype != ext:
-                            print(
-                                Colors.WARNING +
-                                """[Compiler] {} input file extention does not seem to match the declared argument type {} at {}"""
-                                .format(ext, intype, source.name) +
-                                Colors.ENDC)
-                    '''
-                    args = [arg]
-
-                    sig = inspect.signature(staging)
-                    # Generate a new task for staging the input
-                    task = Task(
-                        gen_runner(staging, sig), staging, sig, args, {})
-                    task.is_staging = True
-
-                    # We know this generated task only has one output
-                    outport = task.outputs['0']
-
-                    # Make the configuration of the original task's input to be
-                    # non immediate since now it accepts the output from newly
-                    # generated staging task at runtime
-                    inport.flip_is_immediate()
-
-                    # Connect the out port of the new task to the
-                    # in port of the old source
-                    task.edges.append(Edge(outport, inport))
+                if not isinstance(arg, str) or not arg.startswith("ftp:"):
+                    continue
 
-                    # Collect the new task as a source
-                    new_sources.append(task)
-                    # Collect sources which are made not sources anymore
+                if arg in staged:
+                    # Same resource is staged for another source already.
+                    # Reuse its staging task instead of fetching it again.
+                    inport.flip_is_immediate()
+                    task = staged[arg]
+                    task.edges.append(Edge(task.outputs['0'], inport))
                     deleted_sources.append(source)
-                    # Collect newly generated tasks
-                    new_tasks.append(task)
+                    continue
+
+                ext = get_file_extention(get_file_name(arg))
+                intype = inport.type.id
+                '''
+                if ext:
+                    if intype != ext:
+                        print(
+                            Colors.WARNING +
+                            """[Compiler] {} input file extention does not seem to match the declared argument type {} at {}"""
+                            .format(ext, intype, source.name) +
+                            Colors.ENDC)
+                '''
+                args = [arg]
+
+                sig = inspect.signature(staging)
+                # Generate a new task for staging the input
+                task = Task(
+                    gen_runner(staging, sig), staging, sig, args, {})
+                task.is_staging = True
+
+                # We know this generated task only has one output
+                outport = task.outputs['0']
+
+                # Make the configuration of the original task's input to be
+                # non immediate since now it accepts the output from newly
+                # generated staging task at runtime
+                inport.flip_is_immediate()
+
+                # Connect the out port of the new task to the
+                # in port of the old source
+                task.edges.append(Edge(outport, inport))
+
+                # Collect the new task as a source
+                new_sources.append(task)
+                # Collect sources which are made not sources anymore
+                deleted_sources.append(source)
+                # Collect newly generated tasks
+                new_tasks.append(task)
+                staged[arg] = task
 
         # Add the newly generated tasks to the graph
         for task in new_tasks:
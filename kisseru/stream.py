@@ -0,0 +1,147 @@
+import collections
+import threading
+
+DEFAULT_BUFFER = 8
+
+_END = object()
+
+
+class StreamError(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class Stream(object):
+    """ A bounded stream of chunks flowing along an edge
+
+    Generator tasks push each chunk they yield in to a stream per consumer as
+    soon as it is produced. Consumers iterate over their input stream while
+    the producer is still running. Once the consumer is attached (i.e: it has
+    been scheduled to run) the buffer is bounded so a producer which gets
+    ahead of its slowest consumer blocks until there is room again. Until then
+    chunks are held without a bound since the consumer may be waiting on other
+    inputs which in turn depend on the producer.
+
+    A stream can only be iterated once.
+
+    Attributes:
+        name: Name of the producing task. Used for error reporting
+        buffer: Maximum number of chunks held once the consumer is attached
+        attached: True once the consumer has been scheduled to run
+        cancelled: True once the consumer has stopped reading
+    """
+
+    def __init__(self, name, buffer=DEFAULT_BUFFER):
+        self.name = name
+        self.buffer = buffer
+        self.attached = False
+        self.cancelled = False
+        self._chunks = collections.deque()
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return "<stream from {}>".format(self.name)
+
+    def _append(self, chunk):
+        self._chunks.append(chunk)
+        self._cond.notify_all()
+
+    def put(self, chunk):
+        """ Pushes a chunk, blocking while the buffer is full
+
+        Returns:
+            False if the consumer is no longer reading
+        """
+
+        with self._cond:
+            while self.attached and not self.cancelled and \
+                    len(self._chunks) >= self.buffer:
+                self._cond.wait()
+            if self.cancelled:
+                return False
+            self._append(chunk)
+            return True
+
+    def close(self):
+        """ Marks the end of the stream """
+
+        with self._cond:
+            if not self.cancelled:
+                self._append(_END)
+
+    def fail(self, error):
+        """ Ends the stream with an error which is raised at the consumer """
+
+        with self._cond:
+            if not self.cancelled:
+                self._append(StreamError(error))
+
+    def attach(self):
+        """ Called once the consumer is scheduled to run. Bounds the buffer
+        from then on.
+        """
+
+        with self._cond:
+            self.attached = True
+
+    def cancel(self):
+        """ Called on behalf of a consumer which stopped reading. Unblocks the
+        producer and makes it drop any further chunks.
+        """
+
+        with self._cond:
+            self.cancelled = True
+            self._chunks.clear()
+            self._cond.notify_all()
+
+    def __iter__(self):
+        self.attach()
+        while True:
+            with self._cond:
+                while not self._chunks:
+                    self._cond.wait()
+                chunk = self._chunks.popleft()
+                self._cond.notify_all()
+
+            if chunk is _END:
+                return
+            elif isinstance(chunk, StreamError):
+                raise Exception("Upstream task {} failed with {}".format(
+                    self.name, repr(chunk.error)))
+            yield chunk
+
+
+def pump(gen, streams, collected=None):
+    """ Pushes the chunks yielded by a generator in to the given streams
+
+    Stops early if all the consumers have stopped reading. Streams get closed
+    (or failed if the generator raises) once the generator is done.
+
+    Args:
+        gen: Generator to drain
+        streams: Streams to push the chunks in to
+        collected: If given chunks are appended to it as well. The generator
+            is then always run to completion
+
+    Returns:
+        Number of chunks produced
+    """
+
+    count = 0
+    try:
+        for chunk in gen:
+            count += 1
+            live = [stream.put(chunk) for stream in streams]
+            if collected is not None:
+                collected.append(chunk)
+            elif streams and not any(live):
+                gen.close()
+                break
+    except BaseException as e:
+        for stream in streams:
+            stream.fail(e)
+        raise
+
+    for stream in streams:
+        stream.close()
+    return count
@@ -24,6 +24,16 @@ from handler import HandlerRegistry
 
 log = logging.getLogger(__name__)
 
+# Execution modes a task can ask for with @task(executor=...)
+#
+#   inline     - Run on the thread which delivered the last input. For trivial
+#                glue code
+#   thread     - Run on a thread pool. For GIL releasing work (e.g: numpy,
+#                pandas)
+#   process    - Run in a forked process. For pure python CPU bound work
+#   subprocess - Run in a freshly started python interpreter
+EXECUTORS = ('inline', 'thread', 'process', 'subprocess')
+
 
 class Port(metaclass=abc.ABCMeta):
     """ A communication port.
@@ -95,6 +105,15 @@ class Port(metaclass=abc.ABCMeta):
 
         pass
 
+    def release(self):
+        """ Releases any resources held for the value received at this in-port
+
+        Called once the task which owns the in-port has run and no longer
+        needs the value.
+        """
+
+        pass
+
     def notify_task(self):
         with self.task_ref._latch.get_lock():
             self.task_ref._latch.value -= 1
@@ -215,6 +234,17 @@ class Task(object):
         _fn: User given function for the task (this is a python code object)
         _sig: Original task (function) signature
         _args: Task (function) arguments
+        configs: Task configurations given at the @task decorator
+        executor: Execution mode requested for the task (one of EXECUTORS).
+            None if the backend should decide
+        is_streaming: True if the task is a generator with a single output.
+            Backends which support streaming push each chunk it yields
+            downstream as soon as it is produced. Others collect the chunks
+            in to a list
+        handlers: Handlers enabled for the task. True for all of them, False
+            for none or the names or features of the enabled handlers (see
+            HandlerRegistry.select). Set by @task(handlers=...) and narrowed
+            down to the ones enabled for the run when the graph is compiled
 
         _latch: Task trigger latch. Gets triggers once all non immediate inputs
             have been received 
@@ -228,7 +258,9 @@ class Task(object):
             and an out-port object as value
         edges: Output edges of the task
 
-        is_fusee: True if this task is contained within a FusedTask
+        is_fusee: True if this task is contained within a FusedTask or a
+            BatchTask
+        batch: BatchTask the task runs as a part of. None if it is not batched
         is_source: True if this task is a source of the associated task graph
         is_sink: True if this task is a sink of the associated task graph
         is_staging: True if this task is a staging task generated by the task 
@@ -237,7 +269,7 @@ class Task(object):
             by the task graph compiler
     """
 
-    def __init__(self, runner, fn, sig, args, kwargs):
+    def __init__(self, runner, fn, sig, args, kwargs, configs=None):
         self.name = fn.__name__
         self.id = None
         self.graph = None
@@ -246,6 +278,17 @@ class Task(object):
         self._sig = sig
         self._args = {}
 
+        # Configuration
+        self.configs = configs if configs else {}
+        self.executor = self.configs.get('executor', None)
+        if self.executor and self.executor not in EXECUTORS:
+            raise Exception("{} has an unknown executor '{}'. Expected one of "
+                            "{}".format(self.name, self.executor,
+                                        ", ".join(EXECUTORS)))
+        self.is_streaming = inspect.isgeneratorfunction(fn) and \
+            type(sig.return_annotation) != tuple
+        self.handlers = self.configs.get('handlers', True)
+
         # Runtime control
         self._latch = Value('i', 0)
         self.triggered = Condition()
@@ -257,6 +300,7 @@ class Task(object):
 
         # Flags
         self.is_fusee = False
+        self.batch = None
         self.is_fused  = False
         self.is_source = False
         self.is_sink = False
@@ -300,7 +344,7 @@ class Task(object):
                     param_type = outport.type
                 elif isinstance(value, Tasklet):
                     parent = value.parent
-                    outport = parent.outputs[value.out_slot_in_parent]
+                    outport = parent.outputs[str(value.out_slot_in_parent)]
                     param_type = outport.type
                 else:
                     py_type = type(value)
@@ -328,7 +372,7 @@ class Task(object):
             elif isinstance(value, Tasklet):
                 inport.is_immediate = False
                 parent = value.parent
-                outport = parent.outputs[value.out_slot_in_parent]
+                outport = parent.outputs[str(value.out_slot_in_parent)]
 
                 edge = Edge(outport, inport)
                 parent.edges.append(edge)
@@ -390,6 +434,9 @@ class Task(object):
         return list(children)
 
     def send(self, ret):
+        if self.graph is not None and self.graph.journal is not None:
+            self.graph.journal.record(self, ret)
+
         log.debug("Sending value {} from {}".format(ret, self.name))
         # We have multiple out-ports and we need to route return values to the
         # corresponding out-ports
@@ -425,10 +472,30 @@ class Task(object):
             with self.triggered:
                 self.triggered.wait()
 
+        if self.batch is not None:
+            # Batched tasks get run together once all of them are ready
+            self.batch.member_ready(self)
+            return
         Backend.get_current_backend().run_task(self)
 
+    def release_inputs(self):
+        """ Drops the values received from upstream tasks
+
+        Each consumer holds on to its own reference of an upstream value (or
+        its own transfer file). Releasing those once the task has run frees
+        the value as soon as its last consumer is done with it instead of at
+        the end of the run.
+        """
+
+        for name, inport in self.inputs.items():
+            if not inport.is_immediate:
+                inport.release()
+                self._args.pop(name, None)
+
     def run(self):
-        self.send(self._runner(**self._args))
+        ret = run_sync(self._runner(**self._args))
+        self.release_inputs()
+        self.send(ret)
         self.graph.mark_completed(self.id)
 
     def dump(self):
@@ -446,7 +513,22 @@ class Task(object):
 
 # Notes : ports take care of inter task communication
 class FusedTask(Task):
-    """ A container task for multiple tasks fused together"""
+    """ A container task for multiple tasks fused together
+
+    A chain of plain tasks gets a runner generated for it (see
+    gen_fused_runner) which calls the member functions one after the other,
+    handing values over in local variables. The chain's result is then sent
+    down the tail's edges. Chains with streaming, coroutine or map tasks
+    instead run the head and push its result through the members' local
+    ports as before.
+
+    Attributes:
+        tasks: Fused tasks in the order they run
+        head: First task of the chain
+        tail: Last task of the chain
+        _runner: Generated runner of the whole chain. None if the chain runs
+            through its head
+    """
 
     def __init__(self, tasks):
         if tasks == None or len(tasks) == 0:
@@ -461,9 +543,13 @@ class FusedTask(Task):
         self.tasks = tasks
         self.head = tasks[0]
         self.tail = tasks[-1]
+        self.configs = {}
+        self.executor = self.head.executor
+        self.is_streaming = self.head.is_streaming
 
         # Default initializing other task flags
         self.is_fusee = False
+        self.batch = None
         self.is_fused = True
         self.is_source = False
         self.is_sink = False
@@ -520,10 +606,216 @@ class FusedTask(Task):
         # Make this task inputs to be that of the head task
         self.inputs = self.head.inputs
 
+        self.bind_runners()
+
+    def bind_runners(self):
+        self._runner = gen_fused_runner(self)
+
+    def send(self, ret):
+        self.tail.send(ret)
+
     def run(self):
+        if self._runner is not None:
+            ret = self._runner(**self._args)
+            self.release_inputs()
+            self.send(ret)
+            self.graph.mark_completed(self.id)
+            return
+
         # Push the inputs that we accepted on behalf of the head task through
         # the head task
-        self.head.send(self.head._runner(**self._args))
+        ret = run_sync(self.head._runner(**self._args))
+        self.release_inputs()
+        self.head.send(ret)
+
+
+class MapTask(Task):
+    """ A task expanded over the elements of an upstream output at runtime
+
+    The first argument of the task function is mapped over. The task runs once
+    per element of the list it receives for that argument, with the rest of
+    the arguments shared by all the elements. Results are gathered in to a
+    list in the order of the elements. How the elements get run (e.g: in
+    parallel) is up to the backend's run_map.
+
+    Attributes:
+        map_param: Name of the argument mapped over
+        _element_sig: Signature of the task function for a single element
+        _element_runner: Runner of the task function for a single element
+    """
+
+    def __init__(self, fn, sig, items, args, kwargs, configs=None):
+        params = list(sig.parameters.values())
+        if not params:
+            raise Exception(
+                "{} has no arguments to map over".format(fn.__name__))
+        if type(sig.return_annotation) == tuple:
+            raise Exception("Mapping {} which returns multiple values is not "
+                            "supported".format(fn.__name__))
+
+        self.map_param = params[0].name
+        self._element_sig = sig
+        # The task as a whole accepts and returns lists
+        map_sig = sig.replace(
+            parameters=[params[0].replace(annotation=list)] + params[1:],
+            return_annotation=list)
+        Task.__init__(self, None, fn, map_sig, (items, ) + tuple(args),
+                      kwargs, configs)
+        self.is_streaming = False
+        self.bind_runners()
+
+    def bind_runners(self):
+        self._element_runner = gen_runner(self._fn, self._element_sig,
+                                          self.handlers)
+        self._runner = self._run_map
+
+    def _run_map(self, **kwargs):
+        items = kwargs.pop(self.map_param)
+        return Backend.get_current_backend().run_map(self, list(items),
+                                                     kwargs)
+
+    def element_args(self, item, kwargs):
+        """ Arguments of the task function for a single element """
+
+        args = dict(kwargs)
+        args[self.map_param] = item
+        return args
+
+    def run_element(self, item, kwargs):
+        """ Runs the task function for a single element """
+
+        return run_sync(self._element_runner(**self.element_args(item,
+                                                                 kwargs)))
+
+
+class BatchTask(Task):
+    """ A container task running many instances of the same task at once
+
+    Instances of a @task(batch=N) function which don't depend on each other
+    get grouped in to batches of up to N by the Batching pass. A batch is
+    scheduled as a single unit and runs the task function for all of its
+    members in a tight loop, skipping the per task handlers. A vectorized task
+    (@task(batch=N, vectorized=True)) instead gets called once per batch with
+    a list per argument holding the values of all the members, and returns a
+    list of results. Each result is then sent down the edges of the member it
+    belongs to.
+
+    Members keep their in-ports and receive their inputs as usual. Once all
+    of them have their inputs the batch gets run.
+
+    Attributes:
+        tasks: Batched tasks
+        vectorized: Whether the task function accepts columnar arguments
+        _ready: Ids of the members which have all of their inputs
+    """
+
+    def __init__(self, tasks, name):
+        self.name = name
+        self.id = None
+        self.graph = None
+        self.tasks = tasks
+        self._fn = tasks[0]._fn
+        self._sig = tasks[0]._sig
+        self.configs = tasks[0].configs
+        self.executor = tasks[0].executor
+        self.vectorized = self.configs.get('vectorized', False)
+
+        waiting = sum(1 for task in tasks if task._latch.value)
+        self._latch = Value('i', waiting)
+        self.triggered = Condition()
+        self._ready = set()
+
+        self.inputs = {}
+        self.outputs = {}
+        self.edges = []
+
+        self.is_fusee = False
+        self.batch = None
+        self.is_fused = False
+        self.is_streaming = False
+        self.is_source = False
+        self.is_sink = all(task.is_sink for task in tasks)
+        self.is_staging = False
+        self.is_transform = False
+
+        for task in tasks:
+            task.is_fusee = True
+            task.batch = self
+
+        self.bind_runners()
+
+    @property
+    def _args(self):
+        return {'members': [task._args for task in self.tasks]}
+
+    def bind_runners(self):
+        self._runner = gen_runner(self._run_batch, self._sig)
+
+    def _run_batch(self, members):
+        if not self.vectorized:
+            return [run_sync(self._fn(**args)) for args in members]
+
+        columns = {
+            name: [args[name] for args in members]
+            for name in self._sig.parameters
+        }
+        rets = run_sync(self._fn(**columns))
+        if rets is None or len(rets) != len(members):
+            raise Exception("Vectorized task {} returned {} results for {} "
+                            "inputs".format(self.name, None if rets is None
+                                            else len(rets), len(members)))
+        return list(rets)
+
+    def run_each(self, members):
+        """ Runs each member through its own runner instead """
+
+        return [run_sync(task._runner(**args))
+                for task, args in zip(self.tasks, members)]
+
+    def get_parents(self):
+        parents = set()
+        for task in self.tasks:
+            parents.update(task.get_parents())
+        return list(parents)
+
+    def get_children(self):
+        children = set()
+        for task in self.tasks:
+            children.update(task.get_children())
+        return list(children)
+
+    def member_ready(self, task):
+        with self._latch.get_lock():
+            if task.id in self._ready:
+                return
+            self._ready.add(task.id)
+            self._latch.value -= 1
+            ready = not self._latch.value
+        if ready:
+            Backend.get_current_backend().run_task(self)
+
+    def release_inputs(self):
+        for task in self.tasks:
+            task.release_inputs()
+
+    def send(self, ret):
+        # Failed batches send None to every member
+        if ret is None:
+            ret = [None] * len(self.tasks)
+        for task, value in zip(self.tasks, ret):
+            task.send(value)
+
+    def run(self):
+        # Pick up inputs which were received by other processes
+        for task in self.tasks:
+            for name, inport in task.inputs.items():
+                if not inport.is_immediate:
+                    inport.receive()
+
+        ret = run_sync(self._runner(**self._args))
+        self.release_inputs()
+        self.send(ret)
+        self.graph.mark_completed(self.id)
 
 
 class TaskGraph(object):
@@ -545,6 +837,11 @@ class TaskGraph(object):
             completed so far in the task graph
         done: Runtime monitor which will be notified once the graph execution 
             is completed
+        compile_stats: CompileStats recorded when the graph was compiled
+        journal: RunJournal recording the tasks completed during the run. None
+            if the run is not journaled
+        run_metrics: RunMetrics recorded by the backend during the last run.
+            None if the backend does not record any
     """
 
     name = None
@@ -552,11 +849,30 @@ class TaskGraph(object):
     fusee_map = defaultdict()
     sources = {}
     num_tasks = 0
+    compile_stats = None
+    journal = None
+    run_metrics = None
 
     # Runtime controls for task graph execution
     completed_tasks = Value('i', 0)
     done = Condition()
 
+    def reset(self):
+        """ Clears the graph so that a new one can be built in its place
+
+        Graph state lives at the class level. So this needs to be done before
+        each time an app specification is run within the same process.
+        """
+
+        self.tasks.clear()
+        self.fusee_map.clear()
+        self.sources.clear()
+        self.num_tasks = 0
+        self.compile_stats = None
+        self.journal = None
+        self.run_metrics = None
+        self.completed_tasks.value = 0
+
     def mark_completed(self, tid):
         with self.completed_tasks.get_lock():
             self.completed_tasks.value += 1
@@ -675,9 +991,9 @@ class PostProcess(Pass):
         for tid, task in graph.tasks.items():
             tasks.add(task)
 
-        # Now remove any tasks within fused tasks
+        # Now remove any tasks within fused tasks and batches
         for tid, task in graph.tasks.items():
-            if isinstance(task, FusedTask):
+            if isinstance(task, (FusedTask, BatchTask)):
                 for t in task.tasks:
                     tasks.remove(t)
 
@@ -687,37 +1003,178 @@ class PostProcess(Pass):
         pass
 
 
-def gen_runner(fn, sig):
-    def run_task(**kwargs):
+def run_sync(ret):
+    """ Resolves the result of a coroutine task when it is run outside of an
+    event loop (i.e: by a backend which is not asyncio based). Chunks yielded
+    by a generator task get collected in to a list when it is run by a backend
+    which does not stream.
+    """
+    if inspect.isawaitable(ret):
+        # Most tasks are plain functions. Don't import asyncio for them.
+        import asyncio
+        return asyncio.run(ret)
+    if inspect.isgenerator(ret):
+        return list(ret)
+    return ret
+
+
+def gen_async_runner(fn, sig, pre=(), post=()):
+    if not pre and not post:
+        async def run_task(**kwargs):
+            try:
+                return await fn(**kwargs)
+            except:
+                traceback.print_exc()
+                return None
+        return run_task
+
+    async def run_task(**kwargs):
         ctx = HandlerContext(fn)
         ctx.args = kwargs
         ctx.sig = sig
 
-        log.debug("Running pre handlers")
-        log.debug(HandlerRegistry().pre_handlers)
-        for pre in HandlerRegistry.pre_handlers:
-            pre.run(ctx)
+        for handler in pre:
+            handler.run(ctx)
 
         ret = None
         try:
-            ret = ctx.fn(**kwargs)
+            ret = await ctx.fn(**kwargs)
         except:
-            # [TODO] Ideally we want to match the original line info in the
-            # printed trace back for better script debuggability. We should
-            # probably be able to do that by playing with the exception stack
-            # trace.
             traceback.print_exc()
         ctx.ret = ret
 
-        for post in HandlerRegistry.post_handlers:
-            post.run(ctx)
+        for handler in post:
+            handler.run(ctx)
         return ret
 
     return run_task
 
 
-def gen_task(fn, sig, args, kwargs):
-    task = Task(gen_runner(fn, sig), fn, sig, args, kwargs)
+def gen_runner(fn, sig, handlers=True):
+    """ Generates the runner of a task function
+
+    The runner is specialized for the handlers enabled by the given selection
+    (see HandlerRegistry.select) when it gets generated. A runner without any
+    handlers to run just calls the function.
+    """
+
+    pre, post = HandlerRegistry.select(handlers)
+    # Coroutine tasks get a runner which needs to be awaited
+    if inspect.iscoroutinefunction(fn):
+        return gen_async_runner(fn, sig, pre, post)
+
+    if not pre and not post:
+
+        def run_task(**kwargs):
+            try:
+                return fn(**kwargs)
+            except:
+                traceback.print_exc()
+                return None
+    else:
+
+        def run_task(**kwargs):
+            ctx = HandlerContext(fn)
+            ctx.args = kwargs
+            ctx.sig = sig
+
+            for handler in pre:
+                handler.run(ctx)
+
+            ret = None
+            try:
+                ret = ctx.fn(**kwargs)
+            except:
+                # [TODO] Ideally we want to match the original line info in
+                # the printed trace back for better script debuggability. We
+                # should probably be able to do that by playing with the
+                # exception stack trace.
+                traceback.print_exc()
+            ctx.ret = ret
+
+            for handler in post:
+                handler.run(ctx)
+            return ret
+
+    # Lets fused chains call the function directly when there are no handlers
+    # to run
+    run_task.__wrapped__ = fn
+    run_task.handlers = bool(pre or post)
+    return run_task
+
+
+def gen_fused_runner(fused):
+    """ Generates a single function running a chain of fused tasks
+
+    Each member is called with the value of the previous one passed through a
+    local variable and its immediate arguments bound as constants. Members
+    are called directly when their runners have no handlers to run. Otherwise,
+    or if their runner has been replaced (e.g: to replay a journaled result),
+    their runner is called instead. Like the runner of a single task, the function
+    prints the traceback of a failure and returns None. So does it when a
+    member returns None, which would have never reached the next member.
+
+    Returns:
+        The generated function. None if the chain can't be run by one (i.e:
+        it has streaming, coroutine or map tasks).
+    """
+
+    members = fused.tasks
+    if any(type(task) is not Task or task.is_streaming or
+           inspect.iscoroutinefunction(task._runner) for task in members):
+        return None
+
+    env = {'run_sync': run_sync, 'traceback': traceback}
+    lines = ["def fused_chain(**kwargs):", "    try:"]
+    for i, task in enumerate(members):
+        runner = task._runner
+        direct = getattr(runner, '__wrapped__', None) is task._fn and \
+            not getattr(runner, 'handlers', True)
+        env['f{}'.format(i)] = task._fn if direct else task._runner
+
+        if i == 0:
+            args = ["**kwargs"]
+        else:
+            parent = members[i - 1]
+            multiple = type(parent._sig.return_annotation) == tuple
+            received = {}
+            for edge in parent.edges:
+                received[edge.dest.name] = "v{}[{}]".format(
+                    i - 1, edge.source.index) if multiple else "v{}".format(
+                        i - 1)
+
+            args = []
+            for name in task._sig.parameters:
+                if name in received:
+                    args.append("{}={}".format(name, received[name]))
+                elif name in task._args:
+                    const = "c{}_{}".format(i, name)
+                    env[const] = task._args[name]
+                    args.append("{}={}".format(name, const))
+
+        call = "f{}({})".format(i, ", ".join(args))
+        if not direct:
+            call = "run_sync({})".format(call)
+        lines.append("        v{} = {}".format(i, call))
+        if i < len(members) - 1:
+            lines.append("        if v{} is None:".format(i))
+            lines.append("            return None")
+
+    lines.append("        return v{}".format(len(members) - 1))
+    lines.append("    except Exception:")
+    lines.append("        traceback.print_exc()")
+    lines.append("        return None")
+
+    code = compile("\n".join(lines) + "\n", "<fused {}>".format(fused.name),
+                   'exec')
+    exec(code, env)
+    return env['fused_chain']
+
+
+def gen_task(fn, sig, args, kwargs, configs=None):
+    handlers = configs.get('handlers', True) if configs else True
+    task = Task(gen_runner(fn, sig, handlers), fn, sig, args, kwargs,
+                configs)
     # Check if the task returns multiple values.
     rets = sig.return_annotation
     tasklets = []
@@ -727,8 +1184,9 @@ def gen_task(fn, sig, args, kwargs):
         #  ... -> 'return_1:typ_1, ..., return_N:typ_N'
         for index, ret in enumerate(rets):
             tasklets.append(Tasklet(task, index))
-    tup = gen_tuple(tasklets)
-    if tup == None:
-        log.error("Task returning more than 10 outputs.")
-        raise Exception("Task returning more than 10 outputs")
-    return (task, tup)
+    return (task, gen_tuple(tasklets))
+
+
+def gen_map_task(fn, sig, items, args, kwargs, configs=None):
+    task = MapTask(fn, sig, items, args, kwargs, configs)
+    return (task, gen_tuple([]))
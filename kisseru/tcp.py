@@ -0,0 +1,625 @@
+import inspect
+import logging
+import os
+import pickle
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import traceback
+
+from collections import defaultdict
+from multiprocessing import Pipe
+from multiprocessing import Process
+
+from tasks import Port
+from tasks import FusedTask
+from tasks import MapTask
+from tasks import Sink
+from tasks import gen_runner
+from tasks import run_sync
+from accounting import ResourceMeter
+from accounting import count_port_bytes
+from accounting import merge
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from payload import function_hash
+from payload import pack_function
+from payload import unpack_function
+from process import ProcessFactory
+from placement import LocalityPlanner
+from metrics import RunMetrics
+from logger import LogColor
+from logger import TaskLogger
+
+log = logging.getLogger(__name__)
+
+# Every frame on the wire is prefixed with its length
+_header = struct.Struct('!Q')
+
+################### Wire Utilities ######################
+
+
+def parse_address(address):
+    if isinstance(address, tuple):
+        return address
+    host, port = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+def send_frame(sock, data):
+    sock.sendall(_header.pack(len(data)))
+    sock.sendall(data)
+
+
+def recv_frame(sock):
+    size = _header.unpack(_recv_exactly(sock, _header.size))[0]
+    return _recv_exactly(sock, size)
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if not n:
+            raise Exception("Connection closed while receiving")
+        received += n
+    return buf
+
+
+def send_msg(sock, msg):
+    send_frame(sock, pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def recv_msg(sock):
+    return pickle.loads(recv_frame(sock))
+
+
+def request(address, msg):
+    """ Sends a message to the daemon at the address and returns its reply """
+
+    with socket.create_connection(parse_address(address)) as sock:
+        send_msg(sock, msg)
+        return recv_msg(sock)
+
+
+################### Value Store ######################
+
+
+class ValueStore(object):
+    """ Serialized task outputs held by a worker until consumers pull them
+
+    Each value is reference counted by the number of consumer edges of the
+    out-port which produced it. A value is dropped as soon as the last
+    consumer has pulled it.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.refs = {}
+        self.lock = threading.Lock()
+
+    def put(self, key, data, refs=1):
+        """ Stores the value for 'refs' more consumers """
+
+        with self.lock:
+            self.values[key] = data
+            self.refs[key] = self.refs.get(key, 0) + refs
+
+    def get(self, key):
+        with self.lock:
+            return self.values.get(key, None)
+
+    def take(self, key):
+        """ Gets the value on behalf of a consumer and drops its reference """
+
+        with self.lock:
+            data = self.values.get(key, None)
+            if data is not None:
+                self.refs[key] -= 1
+                if self.refs[key] <= 0:
+                    del self.values[key]
+                    del self.refs[key]
+            return data
+
+    def size(self):
+        with self.lock:
+            return sum(map(len, self.values.values()))
+
+
+class TcpPort(Port):
+    """ A port which streams serialized values between workers over TCP
+
+    An out-port publishes its value in the value store of the worker running
+    the task. The in-port of the consumer then pulls the value directly from
+    that worker. So values never touch a shared filesystem or the coordinator.
+
+    Attributes:
+        location: (worker address, value key) of the value this in-port
+            receives. Set by the coordinator once the producer has been placed
+        n_bytes: Size of the serialized value last fetched
+    """
+
+    def __init__(self, typ, name, index, task):
+        Port.__init__(self, typ, name, index, task)
+        self.is_one_sided_receive = False
+        self.location = None
+        self.n_bytes = 0
+
+    def send(self, value, to_port):
+        worker = Worker.current
+        key = "{}:{}".format(self.task_ref.id, self.index)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        worker.store.put(key, data)
+        count_port_bytes(self.task_ref, 'bytes_out', len(data))
+        to_port.location = (worker.address, key)
+
+    def fetch(self):
+        address, key = self.location
+        worker = Worker.current
+        if worker and worker.address == address:
+            # Value lives in this worker. No need to go over the wire.
+            data = worker.store.take(key)
+        else:
+            with socket.create_connection(address) as sock:
+                send_msg(sock, ('fetch', key))
+                data = recv_frame(sock)
+
+        if not data:
+            raise Exception("Value {} not found at {}:{}".format(
+                key, address[0], address[1]))
+        self.n_bytes = len(data)
+        if self.task_ref is not None:
+            count_port_bytes(self.task_ref, 'bytes_in', len(data))
+        return pickle.loads(data)
+
+    def receive(self, value=None, from_port=None):
+        self.task_ref._args[self.name] = self.fetch()
+        # Notify the task that it got a new input
+        self.notify_task()
+
+
+################### Worker Daemon ######################
+
+
+class _WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.worker.handle(self.request)
+
+
+class _WorkerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Worker(object):
+    """ A worker daemon which runs tasks on behalf of the coordinator
+
+    The coordinator sends a worker a task descriptor for each task placed on
+    it. Descriptors reference task code by content hash and carry the code
+    itself only if the worker has not seen it before. Workers cache the code
+    so each function gets shipped only once per worker.
+
+    Attributes:
+        address: (host, port) the worker is listening on
+        store: Serialized outputs of the tasks run at this worker
+        code_cache: Unpacked task functions keyed by their content hash
+        staged: Local paths of the resources staged at this worker keyed by
+            their URL
+    """
+
+    # Worker running within the current process if any
+    current = None
+
+    def __init__(self, host='localhost', port=0):
+        self.server = _WorkerServer((host, port), _WorkerHandler)
+        self.server.worker = self
+        self.address = (host, self.server.server_address[1])
+        self.store = ValueStore()
+        self.code_cache = {}
+        self.staged = {}
+        self.logger = None
+
+    def serve_forever(self):
+        Worker.current = self
+
+        # Handlers log through the current backend. Make sure there is one
+        # with a logger within the worker process
+        backend = Backend.get_current_backend()
+        if not isinstance(backend, TcpBackend):
+            Backend.set_current_backend(
+                BackendConfig(BackendType.TCP, "Tcp Worker"))
+            backend = Backend.get_current_backend()
+        backend.logger = TaskLogger(
+            "worker_{}.log".format(self.address[1]), line_buffered=True)
+
+        self.server.serve_forever()
+        self.server.server_close()
+
+    def handle(self, sock):
+        msg = recv_msg(sock)
+        op = msg[0]
+        if op == 'run':
+            send_msg(sock, self.run(msg[1]))
+        elif op == 'fetch':
+            data = self.store.take(msg[1])
+            send_frame(sock, data if data is not None else b'')
+        elif op == 'staged':
+            send_msg(sock, ('ok', [
+                url for url, path in self.staged.items()
+                if os.path.isfile(path)
+            ]))
+        elif op == 'ping':
+            send_msg(sock, ('ok', ))
+        elif op == 'shutdown':
+            send_msg(sock, ('ok', ))
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            send_msg(sock, ('error', None, "Unknown op {}".format(op)))
+
+    def _get_function(self, member):
+        fn = self.code_cache.get(member['hash'], None)
+        if fn is None and member['code'] is not None:
+            fn = unpack_function(member['code'])
+            self.code_cache[member['hash']] = fn
+        return fn
+
+    def _call(self, fn, kwargs, handlers, executor, usage):
+        runner = gen_runner(fn, inspect.signature(fn), handlers)
+        if executor in ('process', 'subprocess'):
+            child_usage = {}
+            ret = ProcessFactory.run_in_process(
+                lambda **kw: run_sync(runner(**kw)), kwargs, child_usage)
+            # Results only get pickled on their way back to this worker
+            child_usage.pop('bytes_out', None)
+            merge(usage, child_usage)
+            return ret
+        return run_sync(runner(**kwargs))
+
+    def run(self, desc):
+        fns = []
+        for member in desc['members']:
+            fn = self._get_function(member)
+            if fn is None:
+                return ('missing_code', member['hash'])
+            fns.append(fn)
+
+        # Resources used by the unit. Requests are served on threads of their
+        # own so only this thread gets metered. Members run in child processes
+        # get their usage added.
+        usage = {'bytes_in': 0, 'bytes_out': 0}
+        meter = ResourceMeter(per_thread=True)
+        meter.start()
+        try:
+            # Pull the inputs from the workers holding them
+            kwargs = dict(desc['members'][0]['immediates'])
+            for name, location in desc['inputs'].items():
+                inport = TcpPort(None, name, -1, None)
+                inport.location = location
+                kwargs[name] = inport.fetch()
+                usage['bytes_in'] += inport.n_bytes
+
+            # Run the (possibly fused) task passing values between members
+            # through local variables
+            ret = None
+            prev = None
+            for member, fn in zip(desc['members'], fns):
+                if prev is not None:
+                    kwargs = dict(member['immediates'])
+                    for index, name in member['links']:
+                        kwargs[name] = ret[index] if prev['multi_output'] \
+                                else ret
+
+                url = desc['staged_url'] if prev is None else None
+                path = self.staged.get(url, None) if url else None
+                if path and os.path.isfile(path):
+                    # Resource is already local to this worker. Skip staging.
+                    ret = path
+                elif member['map']:
+                    # Map tasks run their elements one after the other
+                    param = member['map']
+                    ret = []
+                    for item in kwargs.pop(param):
+                        kwargs[param] = item
+                        ret.append(self._call(fn, dict(kwargs),
+                                              member['handlers'],
+                                              desc['executor'], usage))
+                else:
+                    ret = self._call(fn, kwargs, member['handlers'],
+                                     desc['executor'], usage)
+                    if url:
+                        self.staged[url] = os.path.abspath(ret)
+                prev = member
+        except Exception:
+            return ('error', desc['tid'], traceback.format_exc())
+
+        # Publish the outputs for the consumers to pull
+        sizes = {}
+        for index, consumers in desc['outputs'].items():
+            value = ret[index] if prev['multi_output'] else ret
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self.store.put("{}:{}".format(desc['tid'], index), data,
+                           consumers)
+            usage['bytes_out'] += len(data)
+            # Files stay at this worker. Placement needs their actual size
+            # rather than the size of their path.
+            file_bytes = None
+            if isinstance(value, str) and os.path.isfile(value):
+                file_bytes = os.path.getsize(value)
+            sizes[index] = (len(data), file_bytes)
+
+        meter.stop()
+        merge(usage, meter.usage)
+        sink_value = ret if desc['is_sink'] else None
+        return ('done', desc['tid'], sizes, sink_value, usage)
+
+
+def _serve(conn, host):
+    worker = Worker(host, 0)
+    conn.send(worker.address)
+    conn.close()
+    worker.serve_forever()
+
+
+def spawn_local_workers(n_workers, host='localhost'):
+    """ Starts worker daemons as local processes
+
+    Returns:
+        A list of (process, address) tuples
+    """
+
+    workers = []
+    for _ in range(n_workers):
+        reader, writer = Pipe(duplex=False)
+        p = Process(target=_serve, args=(writer, host))
+        p.start()
+        workers.append((p, reader.recv()))
+        reader.close()
+    return workers
+
+
+################### Coordinator ######################
+
+
+@Backend.register_backend
+class TcpBackend(Backend):
+    """ Runs the task graph on a set of worker daemons over TCP
+
+    The backend acts as the coordinator. It places each executable unit (a
+    task or a fused task) on a worker once all of its parents have completed
+    and tells the worker where to pull the unit's inputs from. Workers talk
+    to each other directly to move values. Placement is locality aware (see
+    LocalityPlanner) so that consumers run where their inputs already are.
+
+    Backend options:
+        workers: Addresses ('host:port') of running worker daemons
+        num_workers: Number of local worker processes to start if no worker
+            addresses were given. Defaults to 2
+        spread_bytes: Input size under which tasks may be placed away from
+            their inputs for parallelism. Defaults to 1MB
+        metrics_file: File the run metrics get written to as JSON
+        profile_dir: Directory the collapsed stacks and top functions of the
+            tasks run with the 'cprofile' handler get written to. Workers
+            profile the tasks they run and ship the captures back with their
+            usage. Defaults to the current directory
+
+    Attributes:
+        workers: Addresses of the workers in use
+        planner: Placement planner of the current run
+        placements: Worker address each unit was placed on, keyed by unit id
+        outputs: Values output by the sinks of the graph keyed by unit id
+        metrics: RunMetrics of the current run. Workers meter the resources
+            used by each unit they run (including the bytes of the values it
+            pulled and published) and send them back with its completion
+    """
+
+    name = "TCP"
+
+    def __init__(self, backend_config):
+        Backend.__init__(self, backend_config)
+        self.logger = None
+        self.workers = list(
+            map(parse_address, self.config.options.get('workers', [])))
+        self.local_workers = []
+        self.planner = None
+        self.packed = {}
+        self.worker_code = defaultdict(set)
+        self.placements = {}
+        self.outputs = {}
+        self.completions = queue.Queue()
+        self.metrics = None
+
+    def get_port(self, typ, name, index, task):
+        return TcpPort(typ, name, index, task)
+
+    def package(self):
+        pass
+
+    def deploy(self):
+        pass
+
+    def _pack(self, fn):
+        packed = self.packed.get(id(fn), None)
+        if packed is None:
+            code = pack_function(fn)
+            packed = (function_hash(code), code)
+            self.packed[id(fn)] = packed
+        return packed
+
+    def _get_unit(self, graph, task):
+        return graph.fusee_map.get(task.id, task)
+
+    def _describe(self, graph, unit, address):
+        members = unit.tasks if isinstance(unit, FusedTask) else [unit]
+        head = members[0]
+
+        inputs = {}
+        for name, inport in head.inputs.items():
+            if not inport.is_immediate and inport.inport_edge:
+                source = inport.inport_edge.source
+                parent = self._get_unit(graph, source.task_ref)
+                inputs[name] = (self.placements[parent.id],
+                                "{}:{}".format(parent.id, source.index))
+
+        member_descs = []
+        prev = None
+        for member in members:
+            links = []
+            if prev:
+                links = [(edge.source.index, edge.dest.name)
+                         for edge in prev.edges]
+            linked = set(map(lambda link: link[1], links))
+
+            immediates = {}
+            for name, inport in member.inputs.items():
+                if inport.is_immediate and name in member._args and \
+                        name not in linked:
+                    immediates[name] = member._args[name]
+
+            fn_hash, code = self._pack(member._fn)
+            member_descs.append({
+                'hash': fn_hash,
+                'code': None if fn_hash in self.worker_code[address] else code,
+                'immediates': immediates,
+                'links': links,
+                'multi_output': type(member._sig.return_annotation) == tuple,
+                'handlers': member.handlers,
+                'map': member.map_param if isinstance(member, MapTask)
+                else None,
+            })
+            prev = member
+
+        # Number of consumers of each output. Workers drop an output once all
+        # of its consumers have pulled it.
+        outputs = defaultdict(int)
+        is_sink = False
+        for edge in unit.edges:
+            if isinstance(edge.dest, Sink):
+                is_sink = True
+            else:
+                outputs[edge.source.index] += 1
+
+        staged_url = None
+        if head.is_staging:
+            staged_url = head._args.get('infile', None)
+
+        return {
+            'tid': unit.id,
+            'name': unit.name,
+            'staged_url': staged_url,
+            'members': member_descs,
+            'inputs': inputs,
+            'outputs': dict(outputs),
+            'is_sink': is_sink,
+            'executor': unit.executor,
+        }
+
+    def _run_remote(self, graph, unit, address):
+        try:
+            reply = request(address, ('run', self._describe(
+                graph, unit, address)))
+            if reply[0] == 'missing_code':
+                # Worker lost its code cache (e.g: it got restarted). Resend
+                # the descriptor with all the code.
+                self.worker_code[address].clear()
+                reply = request(address, ('run', self._describe(
+                    graph, unit, address)))
+        except Exception:
+            reply = ('error', unit.id, traceback.format_exc())
+        self.completions.put((unit, address, reply))
+
+    def run_task(self, task):
+        graph = task.graph
+        address = self.planner.place(graph, task)
+        self.placements[task.id] = address
+        threading.Thread(
+            target=self._run_remote, args=(graph, task, address)).start()
+
+    def _on_completed(self, unit, address, reply):
+        # Worker now has the code of all the members cached
+        members = unit.tasks if isinstance(unit, FusedTask) else [unit]
+        for member in members:
+            self.worker_code[address].add(self._pack(member._fn)[0])
+
+        if reply[0] == 'error':
+            raise Exception("Task {} failed at {}:{}\n{}".format(
+                unit.name, address[0], address[1], reply[2]))
+
+        _, tid, sizes, sink_value, usage = reply
+        self.planner.record_outputs(unit, address, sizes)
+        self.metrics.record_usage(unit, usage, executor=unit.executor,
+                                  worker="{}:{}".format(*address))
+        for edge in unit.edges:
+            if isinstance(edge.dest, Sink):
+                multi = type(edge.source.task_ref._sig.return_annotation) \
+                        == tuple
+                value = sink_value[edge.source.index] if multi else sink_value
+                edge.dest.receive(value, edge.source)
+                self.outputs[unit.id] = sink_value
+
+    def run_flow(self, graph):
+        self.logger = TaskLogger("{}.log".format(graph.name))
+        self.metrics = RunMetrics(graph.name, self.name)
+
+        if not self.workers:
+            self.local_workers = spawn_local_workers(
+                self.config.options.get('num_workers', 2))
+            self.workers = list(map(lambda w: w[1], self.local_workers))
+
+        self.planner = LocalityPlanner(
+            self.workers,
+            self.config.options.get('spread_bytes', 1024 * 1024))
+        # Resources staged by the workers in earlier runs need not be staged
+        # again
+        for address in self.workers:
+            for url in request(address, ('staged', ))[1]:
+                self.planner.staged[url] = address
+
+        # Executable units are tasks not contained within a fused task
+        units = {}
+        for tid, task in graph.tasks.items():
+            if isinstance(task, FusedTask) or not task.is_fusee:
+                units[tid] = task
+
+        children = {}
+        n_parents = defaultdict(int)
+        for tid, unit in units.items():
+            children[tid] = set()
+            for edge in unit.edges:
+                if not isinstance(edge.dest, Sink):
+                    children[tid].add(self._get_unit(graph, edge.dest.task_ref))
+            for child in children[tid]:
+                n_parents[child.id] += 1
+
+        for tid, source in graph.sources.items():
+            self.run_task(source)
+
+        remaining = len(units)
+        while remaining:
+            unit, address, reply = self.completions.get()
+            self._on_completed(unit, address, reply)
+            remaining -= 1
+
+            for child in children[unit.id]:
+                n_parents[child.id] -= 1
+                if not n_parents[child.id]:
+                    self.run_task(child)
+
+        for line in self.planner.report():
+            self.logger.log(
+                self.logger.fmt("[Placement] {}".format(line), LogColor.BLUE))
+        self.logger.flush()
+        self.metrics.publish(graph,
+                             self.config.options.get('metrics_file', None),
+                             self.config.options.get('profile_dir', None))
+
+    def cleanup(self, graph):
+        # Stop any workers we started
+        for process, address in self.local_workers:
+            request(address, ('shutdown', ))
+            process.join()
+        self.local_workers = []
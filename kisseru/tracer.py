@@ -6,7 +6,7 @@ from backend import Backend
 
 class TraceEntry(Handler):
     def __init__(self, name):
-        Handler.__init__(self, name)
+        Handler.__init__(self, name, "trace")
 
     def run(self, ctx):
         logger = Backend.get_current_backend().logger
@@ -38,7 +38,7 @@ class TraceEntry(Handler):
 
 class TraceExit(Handler):
     def __init__(self, name):
-        Handler.__init__(self, name)
+        Handler.__init__(self, name, "trace")
 
     def run(self, ctx):
         logger = Backend.get_current_backend().logger
@@ -0,0 +1,487 @@
+import importlib
+import importlib.util
+import io
+import logging
+import os
+import time
+import weakref
+import zlib
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+from accounting import count_port_bytes
+from backend import Backend
+from utils import fmt_bytes
+
+log = logging.getLogger(__name__)
+
+# Transfer files written with a serializer other than pickle, or compressed,
+# start with the magic followed by the serializer name and the codec name
+# (empty unless compressed), each prefixed by its length. Anything else is a
+# plain pickle.
+MAGIC = b"KSRZ"
+
+# Pickle protocol 5 handles large buffers (e.g: of arrays) efficiently
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+# Arrays smaller than this are cheaper to copy than to map
+DEFAULT_MMAP_MIN_SIZE = 1024 * 1024
+
+# Values pickling to less than this are not worth compressing
+DEFAULT_MIN_SIZE = 64 * 1024
+
+# Bytes compressed per sample when estimating compressibility
+SAMPLE_SIZE = 16 * 1024
+
+SAMPLES = 4
+
+# Auto selection leaves values alone unless sampling shrinks them below this
+# fraction of their size
+AUTO_MAX_RATIO = 0.9
+
+
+class Codec(object):
+    """ A compression codec usable for transfers
+
+    Attributes:
+        name: Name used to ask for the codec and recorded in the transfer file
+        compress: Callable taking the bytes and the level
+        decompress: Callable taking the compressed bytes
+        level: Level used unless one is asked for
+    """
+
+    def __init__(self, name, compress, decompress, level):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+        self.level = level
+
+
+class CodecRegistry(object):
+    codecs = {}
+
+    @staticmethod
+    def register(codec):
+        CodecRegistry.codecs[codec.name] = codec
+
+    @staticmethod
+    def get_codec(name):
+        codec = CodecRegistry.codecs.get(name, None)
+        if codec is None:
+            raise Exception("Unknown compression codec {}. Available codecs "
+                            "are {}".format(
+                                name, ", ".join(sorted(CodecRegistry.codecs))))
+        return codec
+
+
+def _has_module(name, cache={}):
+    if name not in cache:
+        try:
+            cache[name] = importlib.util.find_spec(name) is not None
+        except ImportError:
+            # Parent package is missing
+            cache[name] = False
+    return cache[name]
+
+
+# Codec libraries other than zlib get imported when a transfer first uses
+# them, so that processes which don't compress don't pay for them
+_module = importlib.import_module
+
+CodecRegistry.register(
+    Codec('zlib', zlib.compress, zlib.decompress, 6))
+CodecRegistry.register(
+    Codec('bz2', lambda data, level: _module('bz2').compress(data, level),
+          lambda data: _module('bz2').decompress(data), 9))
+CodecRegistry.register(
+    Codec('lzma', lambda data, level: _module('lzma').compress(
+        data, preset=level), lambda data: _module('lzma').decompress(data),
+          6))
+
+# Faster codecs are used when their libraries are around
+if _has_module('lz4'):
+    CodecRegistry.register(
+        Codec('lz4', lambda data, level: _module('lz4.frame').compress(
+            data, compression_level=level),
+              lambda data: _module('lz4.frame').decompress(data), 0))
+
+if _has_module('zstandard'):
+    CodecRegistry.register(
+        Codec('zstd', lambda data, level: _module(
+            'zstandard').ZstdCompressor(level=level).compress(data),
+              lambda data: _module('zstandard').ZstdDecompressor(
+              ).decompress(data), 3))
+
+
+class Serializer(object):
+    """ Turns values of some types in to bytes and back
+
+    Attributes:
+        name: Name recorded in the transfer file
+        dumps: Callable returning the bytes (or a buffer) of a value
+        loads: Callable taking the bytes
+        accepts: Callable telling whether a value can be serialized. Used to
+            fall back on pickle for values the serializer can't represent
+            faithfully (e.g: subclasses)
+    """
+
+    def __init__(self, name, dumps, loads, accepts=None):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.accepts = accepts if accepts else lambda value: True
+
+
+class SerializerRegistry(object):
+    """ Picks the serializer of values sent over file based ports
+
+    Serializers are keyed by kisseru type id (e.g: 'str') and by the fully
+    qualified name of python types (e.g: 'numpy.ndarray'), so that libraries
+    don't have to be imported unless a value of theirs gets sent. The type of
+    the port is looked up first, then the python type of the value and its
+    bases. Pickle is used when nothing else takes the value.
+    """
+
+    serializers = {}
+    type_ids = {}
+    py_types = {}
+
+    @staticmethod
+    def register(serializer, type_ids=(), py_types=()):
+        SerializerRegistry.serializers[serializer.name] = serializer
+        for type_id in type_ids:
+            SerializerRegistry.type_ids[type_id] = serializer.name
+        for py_type in py_types:
+            SerializerRegistry.py_types[py_type] = serializer.name
+
+    @staticmethod
+    def get_serializer(name):
+        serializer = SerializerRegistry.serializers.get(name, None)
+        if serializer is None:
+            raise Exception("Unknown serializer {}".format(name))
+        return serializer
+
+    @staticmethod
+    def lookup(value, typ=None):
+        names = []
+        if typ is not None:
+            names.append(SerializerRegistry.type_ids.get(str(typ), None))
+        for klass in type(value).__mro__:
+            names.append(SerializerRegistry.py_types.get(
+                "{}.{}".format(klass.__module__, klass.__qualname__), None))
+
+        for name in names:
+            if name is None:
+                continue
+            serializer = SerializerRegistry.serializers[name]
+            if serializer.accepts(value):
+                return serializer
+        return SerializerRegistry.serializers['pickle']
+
+
+def _dump_array(array):
+    import numpy
+    fp = io.BytesIO()
+    numpy.save(fp, array, allow_pickle=False)
+    return fp.getbuffer()
+
+
+def _load_array(data):
+    import numpy
+    return numpy.load(io.BytesIO(data), allow_pickle=False)
+
+
+def _dump_frame(frame):
+    import pyarrow
+    import pyarrow.feather
+    sink = pyarrow.BufferOutputStream()
+    pyarrow.feather.write_feather(frame, sink, compression='uncompressed')
+    return memoryview(sink.getvalue())
+
+
+def _load_frame(data):
+    import pyarrow
+    import pyarrow.feather
+    return pyarrow.feather.read_feather(pyarrow.BufferReader(data))
+
+
+SerializerRegistry.register(
+    Serializer('pickle', lambda value: pickle.dumps(value, PICKLE_PROTOCOL),
+               pickle.loads))
+SerializerRegistry.register(
+    Serializer('str', lambda value: value.encode('utf-8'),
+               lambda data: str(data, 'utf-8'),
+               lambda value: type(value) is str),
+    type_ids=('str', ), py_types=('builtins.str', ))
+SerializerRegistry.register(
+    Serializer('bytes', lambda value: value, bytes,
+               lambda value: type(value) is bytes),
+    py_types=('builtins.bytes', ))
+# Arrays are written in the .npy format which is a small header followed by
+# the raw buffer. Arrays of python objects need pickle.
+SerializerRegistry.register(
+    Serializer('npy', _dump_array, _load_array,
+               lambda value: not value.dtype.hasobject),
+    py_types=('numpy.ndarray', ))
+# Feather (Arrow IPC) needs pyarrow and frames with string column names
+SerializerRegistry.register(
+    Serializer('feather', _dump_frame, _load_frame,
+               lambda value: _has_module('pyarrow') and all(
+                   isinstance(column, str) for column in value.columns)),
+    py_types=('pandas.core.frame.DataFrame', ))
+
+
+def parse_spec(spec):
+    """ Parses a compression spec
+
+    A spec is a codec name optionally followed by a level (e.g: 'lzma:9'),
+    'auto' or 'none'.
+
+    Returns:
+        (codec name, level) tuple. The codec name is None when transfers are
+        not compressed. The level is None unless given.
+    """
+
+    if spec is None or spec is False or spec == 'none':
+        return (None, None)
+    if spec is True:
+        return ('auto', None)
+
+    name, _, level = str(spec).partition(':')
+    if name != 'auto':
+        CodecRegistry.get_codec(name)
+    return (name, int(level) if level else None)
+
+
+def get_spec(outport):
+    """ Compression spec of the values sent from the given out-port
+
+    The task's @task(compress=...) takes precedence. It is either a spec for
+    all of its outputs or a dict of specs keyed by out-port name (i.e: the
+    output index). Then comes the 'compress_types' backend option mapping
+    type names to specs and finally the 'compress' backend option.
+    """
+
+    spec = outport.task_ref.configs.get('compress', None)
+    if isinstance(spec, dict):
+        spec = spec.get(outport.name, None)
+    if spec is not None:
+        return spec
+
+    options = Backend.get_current_backend().config.options
+    spec = options.get('compress_types', {}).get(str(outport.type), None)
+    if spec is not None:
+        return spec
+    return options.get('compress', None)
+
+
+def _auto_codec(data, min_size):
+    # Compresses a few evenly spaced samples with a cheap setting to see
+    # whether compressing the whole of the value pays off
+    if len(data) < min_size:
+        return (None, None, None)
+
+    stride = max((len(data) - SAMPLE_SIZE) // max(SAMPLES - 1, 1), 1)
+    raw = 0
+    compressed = 0
+    for start in range(0, len(data), stride)[:SAMPLES]:
+        sample = data[start:start + SAMPLE_SIZE]
+        raw += len(sample)
+        compressed += len(zlib.compress(sample, 1))
+    ratio = compressed / float(raw)
+
+    if ratio > AUTO_MAX_RATIO:
+        return (None, None, ratio)
+    for name in ('lz4', 'zstd'):
+        if name in CodecRegistry.codecs:
+            return (name, None, ratio)
+    return ('zlib', 1, ratio)
+
+
+def _header(serializer, codec):
+    header = MAGIC
+    for name in (serializer, codec):
+        encoded = name.encode()
+        header += bytes([len(encoded)]) + encoded
+    return header
+
+
+def dump(value, fp, spec=None, label="", min_size=DEFAULT_MIN_SIZE,
+         typ=None):
+    """ Serializes the value in to the file compressing it as the spec asks
+
+    Args:
+        value: Value to write
+        fp: File opened for writing in binary mode
+        spec: Compression spec. See parse_spec()
+        label: Describes the transfer in the log
+        min_size: Smallest size worth compressing in 'auto' mode
+        typ: kisseru Type of the value, if known
+    """
+
+    serializer = SerializerRegistry.lookup(value, typ)
+    data = serializer.dumps(value)
+    name, level = parse_spec(spec)
+
+    if name == 'auto':
+        name, level, estimate = _auto_codec(data, min_size)
+        if name is None and estimate is not None:
+            log.debug("Not compressing {} (sampled ratio {:.2f})".format(
+                label, estimate))
+
+    if name is None:
+        if serializer.name != 'pickle':
+            fp.write(_header(serializer.name, ""))
+        fp.write(data)
+        return
+
+    codec = CodecRegistry.get_codec(name)
+    level = codec.level if level is None else level
+    start = time.perf_counter()
+    compressed = codec.compress(data, level)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    fp.write(_header(serializer.name, name))
+    fp.write(compressed)
+
+    log.info("Compressed {} with {}:{} {} -> {} ({:.2f}x) at {}/s".format(
+        label, name, level, fmt_bytes(len(data)), fmt_bytes(len(compressed)),
+        len(data) / float(max(len(compressed), 1)),
+        fmt_bytes(len(data) / elapsed)))
+
+
+def load(fp, mmap_mode='r'):
+    """ Reads a value written by dump() (or a plain pickle) from the file
+
+    Args:
+        fp: File opened for reading in binary mode
+        mmap_mode: Mode shared arrays get mapped with. 'r' maps them read
+            only and 'c' copy on write.
+    """
+
+    data = fp.read()
+    if not data.startswith(MAGIC):
+        return pickle.loads(data)
+
+    data = memoryview(data)
+    offset = len(MAGIC)
+    names = []
+    for _ in range(2):
+        length = data[offset]
+        names.append(str(data[offset + 1:offset + 1 + length], 'utf-8'))
+        offset += 1 + length
+    data = data[offset:]
+
+    if names[0] == 'mmap':
+        import numpy
+        return numpy.load(str(data, 'utf-8'), mmap_mode=mmap_mode)
+    serializer = SerializerRegistry.get_serializer(names[0])
+
+    if names[1]:
+        codec = CodecRegistry.get_codec(names[1])
+        begin = time.perf_counter()
+        data = codec.decompress(data)
+        elapsed = max(time.perf_counter() - begin, 1e-9)
+        log.debug("Decompressed {} with {} at {}/s".format(
+            fmt_bytes(len(data)), names[1], fmt_bytes(len(data) / elapsed)))
+    return serializer.loads(data)
+
+
+# Arrays written by this process keyed by the path they were written to
+_shared = {}
+
+
+def _shared_path(outport):
+    return os.path.abspath("{}_{}.npy".format(outport.task_ref.id,
+                                              outport.name))
+
+
+def _maps(outport, value, options):
+    # Only plain arrays can be mapped back
+    if type(value).__module__ != 'numpy' or \
+            type(value).__name__ not in ('ndarray', 'memmap') or \
+            value.dtype.hasobject:
+        return False
+
+    mmap = outport.task_ref.configs.get('mmap', None)
+    if mmap is None:
+        mmap = options.get('mmap_arrays', False)
+    return mmap and value.nbytes >= options.get('mmap_min_size',
+                                                DEFAULT_MMAP_MIN_SIZE)
+
+
+def _share_array(outport, value):
+    # An out-port sends the same value down each of its edges. The array only
+    # gets written for the first one.
+    path = _shared_path(outport)
+    shared = _shared.get(path, None)
+    if shared is None or shared() is not value:
+        import numpy
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            numpy.save(fp, value, allow_pickle=False)
+        os.replace(tmp_path, path)
+        _shared[path] = weakref.ref(value)
+    return path
+
+
+def write(outport, value, filename):
+    """ Writes a value sent from the out-port to a transfer file
+
+    Given the 'mmap_arrays' backend option (or @task(mmap=True)) numpy arrays
+    of at least 'mmap_min_size' bytes (1M by default) are written once to an
+    .npy file next to the transfer files, which then only refer to it. Their
+    consumers map the array instead of reading in a copy of their own, so
+    that the consumers of an array share its pages.
+
+    Bytes written get accounted to the task of the out-port. Only the
+    reference of a shared array counts since that is all its consumers read.
+    """
+
+    options = Backend.get_current_backend().config.options
+    if _maps(outport, value, options):
+        path = _share_array(outport, value)
+        with open(filename, 'wb') as fp:
+            fp.write(_header('mmap', ""))
+            fp.write(path.encode('utf-8'))
+            count_port_bytes(outport.task_ref, 'bytes_out', fp.tell())
+        return
+
+    label = "{}:{} -> {}".format(outport.task_ref.name, outport.name,
+                                 filename)
+    with open(filename, 'wb') as fp:
+        dump(value, fp, get_spec(outport), label,
+             options.get('compress_min_size', DEFAULT_MIN_SIZE),
+             outport.type)
+        count_port_bytes(outport.task_ref, 'bytes_out', fp.tell())
+
+
+def read(filename, inport=None):
+    """ Reads a value from a transfer file
+
+    Shared arrays are mapped read only unless the task owning the in-port
+    asked for @task(copy_arrays=True). It then gets a copy on write mapping,
+    so that writing to the array doesn't affect the other consumers.
+    """
+
+    mmap_mode = 'r'
+    if inport is not None and inport.task_ref.configs.get('copy_arrays',
+                                                          False):
+        mmap_mode = 'c'
+    with open(filename, 'rb') as fp:
+        value = load(fp, mmap_mode)
+        if inport is not None:
+            count_port_bytes(inport.task_ref, 'bytes_in', fp.tell())
+        return value
+
+
+def remove_shared(task):
+    """ Removes the arrays shared by the out-ports of the task """
+
+    # Fused tasks have no out-ports of their own. Their members get asked.
+    for name, outport in getattr(task, 'outputs', {}).items():
+        path = _shared_path(outport)
+        if os.path.isfile(path):
+            os.remove(path)
@@ -1,5 +1,4 @@
 import inspect
-import pandas as pd
 
 from utils import get_file_name_without_extention
 from utils import get_file_extention
@@ -21,6 +20,8 @@ def csv_to_xls(infile):
 def xls_to_csv(infile):
     file_name = get_file_name_without_extention(infile)
     new_file_name = file_name + '.csv'
+    # pandas takes a while to import. Only pay for it when transforming.
+    import pandas as pd
     df = pd.read_excel(infile)
     df.to_csv(
         new_file_name,
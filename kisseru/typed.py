@@ -1,3 +1,4 @@
+import inspect
 from enum import Enum
 from passes import Pass
 from passes import PassResult
@@ -48,7 +49,7 @@ class FileType(Type):
         self.domain = domain
 
 
-def UserDefinedType(Type):
+class UserDefinedType(Type):
     def __init__(self, type_id, typ):
         Type.__init__(self, type_id, typ)
         self.meta = MetaType.USER_DEF
@@ -65,6 +66,8 @@ def get_type(typ):
         return BuiltinType('dict', typ)
     elif typ == float:
         return BuiltinType('float', typ)
+    elif typ == list:
+        return BuiltinType('list', typ)
     elif typ == 'csv':
         return FileType('csv', None)
     elif typ == 'xls':
@@ -75,6 +78,9 @@ def get_type(typ):
         return BuiltinType('void', typ)
     elif type == 'anyfile':
         return FileType('unknown', typ)
+    elif inspect.isclass(typ):
+        # Other classes (e.g: numpy.ndarray) are known by their name
+        return UserDefinedType(typ.__name__, typ)
 
 
 def is_castable(type1, type2):
@@ -1,4 +1,5 @@
 import re
+import sys
 import logging
 
 ################### String Utilities ######################
@@ -73,24 +74,61 @@ def gen_tuple(ls):
 
     if not len(ls):
         return ()
-    elif len(ls) > 10:
-        return None
-
-    length = len(ls)
-    switcher = {
-        1: (ls[0]),
-        2: (ls[0], ls[1]),
-        3: (ls[0], ls[1], ls[2]),
-        4: (ls[0], ls[1], ls[2], ls[3]),
-        5: (ls[0], ls[1], ls[2], ls[3], ls[4]),
-        6: (ls[0], ls[1], ls[2], ls[3], ls[4], ls[5]),
-        7: (ls[0], ls[1], ls[2], ls[3], ls[4], ls[5], ls[6]),
-        8: (ls[0], ls[1], ls[2], ls[3], ls[4], ls[5], ls[6], ls[7]),
-        9: (ls[0], ls[1], ls[2], ls[3], ls[4], ls[5], ls[6], ls[7], ls[8]),
-        10: (ls[0], ls[1], ls[2], ls[3], ls[4], ls[5], ls[6], ls[7], ls[8],
-             ls[9])
-    }
-    return switcher.get(length, None)
+
+    # A single element is returned as it is rather than as a 1-tuple
+    if len(ls) == 1:
+        return ls[0]
+    return tuple(ls)
+
+
+################### Size Utilities ######################
+
+_size_units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def parse_bytes(size):
+    """ Parses a size given as bytes or as a string like '512M' or '2G' """
+
+    if size == None or isinstance(size, (int, float)):
+        return size
+
+    match = re.match(r'^\s*([0-9.]+)\s*([KMGT]?)B?\s*$', size.upper())
+    if not match:
+        raise Exception("Invalid size {}".format(size))
+    return int(float(match.group(1)) * _size_units[match.group(2)])
+
+
+def fmt_bytes(n_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if n_bytes < 1024:
+            return "{:.1f} {}".format(n_bytes, unit)
+        n_bytes /= 1024.0
+    return "{:.1f} TB".format(n_bytes)
+
+
+def sizeof(value):
+    """ Approximate number of bytes held by a value """
+
+    # numpy arrays
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+
+    # pandas data frames and series
+    memory_usage = getattr(value, 'memory_usage', None)
+    if callable(memory_usage):
+        try:
+            usage = memory_usage(deep=True)
+            return int(getattr(usage, 'sum', lambda: usage)())
+        except Exception:
+            pass
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(map(sizeof, value))
+    elif isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sizeof(k) + sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
 
 
 ################### Logging Utilities ######################
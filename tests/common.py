@@ -3,6 +3,7 @@ import ast
 import inspect
 
 from ir import Function
+from tasks import gen_task
 
 
 def tabs_to_spaces(string):
@@ -97,3 +98,30 @@ def compile_fn(source):
 
     new_fn = types.FunctionType(func_code, {}, name="test_fn")
     return new_fn
+
+
+# Task functions shared by the graph tests
+
+
+def split(n) -> (int, int):
+    return (n, n * 10)
+
+
+def square(x) -> int:
+    return x * x
+
+
+def inc(x) -> int:
+    return x + 1
+
+
+def add(a, b) -> int:
+    return a + b
+
+
+# Adds a task calling fn with the given arguments to the graph. Returns the
+# tasklets of the task if it has multiple outputs and the task otherwise.
+def add_task(graph, fn, *args, **configs):
+    task, tasklets = gen_task(fn, inspect.signature(fn), args, {}, configs)
+    graph.add_task(task)
+    return tasklets if tasklets != () else task
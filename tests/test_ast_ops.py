@@ -6,6 +6,8 @@ import func
 
 from common import get_test_cases
 
+from ir import Function
+
 from utils import gen_spaces
 from func import normalize_fn_body
 from func import set_function_meta
@@ -37,6 +39,19 @@ class ASTOpsTestCase(unittest.TestCase):
             self.assertEqual(''.join(input_fn_ir.lines),
                              ''.join(output_fn_ir.lines))
 
+    def test_handle_scripts_async(self):
+        fn_ir = Function()
+        fn_ir.lines = [
+            "async def test3(x):\n", "    '''bash\n", "    %{y} = %{x}\n",
+            "    '''\n", "    return y\n"
+        ]
+
+        set_function_meta(fn_ir)
+        self.assertTrue(fn_ir.is_async)
+
+        handle_scripts(fn_ir)
+        self.assertIn("await run_script_async(", fn_ir.lines[2])
+
 
 if __name__ == "__main__":
     unittest.main()  # run all tests
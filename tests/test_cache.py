@@ -0,0 +1,216 @@
+import functools
+import inspect
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import types
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from cache import AppKey
+import common
+from common import inc
+from common import square
+from batching import Batching
+from cache import GraphCache
+from fusion import Fusion
+from graph_io import GraphWriter
+from graph_io import MAGIC
+from graph_io import dumps_graph
+from graph_io import loads_graph
+from local import LocalNonThreadedBackend
+from passes import PassContext
+from tasks import BatchTask
+from tasks import FusedTask
+from tasks import gen_map_task
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+
+SCALE = 10
+RESULTS = {}
+
+
+def split(n) -> (int, int):
+    return (n, n * SCALE)
+
+
+def add(a, b) -> int:
+    RESULTS['add'] = a + b
+    return a + b
+
+
+def numbers(n) -> list:
+    return list(range(n))
+
+
+def total(xs) -> int:
+    RESULTS['total'] = sum(xs)
+    return sum(xs)
+
+
+def record(x) -> int:
+    RESULTS.setdefault('recorded', set()).add(x)
+    return x
+
+
+def recompiled(fn):
+    # Stands in for ASTOps which makes task functions unreachable by name
+    new_fn = types.FunctionType(fn.__code__, fn.__globals__, fn.__name__)
+    new_fn.__annotations__ = fn.__annotations__
+    return new_fn
+
+
+def add_task(graph, fn, *args, **configs):
+    return common.add_task(graph, recompiled(fn), *args, **configs)
+
+
+def add_map_task(graph, fn, items):
+    task, _ = gen_map_task(recompiled(fn), inspect.signature(fn), items, (),
+                           {})
+    graph.add_task(task)
+    return task
+
+
+def pipeline(n):
+    lo, hi = split(n)
+    add(inc(square(lo)), square(hi))
+
+
+class GraphCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def test_cached_graph_runs(self):
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "cache_test"
+        lo, hi = add_task(graph, split, 3)
+        left = add_task(graph, inc, add_task(graph, square, lo))
+        add_task(graph, add, left, add_task(graph, square, hi))
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Fusion("fuse"), PostProcess("post")]:
+            p.run(graph, ctx)
+        num_tasks = graph.get_num_tasks()
+
+        cache = GraphCache(os.path.join(self.tmp_dir, "cache"))
+        cache.store("key", graph)
+        # Loading replaces the graph held in the process
+        graph.reset()
+        self.assertIsNone(cache.load("missing"))
+
+        loaded = cache.load("key")
+        self.assertEqual(loaded.name, "cache_test")
+        self.assertEqual(loaded.get_num_tasks(), num_tasks)
+        fused = [t for t in loaded.tasks.values() if isinstance(t, FusedTask)]
+        self.assertEqual([t.name for t in fused], ["square__inc"])
+
+        RESULTS.clear()
+        Backend.get_current_backend().run_flow(loaded)
+        self.assertEqual(RESULTS['add'], 3 * 3 + 1 + 30 * 30)
+
+    def test_serialized_graph(self):
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "ir_test"
+        lo, hi = add_task(graph, split, 3)
+        left = add_task(graph, inc, add_task(graph, square, lo))
+        add_task(graph, add, left, add_task(graph, square, hi))
+        add_task(graph, total,
+                 add_map_task(graph, square, add_task(graph, numbers, 4)))
+        for i in range(4):
+            add_task(graph, record, i, batch=4)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Batching("batch"), Fusion("fuse"),
+                  PostProcess("post")]:
+            p.run(graph, ctx)
+        num_tasks = graph.get_num_tasks()
+
+        # Tasks of the same function share their code
+        doc = GraphWriter(graph).write()
+        self.assertEqual(len(doc['code']), 7)
+
+        data = dumps_graph(graph)
+        graph.reset()
+        loaded = loads_graph(data)
+        self.assertEqual(loaded.name, "ir_test")
+        self.assertEqual(loaded.get_num_tasks(), num_tasks)
+        batches = [t for t in loaded.tasks.values()
+                   if isinstance(t, BatchTask)]
+        self.assertEqual(len(batches), 1)
+        self.assertTrue(all(t.batch is batches[0] for t in batches[0].tasks))
+        for fused in loaded.tasks.values():
+            if isinstance(fused, FusedTask):
+                self.assertIs(fused.inputs, fused.head.inputs)
+                self.assertIs(fused.edges, fused.tail.edges)
+
+        RESULTS.clear()
+        Backend.get_current_backend().run_flow(loaded)
+        self.assertEqual(RESULTS['add'], 3 * 3 + 1 + 30 * 30)
+        self.assertEqual(RESULTS['total'], 0 + 1 + 4 + 9)
+        self.assertEqual(RESULTS['recorded'], {0, 1, 2, 3})
+
+    def test_serialized_graph_checks(self):
+        # Graphs of other format versions are refused
+        data = MAGIC + pickle.dumps({'version': 1})
+        with self.assertRaises(Exception):
+            loads_graph(data)
+
+        # So is anything but builtins in the document
+        data = MAGIC + pickle.dumps({'version': 2, 'tasks': io.BytesIO()})
+        with self.assertRaises(pickle.UnpicklingError):
+            loads_graph(data)
+
+        with self.assertRaises(Exception):
+            loads_graph(pickle.dumps({'version': 2}))
+
+    def test_app_key(self):
+        global SCALE
+
+        def key(app, backend="Serial", **options):
+            return AppKey(app, backend, options).digest
+
+        base = key(functools.partial(pipeline, 3))
+        self.assertEqual(base, key(functools.partial(pipeline, 3)))
+        self.assertNotEqual(base, key(functools.partial(pipeline, 4)))
+        self.assertNotEqual(base, key(functools.partial(pipeline, 3), "Tcp"))
+        # Options which don't change the compiled graph are left out
+        self.assertEqual(
+            base, key(functools.partial(pipeline, 3), stats_file="s.json"))
+        # Neither do backend options read at run time
+        self.assertEqual(
+            base, key(functools.partial(pipeline, 3), mem_budget="1G",
+                      default_executor='thread', metrics_file="m.json",
+                      num_workers=4))
+        # Enabled handlers get baked in to the compiled task runners
+        self.assertNotEqual(
+            base, key(functools.partial(pipeline, 3), handlers=('trace', )))
+
+        # Constants reachable from the app change the key
+        SCALE = 20
+        try:
+            self.assertNotEqual(base, key(functools.partial(pipeline, 3)))
+        finally:
+            SCALE = 10
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,148 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import add_task
+from cprofiler import CProfileEntry
+from cprofiler import CProfileExit
+from cprofiler import RunProfile
+from handler import HandlerRegistry
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+from passes import PassContext
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def seed(n) -> int:
+    return n
+
+
+def crunch(n) -> int:
+    return fib(n)
+
+
+def report(x) -> int:
+    return x
+
+
+class CProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        self.handlers = (HandlerRegistry.pre_handlers,
+                         HandlerRegistry.post_handlers)
+        HandlerRegistry.pre_handlers = [CProfileEntry("CProfileEntry")]
+        HandlerRegistry.post_handlers = [CProfileExit("CProfileExit")]
+
+    def tearDown(self):
+        HandlerRegistry.pre_handlers, HandlerRegistry.post_handlers = \
+            self.handlers
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_graph(self, backend_type, options, handlers='cprofile'):
+        Backend.set_current_backend(
+            BackendConfig(backend_type, "Profile", options))
+        backend = Backend.get_current_backend()
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "profile_test"
+        value = add_task(graph, seed, 15, handlers=handlers)
+        value = add_task(graph, crunch, value, handlers=handlers)
+        add_task(graph, report, value, handlers=handlers)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        try:
+            backend.run_flow(graph)
+        finally:
+            backend.cleanup(graph)
+        return graph
+
+    def check_profile(self, graph, profile_dir):
+        profile = graph.run_metrics.profile
+        self.assertEqual(profile.executions,
+                         {'seed': 1, 'crunch': 1, 'report': 1})
+        label, calls, own_s, cumulative_s = profile.top('crunch')[0]
+        self.assertTrue(label.startswith("fib ("))
+        self.assertEqual(calls, 1973)
+        # Neither of the handlers shows up in the captures
+        self.assertFalse([row for row in profile.top('crunch')
+                          if 'cprofiler.py' in row[0]])
+
+        with open(os.path.join(profile_dir, "profile_test.collapsed")) as fp:
+            stacks = [line.rsplit(' ', 1)[0] for line in fp]
+        self.assertTrue(any(
+            stack.startswith("crunch;crunch (") and "fib (" in stack
+            for stack in stacks))
+        self.assertTrue(os.path.isfile(
+            os.path.join(profile_dir, "profile_test.top.txt")))
+
+    def test_serial(self):
+        graph = self.run_graph(BackendType.LOCAL_NON_THREADED,
+                               {'profile_dir': "profiles"})
+        self.check_profile(graph, "profiles")
+
+    def test_hybrid_process(self):
+        # Captures are taken in the task processes and shipped back with
+        # their usage
+        graph = self.run_graph(BackendType.LOCAL_HYBRID, {
+            'default_executor': 'process',
+            'profile_dir': "profiles",
+        })
+        self.check_profile(graph, "profiles")
+
+    def test_tcp(self):
+        graph = self.run_graph(BackendType.TCP, {'num_workers': 2})
+        self.check_profile(graph, ".")
+
+    def test_opt_in(self):
+        # Enabling all the handlers leaves out the opt in ones
+        self.assertEqual(HandlerRegistry.select(True), ((), ()))
+        self.assertEqual(HandlerRegistry.select_opt_in(True), False)
+        self.assertEqual(HandlerRegistry.select_opt_in('cprofile'),
+                         ("CProfileEntry", "CProfileExit"))
+
+        graph = self.run_graph(BackendType.LOCAL_HYBRID, {}, handlers=True)
+        self.assertEqual(len(graph.run_metrics.profile), 0)
+        self.assertFalse(os.path.isfile("profile_test.collapsed"))
+
+    def test_merge(self):
+        profile = RunProfile("merge_test")
+        for _ in range(2):
+            profile.add({
+                'task': 'load',
+                'stacks': {"load (a.py:1)": 0.5,
+                           "load (a.py:1);parse (a.py:9)": 1.0},
+                'functions': {"load (a.py:1)": [1, 0.5, 1.5],
+                              "parse (a.py:9)": [3, 1.0, 1.0]},
+            })
+
+        self.assertEqual(profile.executions, {'load': 2})
+        self.assertEqual(profile.top('load', 1),
+                         [("parse (a.py:9)", 6, 2.0, 2.0)])
+        fp = io.StringIO()
+        profile.write_collapsed(fp)
+        self.assertEqual(fp.getvalue().splitlines(), [
+            "load;load (a.py:1) 1000000",
+            "load;load (a.py:1);parse (a.py:9) 2000000",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
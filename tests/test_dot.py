@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import add
+from common import add_task
+from common import inc
+from common import split
+from common import square
+from dot import DotGraphGenerator
+from fusion import Fusion
+from local import LocalNonThreadedBackend
+from passes import PassContext
+from tasks import PreProcess
+from tasks import TaskGraph
+
+
+class DotGraphGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+
+        self.graph = TaskGraph()
+        self.graph.reset()
+        self.graph.name = "dot_test"
+        lo, hi = add_task(self.graph, split, 3)
+        left = add_task(self.graph, inc, add_task(self.graph, square, lo))
+        add_task(self.graph, add, left, add_task(self.graph, square, hi))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_passes(self, ctx):
+        for p in [
+                PreProcess("pre"),
+                DotGraphGenerator("dot", "before"),
+                Fusion("fuse"),
+                DotGraphGenerator("dot", "after")
+        ]:
+            p.run(self.graph, ctx)
+
+    def test_disabled_by_default(self):
+        self.run_passes(PassContext())
+        self.assertFalse(os.path.exists("dot_test-before.dot"))
+        self.assertFalse(os.path.exists("dot_test-after.dot"))
+
+    def test_fused_tasks_are_clustered(self):
+        self.run_passes(PassContext({'dot': True}))
+
+        with open("dot_test-before.dot") as fp:
+            before = fp.read()
+        self.assertNotIn("subgraph", before)
+        # Both square tasks are drawn even though they share a name
+        self.assertEqual(before.count('label="square"'), 2)
+        self.assertEqual(before.count("->"), 5)
+
+        with open("dot_test-after.dot") as fp:
+            after = fp.read().splitlines()
+        start = after.index("subgraph cluster0 {")
+        end = after.index("}", start)
+        cluster = "\n".join(after[start:end])
+        self.assertIn('label="square"', cluster)
+        self.assertIn('label="inc"', cluster)
+        self.assertEqual(sum(1 for line in after if "->" in line), 5)
+        self.assertEqual(sum(1 for line in after if "label=" in line and
+                             "->" not in line), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
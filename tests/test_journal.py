@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import add_task
+from journal import RunJournal
+from local import LocalNonThreadedBackend
+from passes import PassContext
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+
+ran = []
+fail = set()
+
+
+def split(n) -> (int, int):
+    ran.append('split')
+    return (n, n * 10)
+
+
+def square(x) -> int:
+    ran.append('square')
+    if x in fail:
+        raise Exception("Failing on {}".format(x))
+    return x * x
+
+
+def add(a, b) -> int:
+    ran.append('add')
+    return a + b
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+        ran.clear()
+        fail.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_graph(self, resume):
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "journal_test"
+        lo, hi = add_task(graph, split, 3)
+        total = add_task(graph, add, add_task(graph, square, lo),
+                         add_task(graph, square, hi))
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+
+        journal = RunJournal("journal", graph)
+        if resume:
+            journal.open()
+            journal.resume(graph)
+        else:
+            journal.start()
+        graph.journal = journal
+        Backend.get_current_backend().run_flow(graph)
+        return (journal, total)
+
+    def test_resume_runs_remaining_tasks(self):
+        fail.add(30)
+        journal, _ = self.run_graph(False)
+        self.assertEqual(len(journal.entries), 2)
+        self.assertNotIn('add', ran)
+
+        ran.clear()
+        fail.clear()
+        journal, total = self.run_graph(True)
+        self.assertEqual(sorted(ran), ['add', 'square'])
+        self.assertEqual(journal.load(journal.keys[total.id]), 909)
+
+    def test_resume_completed_run(self):
+        self.run_graph(False)
+        ran.clear()
+        self.run_graph(True)
+        self.assertEqual(ran, [])
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
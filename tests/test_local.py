@@ -0,0 +1,263 @@
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from accounting import ResourceMeter
+from accounting import merge
+from history import TaskHistory
+from local import LocalHybridBackend
+from metrics import RunMetrics
+from passes import PassContext
+from tasks import gen_task
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+
+lock = threading.Lock()
+running = [0, 0]  # Tasks running now and the most seen running at once
+
+
+def source(n) -> int:
+    return n
+
+
+def work(x) -> int:
+    with lock:
+        running[0] += 1
+        running[1] = max(running[1], running[0])
+    time.sleep(0.05)
+    with lock:
+        running[0] -= 1
+    return x
+
+
+def straggle(x) -> int:
+    # The first copy to run straggles
+    try:
+        os.close(os.open("started", os.O_CREAT | os.O_EXCL))
+        time.sleep(30)
+    except FileExistsError:
+        pass
+    return x + 1
+
+
+def add_task(graph, fn, args, **configs):
+    task, tasklets = gen_task(fn, inspect.signature(fn), args, {}, configs)
+    graph.add_task(task)
+    return task
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        running[:] = [0, 0]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_fan_out(self, options, mem):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid", options))
+        backend = Backend.get_current_backend()
+
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "admission_test"
+        root = add_task(graph, source, (1, ), executor='inline')
+        for _ in range(6):
+            add_task(graph, work, (root, ), executor='thread', mem=mem)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        backend.run_flow(graph)
+        return backend
+
+    def test_unbounded_without_budget(self):
+        self.run_fan_out({}, "100M")
+        self.assertEqual(running[1], 6)
+
+    def test_admits_within_budget(self):
+        backend = self.run_fan_out({'mem_budget': "250M"}, "100M")
+        self.assertEqual(running[1], 2)
+        self.assertEqual(backend.mem_peak, 200 * 1024**2)
+        self.assertEqual(backend.mem_in_use, 0)
+        self.assertTrue(os.path.isfile(".kisseru_history.json"))
+
+    def test_backend_reused(self):
+        backend = self.run_fan_out({'mem_budget': "250M"}, "100M")
+        backend.errors.append("left over from the previous run")
+        backend.mem_peak = 1024**3
+
+        TaskGraph().reset()
+        graph = TaskGraph()
+        graph.name = "admission_test"
+        root = add_task(graph, source, (1, ), executor='inline')
+        add_task(graph, work, (root, ), executor='thread', mem="100M")
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, PassContext())
+        backend.run_flow(graph)
+
+        # Only this run's tasks and reservations are accounted for
+        self.assertEqual(backend.errors, [])
+        self.assertEqual(backend.mem_peak, 100 * 1024**2)
+        self.assertEqual(len(backend.dispatched), 2)
+
+    def test_oversized_tasks_run_one_at_a_time(self):
+        self.run_fan_out({'mem_budget': "50M"}, "100M")
+        self.assertEqual(running[1], 1)
+
+    def test_history(self):
+        history = TaskHistory("history.json", max_samples=2)
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid"))
+        task = gen_task(work, inspect.signature(work), (1, ), {})[0]
+        for value in [10, 30, 20]:
+            history.record(task, 'peak_rss', value)
+        history.save()
+
+        loaded = TaskHistory("history.json")
+        self.assertEqual(loaded.get(task, 'peak_rss'), [30, 20])
+        self.assertEqual(loaded.peak(task, 'peak_rss'), 30)
+        self.assertEqual(loaded.median(task, 'peak_rss'), 25)
+
+
+class SpeculationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def test_straggler_gets_duplicated(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid", {
+                'speculate': True,
+                'speculation_min': 0.2,
+                'metrics_file': "metrics.json"
+            }))
+        backend = Backend.get_current_backend()
+
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "speculation_test"
+        root = add_task(graph, source, (1, ), executor='inline')
+        add_task(graph, straggle, (root, ), executor='process',
+                 idempotent=True)
+        for task in list(graph.tasks.values()):
+            backend.history.record(task, 'duration', 0.01)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+
+        start = time.time()
+        backend.run_flow(graph)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(graph.run_metrics.counters, {
+            'speculative_launches': 1,
+            'speculative_backup_won': 1
+        })
+        self.assertTrue(os.path.isfile("metrics.json"))
+
+
+class ResourceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def test_meter(self):
+        with ResourceMeter(per_thread=True) as meter:
+            sum(i * i for i in range(200000))
+            with open("out", 'w') as fp:
+                fp.write("k" * 4096)
+        usage = meter.usage
+        self.assertGreater(usage['cpu_user_s'] + usage['cpu_sys_s'], 0)
+        self.assertGreater(usage['duration'], 0)
+        self.assertGreaterEqual(usage['peak_rss'], 0)
+        if 'write_bytes' in usage:
+            self.assertGreaterEqual(usage['write_bytes'], 4096)
+
+    def test_merge(self):
+        total = merge({}, {'cpu_user_s': 1.0, 'peak_rss': 10, 'bytes_in': 5})
+        merge(total, {'cpu_user_s': 2.0, 'peak_rss': 4, 'bytes_in': 1})
+        self.assertEqual(total, {'cpu_user_s': 3.0, 'peak_rss': 10,
+                                 'bytes_in': 6})
+
+    def test_resource_table(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid"))
+        graph = TaskGraph()
+        graph.reset()
+        first = add_task(graph, work, (1, ))
+        second = add_task(graph, work, (2, ))
+
+        metrics = RunMetrics("resource_test", "Local Hybrid")
+        metrics.record_usage(first, {'cpu_user_s': 1.0, 'peak_rss': 300})
+        metrics.record_usage(second, {'cpu_user_s': 0.5, 'peak_rss': 500},
+                             executor='thread')
+        self.assertEqual(metrics.resource_table(), {
+            'work': {'executions': 2, 'cpu_user_s': 1.5, 'peak_rss': 500}
+        })
+
+        # Doesn't block on the lock the table takes
+        data = metrics.to_dict()
+        self.assertEqual(len(data['resources']), 2)
+        self.assertEqual(data['resource_table']['work']['executions'], 2)
+        self.assertTrue(any(line.startswith("work ")
+                            for line in metrics.report()))
+        metrics.dump("metrics.json")
+
+    def test_run_records_usage(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid",
+                          {'metrics_file': "metrics.json"}))
+        backend = Backend.get_current_backend()
+
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "resource_test"
+        root = add_task(graph, source, (1, ), executor='inline')
+        add_task(graph, work, (root, ), executor='thread')
+        add_task(graph, work, (root, ), executor='process')
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        backend.run_flow(graph)
+
+        with open("metrics.json") as fp:
+            table = json.load(fp)['resource_table']
+        self.assertEqual(table['source']['executions'], 1)
+        self.assertEqual(table['work']['executions'], 2)
+        # Only the result of the process task got pickled
+        self.assertGreater(table['work']['bytes_out'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
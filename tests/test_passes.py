@@ -0,0 +1,143 @@
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import inc
+from common import square
+from fusion import Fusion
+from handler import Handler
+from handler import HandlerRegistry
+from local import LocalNonThreadedBackend
+from passes import CompileStats
+from passes import PassContext
+from specialize import Specialize
+from tasks import gen_task
+from tasks import PreProcess
+from tasks import TaskGraph
+
+
+class CompileStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        # Graph state is shared across graph instances
+        TaskGraph().reset()
+
+    def test_records_graph_changes_per_pass(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+
+        stats = CompileStats(trace_memory=True)
+        stats.start()
+
+        step = stats.begin("App Specification")
+        graph = TaskGraph()
+        graph.reset()
+        parent = None
+        for fn in [square, inc, square]:
+            args = (parent, ) if parent else (2, )
+            parent, _ = gen_task(fn, inspect.signature(fn), args, {})
+            graph.add_task(parent)
+        stats.end(step, graph)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Fusion("fuse")]:
+            step = stats.begin(p.name, p.tag, graph)
+            p.run(graph, ctx)
+            stats.end(step, graph)
+        stats.finish()
+
+        spec, pre, fuse = stats.steps
+        self.assertEqual((spec.tasks_before, spec.tasks_after), (0, 3))
+        self.assertEqual((spec.edges_before, spec.edges_after), (0, 2))
+        # The chain gets fused in to a single executable unit
+        self.assertEqual((fuse.units_before, fuse.units_after), (3, 1))
+        self.assertEqual(fuse.tasks_after, 4)
+        self.assertIsNotNone(fuse.mem_peak_bytes)
+        self.assertGreaterEqual(stats.total_s, fuse.wall_s)
+
+        out_file = os.path.join(self.tmp_dir, "stats.json")
+        stats.dump(out_file)
+        with open(out_file) as fp:
+            dumped = json.load(fp)
+        self.assertEqual([s['name'] for s in dumped['steps']],
+                         ["App Specification", "pre", "fuse"])
+
+
+calls = []
+
+
+class Recorder(Handler):
+    def run(self, ctx):
+        calls.append(self.name)
+
+
+class SpecializeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handlers = (HandlerRegistry.pre_handlers,
+                         HandlerRegistry.post_handlers)
+        HandlerRegistry.pre_handlers = [Recorder("TraceIn", "trace"),
+                                        Recorder("ProfIn", "profile")]
+        HandlerRegistry.post_handlers = [Recorder("TraceOut", "trace")]
+        calls.clear()
+
+    def tearDown(self):
+        HandlerRegistry.pre_handlers, HandlerRegistry.post_handlers = \
+            self.handlers
+        TaskGraph().reset()
+
+    def run_task(self, enabled, **configs):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+        graph = TaskGraph()
+        graph.reset()
+        task, _ = gen_task(square, inspect.signature(square), (3, ), {},
+                           configs)
+        graph.add_task(task)
+        Specialize("specialize").run(graph, PassContext(
+            {'handlers': enabled}))
+        self.assertEqual(task._runner(x=3), 9)
+        return task
+
+    def test_select(self):
+        pre, post = HandlerRegistry.select('trace')
+        self.assertEqual([h.name for h in pre + post],
+                         ["TraceIn", "TraceOut"])
+        self.assertEqual(HandlerRegistry.select(False), ((), ()))
+
+    def test_all_enabled(self):
+        self.run_task(True)
+        self.assertEqual(calls, ["TraceIn", "ProfIn", "TraceOut"])
+
+    def test_run_option(self):
+        task = self.run_task(False)
+        self.assertEqual(calls, [])
+        self.assertFalse(task._runner.handlers)
+
+        calls.clear()
+        self.run_task(['profile'])
+        self.assertEqual(calls, ["ProfIn"])
+
+    def test_task_and_run_selections(self):
+        # Only the handlers enabled for both run
+        self.run_task(['profile', 'trace'], handlers='trace')
+        self.assertEqual(calls, ["TraceIn", "TraceOut"])
+
+        calls.clear()
+        self.run_task('profile', handlers='trace')
+        self.assertEqual(calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
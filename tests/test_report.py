@@ -0,0 +1,141 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import add_task
+from local import LocalHybridBackend
+from passes import PassContext
+from report import RunReport
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+
+
+def source(n) -> int:
+    return n
+
+
+def nap(x, secs) -> int:
+    time.sleep(secs)
+    return x
+
+
+def add(a, b) -> int:
+    return a + b
+
+
+def execution(tid, start, end):
+    return {'task': tid, 'tid': tid, 'start': start, 'end': end,
+            'duration': end - start}
+
+
+# a -> b -> d and a -> c -> d with c the longer branch. e runs on its own
+# after an idle spell.
+METRICS = {
+    'graph': "diamond",
+    'backend': "Local Hybrid",
+    'total_s': 5.0,
+    'topology': {
+        'units': {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd', 'e': 'e'},
+        'edges': [['a', 'b'], ['a', 'c'], ['b', 'd'], ['c', 'd']],
+    },
+    'resources': [
+        execution('a', 0.0, 1.0),
+        execution('b', 1.0, 1.5),
+        execution('c', 1.0, 3.0),
+        # d got dispatched late
+        execution('d', 3.5, 4.0),
+        execution('e', 4.5, 5.0),
+    ],
+}
+
+
+class RunReportTestCase(unittest.TestCase):
+    def test_critical_path(self):
+        report = RunReport(METRICS)
+        self.assertEqual([unit.name for unit in report.critical_path()],
+                         ['a', 'c', 'd'])
+        self.assertAlmostEqual(report.makespan, 3.5)
+        self.assertAlmostEqual(report.units['b'].slack, 1.5)
+        self.assertAlmostEqual(report.units['c'].slack, 0.0)
+        # e is off the path and can start as late as the path allows
+        self.assertAlmostEqual(report.units['e'].slack, 3.0)
+
+    def test_parallelism_and_gaps(self):
+        report = RunReport(METRICS)
+        self.assertEqual(max(running for at, running in
+                             report.parallelism()), 2)
+        self.assertAlmostEqual(report.average_parallelism(), 4.5 / 5.0)
+        self.assertEqual(report.idle_gaps(), [(3.0, 3.5), (4.0, 4.5)])
+        gaps = report.scheduler_gaps()
+        self.assertEqual([(unit.name, round(delay, 3))
+                          for unit, delay in gaps], [('d', 0.5)])
+
+    def test_outputs(self):
+        report = RunReport(METRICS)
+        text = "\n".join(report.text())
+        self.assertIn("Critical path : 3.500s over 3 units", text)
+        self.assertIn("<li>d waited 0.500s</li>", report.html())
+
+        fp = io.StringIO()
+        report.write_dot(fp)
+        dot = fp.getvalue()
+        self.assertTrue(dot.startswith("digraph diamond {"))
+        self.assertEqual(dot.count("color=red penwidth=2"), 2)
+
+    def test_no_topology(self):
+        with self.assertRaises(Exception):
+            RunReport({'resources': []})
+
+
+class RecordedRunTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def test_hybrid_run(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Local Hybrid",
+                          {'metrics_file': "metrics.json",
+                           'default_executor': 'thread'}))
+        backend = Backend.get_current_backend()
+
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "report_test"
+        root = add_task(graph, source, 1)
+        fast = add_task(graph, nap, root, 0.01)
+        slow = add_task(graph, nap, root, 0.2)
+        add_task(graph, add, fast, slow)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        backend.run_flow(graph)
+
+        report = RunReport.load("metrics.json")
+        path = [unit.name for unit in report.critical_path()]
+        self.assertEqual(path, ['source', 'nap', 'add'])
+        slow_unit = report.units[str(slow.id)]
+        fast_unit = report.units[str(fast.id)]
+        self.assertTrue(slow_unit.critical)
+        self.assertGreater(fast_unit.slack, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
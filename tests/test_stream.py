@@ -0,0 +1,121 @@
+import inspect
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from local import LocalHybridBackend
+from local import LocalNonThreadedBackend
+from passes import PassContext
+from stream import Stream
+from stream import pump
+from tasks import gen_task
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+
+lock = threading.Lock()
+events = []
+results = []
+
+
+def record(event):
+    with lock:
+        events.append(event)
+
+
+def extract(n) -> int:
+    for i in range(n):
+        record(('extract', i))
+        yield i
+    record(('extract', 'done'))
+
+
+def evens(xs) -> int:
+    for x in xs:
+        if x % 2 == 0:
+            yield x
+
+
+def total(xs) -> int:
+    result = 0
+    for x in xs:
+        record(('total', x))
+        result += x
+    results.append(result)
+    return result
+
+
+def add_task(graph, fn, args, **configs):
+    task, tasklets = gen_task(fn, inspect.signature(fn), args, {}, configs)
+    graph.add_task(task)
+    return task
+
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        events.clear()
+        results.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_pipeline(self, backend_type, options=None):
+        Backend.set_current_backend(
+            BackendConfig(backend_type, "Streaming", options))
+        backend = Backend.get_current_backend()
+
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "stream_test"
+        source = add_task(graph, extract, (20, ), buffer=2)
+        evens_task = add_task(graph, evens, (source, ))
+        add_task(graph, total, (evens_task, ))
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        backend.run_flow(graph)
+
+    def test_stages_overlap(self):
+        self.run_pipeline(BackendType.LOCAL_HYBRID, {'stream_buffer': 2})
+        self.assertEqual(results, [90])
+        # Aggregation starts before extraction is done and the bounded
+        # buffers keep extraction from getting far ahead of it
+        self.assertLess(events.index(('total', 0)),
+                        events.index(('extract', 'done')))
+        self.assertLess(events.index(('total', 4)),
+                        events.index(('extract', 19)))
+
+    def test_materialized_without_streaming(self):
+        self.run_pipeline(BackendType.LOCAL_NON_THREADED)
+        self.assertEqual(results, [90])
+        self.assertGreater(events.index(('total', 0)),
+                           events.index(('extract', 'done')))
+
+    def test_cancelled_consumer_unblocks_producer(self):
+        stream = Stream("producer", buffer=1)
+        reader = iter(stream)
+        thread = threading.Thread(target=pump,
+                                  args=(iter(range(100)), [stream]))
+        thread.start()
+        self.assertEqual(next(reader), 0)
+        stream.cancel()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
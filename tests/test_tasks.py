@@ -0,0 +1,284 @@
+import inspect
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from batching import Batching
+from common import add
+from common import add_task
+from common import split
+from common import square
+from fusion import Fusion
+from local import LocalHybridBackend
+from local import LocalNonThreadedBackend
+from local import LocalThreadedBackend
+from passes import PassContext
+from tasks import gen_map_task
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+
+
+def discover(n) -> list:
+    return list(range(n))
+
+
+def scale(x, factor) -> int:
+    return x * factor
+
+
+def wide(n) -> (int, int, int, int, int, int, int, int, int, int, int, int):
+    return tuple(range(n, n + 12))
+
+
+results = []
+
+
+def collect(values) -> list:
+    results.append(values)
+    return values
+
+
+def vadd(a, b) -> int:
+    return [x + y for x, y in zip(a, b)]
+
+
+class ReleaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def test_inputs_released_after_run(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "release_test"
+        lo, hi = add_task(graph, split, 3)
+        total = add_task(graph, add, add_task(graph, square, lo),
+                         add_task(graph, square, hi))
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        Backend.get_current_backend().run_flow(graph)
+
+        for tid, task in graph.tasks.items():
+            for name, inport in task.inputs.items():
+                if inport.is_immediate:
+                    # Immediate arguments are part of the task
+                    self.assertIn(name, task._args)
+                else:
+                    self.assertNotIn(name, task._args)
+
+    def test_transfer_file_released(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL, "Local Threaded"))
+        graph = TaskGraph()
+        graph.reset()
+        parent = add_task(graph, square, 3)
+        child = add_task(graph, square, parent)
+
+        inport = child.inputs['x']
+        filename = "{}_x".format(child.id)
+        with open(filename, "w") as fp:
+            fp.write("value")
+        inport.release()
+        self.assertFalse(os.path.exists(filename))
+
+
+class MapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        results.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_map(self, backend_type, options=None):
+        Backend.set_current_backend(
+            BackendConfig(backend_type, "Map", options))
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "map_test"
+        items = add_task(graph, discover, 6)
+        scaled, _ = gen_map_task(scale, inspect.signature(scale), items, (),
+                                 {'factor': 3})
+        graph.add_task(scaled)
+        add_task(graph, collect, scaled)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), PostProcess("post")]:
+            p.run(graph, ctx)
+        Backend.get_current_backend().run_flow(graph)
+
+    def test_map_serial(self):
+        self.run_map(BackendType.LOCAL_NON_THREADED)
+        self.assertEqual(results, [[0, 3, 6, 9, 12, 15]])
+
+    def test_map_hybrid(self):
+        self.run_map(BackendType.LOCAL_HYBRID,
+                     {'default_executor': 'thread'})
+        self.assertEqual(results, [[0, 3, 6, 9, 12, 15]])
+
+    def test_many_outputs(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Serial"))
+        graph = TaskGraph()
+        graph.reset()
+        outs = add_task(graph, wide, 1)
+        self.assertEqual(len(outs), 12)
+        self.assertEqual(outs[11].out_slot_in_parent, 11)
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        results.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_batch(self, backend_type, fn, batch, vectorized=False,
+                  options=None):
+        Backend.set_current_backend(
+            BackendConfig(backend_type, "Batch", options))
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "batch_test"
+        for i in range(5):
+            out = add_task(graph, fn, i, 10 * i, batch=batch,
+                           vectorized=vectorized)
+            add_task(graph, collect, out)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Batching("batch"), Fusion("fuse"),
+                  PostProcess("post")]:
+            p.run(graph, ctx)
+        Backend.get_current_backend().run_flow(graph)
+        return graph
+
+    def test_batch_serial(self):
+        graph = self.run_batch(BackendType.LOCAL_NON_THREADED, add, 2)
+        # Two batches of two, four collectors and the lone task fused with
+        # its collector
+        self.assertEqual(graph.num_tasks, 7)
+        self.assertEqual(sorted(results), [0, 11, 22, 33, 44])
+
+    def test_batch_hybrid(self):
+        self.run_batch(BackendType.LOCAL_HYBRID, add, 2,
+                       options={'default_executor': 'thread'})
+        self.assertEqual(sorted(results), [0, 11, 22, 33, 44])
+
+    def test_vectorized(self):
+        graph = self.run_batch(BackendType.LOCAL_NON_THREADED, vadd, 3,
+                               vectorized=True)
+        # The lone remaining instance gets a batch of its own
+        self.assertEqual(graph.num_tasks, 7)
+        self.assertEqual(sorted(results), [0, 11, 22, 33, 44])
+
+
+class FusionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        results.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def run_chain(self, length, **configs):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_NON_THREADED, "Fusion"))
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "fusion_test"
+        lo, hi = add_task(graph, split, 1)
+        value = lo
+        for i in range(length):
+            value = add_task(graph, scale, value, 1, **configs)
+        value = add_task(graph, add, value, hi, **configs)
+        add_task(graph, collect, value)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Fusion("fuse"), PostProcess("post")]:
+            p.run(graph, ctx)
+        Backend.get_current_backend().run_flow(graph)
+        return graph
+
+    def test_generated_chain(self):
+        graph = self.run_chain(5)
+        self.assertEqual(results, [11])
+        # split, the scale chain and add fused with collect
+        self.assertEqual(graph.num_tasks, 3)
+        fused = [task for tid, task in graph.tasks.items()
+                 if task.is_fused]
+        self.assertIsNotNone(fused[0]._runner)
+
+    def test_long_chain(self):
+        # Members get called directly and the chain runs without recursing
+        # through the ports
+        self.run_chain(2000, handlers=False)
+        self.assertEqual(results, [11])
+
+    def test_mixed_executors(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL_HYBRID, "Fusion",
+                          {'default_executor': 'thread'}))
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "fusion_test"
+        value = add_task(graph, scale, 1, 2, executor='thread')
+        value = add_task(graph, scale, value, 3, executor='thread')
+        value = add_task(graph, scale, value, 5, executor='process')
+        value = add_task(graph, scale, value, 7, executor='process')
+        add_task(graph, collect, value)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Fusion("fuse"), PostProcess("post")]:
+            p.run(graph, ctx)
+
+        # Chains break where the executor changes
+        fused = [task for tid, task in graph.tasks.items() if task.is_fused]
+        self.assertEqual(
+            sorted([member.executor for member in task.tasks]
+                   for task in fused),
+            [['process', 'process'], ['thread', 'thread']])
+        self.assertEqual(graph.num_tasks, 3)
+
+        backend = Backend.get_current_backend()
+        try:
+            backend.run_flow(graph)
+        finally:
+            backend.cleanup(graph)
+        self.assertEqual(results, [210])
+        table = graph.run_metrics.resource_table()
+        self.assertEqual(table['scale__scale']['executions'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import add
+from common import add_task
+from common import inc
+from common import split
+from common import square
+from fusion import Fusion
+from local import LocalNonThreadedBackend
+from tasks import PreProcess
+from tasks import PostProcess
+from tasks import TaskGraph
+from passes import PassContext
+from tcp import TcpBackend
+from tcp import ValueStore
+
+
+class TcpBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run_flow_with_local_workers(self):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.TCP, "Tcp", {
+                'num_workers': 3,
+                'spread_bytes': 0
+            }))
+        backend = Backend.get_current_backend()
+
+        graph = TaskGraph()
+        graph.reset()
+        graph.name = "tcp_test"
+        lo, hi = add_task(graph, split, 3)
+        # inc(square(...)) gets fused in to a single unit
+        left = add_task(graph, inc, add_task(graph, square, lo))
+        right = add_task(graph, square, hi)
+        total = add_task(graph, add, left, right)
+
+        ctx = PassContext()
+        for p in [PreProcess("pre"), Fusion("fuse"), PostProcess("post")]:
+            p.run(graph, ctx)
+
+        try:
+            backend.run_flow(graph)
+        finally:
+            backend.cleanup(graph)
+
+        self.assertEqual(backend.outputs[total.id], 3 * 3 + 1 + 30 * 30)
+        # Consumers got placed next to their inputs. So no value had to move
+        # between workers.
+        self.assertEqual(backend.planner.bytes_moved(), 0)
+        decisions = {d.task: d for d in backend.planner.decisions}
+        self.assertEqual(len(decisions), 4)
+        self.assertEqual(decisions['split'].reason, "least loaded")
+        self.assertEqual(decisions['square__inc'].reason,
+                         "co-located with inputs")
+        self.assertEqual(decisions['square__inc'].bytes_moved, 0)
+        self.assertEqual(decisions['square__inc'].address,
+                         decisions['split'].address)
+
+        # Workers sent back the usage of each unit along with the bytes of
+        # the values it pulled and published
+        table = graph.run_metrics.resource_table()
+        self.assertEqual(set(table), set(decisions))
+        self.assertGreater(table['add']['bytes_in'], 0)
+        self.assertGreater(table['split']['bytes_out'], 0)
+
+    def test_value_store_drops_consumed_values(self):
+        store = ValueStore()
+        store.put("t:0", b"value", 2)
+        self.assertEqual(store.take("t:0"), b"value")
+        self.assertEqual(store.size(), 5)
+        self.assertEqual(store.take("t:0"), b"value")
+        # Last consumer pulled the value
+        self.assertIsNone(store.get("t:0"))
+        self.assertEqual(store.size(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,163 @@
+import importlib.util
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+# append parent directory to import path
+import env
+
+from backend import Backend
+from backend import BackendConfig
+from backend import BackendType
+from common import add_task
+from common import square
+from local import LocalThreadedBackend
+from tasks import TaskGraph
+from transfer import CodecRegistry
+from transfer import MAGIC
+from transfer import dump
+from transfer import load
+from transfer import read
+from transfer import remove_shared
+from transfer import write
+
+
+def header(data):
+    # (serializer, codec) named by the header of a transfer file. None for
+    # plain pickles.
+    if not data.startswith(MAGIC):
+        return None
+    offset = len(MAGIC)
+    names = []
+    for _ in range(2):
+        length = data[offset]
+        names.append(data[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+    return tuple(names)
+
+
+class CodecTestCase(unittest.TestCase):
+    def round_trip(self, value, spec, min_size=0):
+        fp = io.BytesIO()
+        dump(value, fp, spec, min_size=min_size)
+        data = fp.getvalue()
+        self.assertEqual(load(io.BytesIO(data)), value)
+        return data
+
+    def test_codecs(self):
+        value = ["kisseru"] * 1000
+        for name in CodecRegistry.codecs:
+            data = self.round_trip(value, name)
+            self.assertEqual(header(data), ('pickle', name))
+        self.assertEqual(header(self.round_trip(value, 'lzma:1')),
+                         ('pickle', 'lzma'))
+
+    def test_uncompressed(self):
+        self.assertIsNone(header(self.round_trip([1, 2, 3], None)))
+
+    def test_auto(self):
+        # Repetitive values get compressed while random bytes and small
+        # values don't
+        self.assertNotEqual(header(self.round_trip(b"a" * 100000,
+                                                   'auto'))[1], "")
+        self.assertEqual(header(self.round_trip(os.urandom(100000), 'auto')),
+                         ('bytes', ""))
+        self.assertIsNone(header(self.round_trip([1] * 100, 'auto',
+                                                 min_size=1024)))
+
+    def test_serializers(self):
+        self.assertEqual(header(self.round_trip("kisseru", None)),
+                         ('str', ""))
+        self.assertEqual(header(self.round_trip(b"kisseru", 'zlib')),
+                         ('bytes', 'zlib'))
+        # Subclasses and other values get pickled
+        self.assertIsNone(header(self.round_trip(bytearray(b"k"), None)))
+        self.assertIsNone(header(self.round_trip({'a': 1}, None)))
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), "needs numpy")
+    def test_array(self):
+        import numpy
+        array = numpy.arange(1000, dtype=numpy.float64).reshape(10, 100)
+        fp = io.BytesIO()
+        dump(array, fp, 'zlib')
+        self.assertEqual(header(fp.getvalue()), ('npy', 'zlib'))
+        self.assertTrue((load(io.BytesIO(fp.getvalue())) == array).all())
+
+    def test_unknown_codec(self):
+        with self.assertRaises(Exception):
+            self.round_trip([1], 'nope')
+
+
+class PortTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+        TaskGraph().reset()
+
+    def transfer(self, options, **configs):
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL, "Local Threaded", options))
+        graph = TaskGraph()
+        graph.reset()
+        parent = add_task(graph, square, 3, **configs)
+
+        write(parent.outputs['0'], 12, "transfer")
+        with open("transfer", 'rb') as fp:
+            compressed = fp.read().startswith(MAGIC)
+        self.assertEqual(read("transfer"), 12)
+        return compressed
+
+    def test_backend_option(self):
+        self.assertTrue(self.transfer({'compress': 'zlib'}))
+        self.assertFalse(self.transfer({}))
+
+    def test_type_option(self):
+        self.assertTrue(self.transfer({'compress_types': {'int': 'bz2'}}))
+        self.assertFalse(self.transfer({'compress_types': {'str': 'bz2'}}))
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), "needs numpy")
+    def test_shared_array(self):
+        import numpy
+        Backend.set_current_backend(
+            BackendConfig(BackendType.LOCAL, "Local Threaded",
+                          {'mmap_arrays': True, 'mmap_min_size': 0}))
+        graph = TaskGraph()
+        graph.reset()
+        parent = add_task(graph, square, 3)
+        child = add_task(graph, square, parent)
+        writer = add_task(graph, square, parent, copy_arrays=True)
+
+        array = numpy.arange(100)
+        outport = parent.outputs['0']
+        write(outport, array, "a")
+        write(outport, array, "b")
+        self.assertEqual(header(open("a", 'rb').read())[0], 'mmap')
+
+        # Both consumers map the one array written
+        mapped = read("a", child.inputs['x'])
+        self.assertIsInstance(mapped, numpy.memmap)
+        self.assertTrue((mapped == array).all())
+        with self.assertRaises(ValueError):
+            mapped[0] = 1
+        copied = read("b", writer.inputs['x'])
+        copied[0] = 1
+        self.assertEqual(read("a", child.inputs['x'])[0], 0)
+
+        remove_shared(parent)
+        self.assertEqual([f for f in os.listdir(".")
+                          if f.endswith(".npy")], [])
+
+    def test_task_config(self):
+        self.assertFalse(self.transfer({'compress': 'zlib'}, compress='none'))
+        self.assertTrue(self.transfer({}, compress={'0': 'lzma'}))
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests